@@ -0,0 +1,98 @@
+# dispatch_bench.py
+"""
+对比 batch-subscribe 旧的线性扫描与 ChatDispatcher 的单条消息分发耗时。
+
+    python -m benchmarks.dispatch_bench
+"""
+import asyncio
+import random
+import time
+
+from telethon import utils
+from telethon.tl.types import Channel, ChatPhotoEmpty
+
+from core.dispatch import ChatDispatcher
+
+CHAT_COUNTS = (10, 100, 1000, 10000)
+EVENTS = 20000
+
+
+class FakeEvent:
+    __slots__ = ('chat_id',)
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+
+
+class FakeClient:
+    def __init__(self):
+        self.handlers = []
+
+    def add_event_handler(self, callback, event=None):
+        self.handlers.append(callback)
+
+
+def make_entities(count):
+    return {
+        f"@chat{i}": Channel(id=1000000 + i, title=f"chat{i}", photo=ChatPhotoEmpty(), date=None, access_hash=i)
+        for i in range(count)
+    }
+
+
+async def bench_linear(entities, events):
+    """旧实现：每条消息遍历全部已订阅聊天"""
+    hits = 0
+
+    async def handler(event):
+        nonlocal hits
+        chat_name = None
+        for name, entity in entities.items():
+            if entity.id == event.chat_id:
+                chat_name = name
+                break
+        if chat_name:
+            hits += 1
+
+    started = time.perf_counter()
+    for event in events:
+        await handler(event)
+    return time.perf_counter() - started, hits
+
+
+async def bench_dispatch(entities, events):
+    hits = 0
+    dispatcher = ChatDispatcher()
+    for name, entity in entities.items():
+        dispatcher.add(name, entity)
+
+    async def on_message(event, chat):
+        nonlocal hits
+        hits += 1
+
+    client = FakeClient()
+    dispatcher.register(client, None, on_message)
+    handler = client.handlers[0]
+
+    started = time.perf_counter()
+    for event in events:
+        await handler(event)
+    return time.perf_counter() - started, hits
+
+
+async def main():
+    print(f"{'chats':>8}{'linear us/msg':>16}{'dispatch us/msg':>18}")
+    for count in CHAT_COUNTS:
+        entities = make_entities(count)
+        picks = [random.choice(list(entities.values())) for _ in range(EVENTS)]
+        # 旧实现比较的是 entity.id，新实现按带标记的 peer id 查找，各自喂入能命中的事件
+        linear_events = [FakeEvent(entity.id) for entity in picks]
+        peer_events = [FakeEvent(utils.get_peer_id(entity)) for entity in picks]
+
+        linear, linear_hits = await bench_linear(entities, linear_events)
+        dispatch, dispatch_hits = await bench_dispatch(entities, peer_events)
+        assert linear_hits == dispatch_hits == EVENTS
+        print(f"{count:>8}{linear / EVENTS * 1e6:>16.2f}{dispatch / EVENTS * 1e6:>18.2f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+# mysql_load_bench.py
+"""
+对比多行 INSERT 与 LOAD DATA LOCAL INFILE + 合并两种 upsert 方式写入 telegram_message 的吞吐量。
+
+需要配置好的 MySQL，且服务端开启 local_infile。测试数据写在一个专用的 chat_id 下，结束后删除。
+
+    python -m benchmarks.mysql_load_bench
+"""
+import asyncio
+import time
+
+from benchmarks.normalize_bench import make_messages
+from core.config import config
+from core.mysql import (
+    chat_column, close_mysql_pool, create_message_table, get_mysql_pool, insert_rows, load_rows, table_row,
+)
+from core.schema import MessageRecord
+
+ROWS = 50000
+BATCH_SIZES = (500, 2000, 10000)
+CHAT_ID = "@__mysql_load_bench__"
+
+
+async def write(rows, batch_size, method):
+    started = time.perf_counter()
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor() as cursor:
+            for i in range(0, len(rows), batch_size):
+                await method(cursor, rows[i:i + batch_size])
+                await conn.commit()
+    return time.perf_counter() - started
+
+
+async def cleanup():
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("DELETE FROM telegram_message WHERE chat_id = %s", (chat_column(CHAT_ID),))
+        await conn.commit()
+
+
+async def main():
+    # 连接池创建时才决定是否允许 LOCAL INFILE
+    config.MYSQL_BULK_LOAD = True
+    rows = [table_row(record.mysql_row()) for record in MessageRecord.from_messages(make_messages(ROWS), CHAT_ID)]
+    try:
+        await create_message_table()
+        await cleanup()
+        print(f"{ROWS} rows")
+        print(f"{'batch':>8}{'method':>10}{'insert rows/s':>16}{'upsert rows/s':>16}")
+        for batch_size in BATCH_SIZES:
+            for name, method in (("insert", insert_rows), ("load", load_rows)):
+                # 第一轮是全新插入，第二轮全部命中唯一键，走更新分支
+                inserted = await write(rows, batch_size, method)
+                updated = await write(rows, batch_size, method)
+                await cleanup()
+                print(f"{batch_size:>8}{name:>10}{ROWS / inserted:>16.0f}{ROWS / updated:>16.0f}")
+    finally:
+        await cleanup()
+        await close_mysql_pool()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+# normalize_bench.py
+"""
+对比旧的 process_message 与 MessageRecord.from_message / from_messages 的消息转换耗时。
+
+    python -m benchmarks.normalize_bench
+"""
+import random
+import re
+import time
+from datetime import datetime, timezone
+
+from telethon.tl.types import (
+    Message, MessageMediaDocument, MessageMediaPhoto, MessageMediaWebPage, PeerChannel, PhotoEmpty, WebPageEmpty,
+)
+
+from core.schema import MessageRecord
+
+MESSAGES = 200000
+CHAT_ID = "@benchmark_channel"
+
+
+def process_message(msg, chat_id):
+    """旧实现，原样保留用于对比"""
+    media_type = None
+    if msg.media:
+        media_type = str(msg.media).split('.')[-1].split("'")[0].lower()
+
+    doc = {
+        "message_id": msg.id,
+        "chat_id": chat_id,
+        "message": msg.message or "",
+        "date": msg.date,
+        "sender_id": msg.sender_id if hasattr(msg, 'sender_id') else None,
+        "views": msg.views if hasattr(msg, 'views') else 0,
+        "forwards": msg.forwards if hasattr(msg, 'forwards') else 0,
+        "media_type": media_type,
+        "edited_at": msg.edit_date,
+        "message_link": f"https://t.me/{chat_id[1:]}/{msg.id}" if chat_id.startswith('@') else f"https://t.me/c/{chat_id}/{msg.id}"
+    }
+
+    if doc['message']:
+        doc['message'] = re.sub(r'<[^>]+>', '', doc['message'])
+
+    return doc
+
+
+def make_messages(count):
+    """约 10% 带 HTML 标签、30% 带媒体、5% 无文本，接近频道消息的分布"""
+    rng = random.Random(42)
+    date = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    medias = [
+        MessageMediaPhoto(photo=PhotoEmpty(id=1)),
+        MessageMediaDocument(),
+        MessageMediaWebPage(webpage=WebPageEmpty(id=1)),
+    ]
+    messages = []
+    for i in range(count):
+        roll = rng.random()
+        if roll < 0.05:
+            text = ""
+        elif roll < 0.15:
+            text = f"<b>公告</b> 第 {i} 条消息 <a href='https://example.com'>链接</a>"
+        else:
+            text = f"第 {i} 条普通消息，" + "内容" * rng.randint(5, 60)
+        messages.append(Message(
+            id=i + 1,
+            peer_id=PeerChannel(channel_id=1000000),
+            date=date,
+            message=text,
+            media=rng.choice(medias) if rng.random() < 0.3 else None,
+            views=rng.randint(0, 10000),
+            forwards=rng.randint(0, 100),
+        ))
+    return messages
+
+
+def bench(label, func, baseline=None):
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    speedup = f"{baseline / elapsed:>8.1f}x" if baseline else f"{'':>9}"
+    print(f"{label:<30}{elapsed / MESSAGES * 1e6:>10.2f} us/msg{speedup}")
+    return elapsed
+
+
+def main():
+    messages = make_messages(MESSAGES)
+
+    # 两种实现的输出必须一致（旧实现的 media_type 解析是字符串拼凑的，只比较其余字段）
+    for msg in messages[:1000]:
+        old = process_message(msg, CHAT_ID)
+        new = MessageRecord.from_message(msg, CHAT_ID)
+        assert (old["message"], old["message_link"], old["views"]) == (new.message, new.message_link, new.views)
+
+    print(f"{MESSAGES} messages")
+    baseline = bench("process_message", lambda: [process_message(msg, CHAT_ID) for msg in messages])
+    bench("MessageRecord.from_message", lambda: [MessageRecord.from_message(msg, CHAT_ID) for msg in messages], baseline)
+    bench("MessageRecord.from_messages", lambda: MessageRecord.from_messages(messages, CHAT_ID), baseline)
+
+
+if __name__ == '__main__':
+    main()
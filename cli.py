@@ -1,42 +1,33 @@
-import os
-import re
 import argparse
+import logging
 import asyncio
-import pymysql
-from telethon import TelegramClient, events
-from telethon.tl.types import Message
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from telethon import events
 from dotenv import load_dotenv
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk
 import signal
 import sys
-from datetime import datetime
+
+from core.checkpoint import create_checkpoint_table
+from core.config import config
+from core.dispatch import ChatDispatcher
+from core.es import close_es_client, save_to_es
+from core.es_bulk import BulkLoadMode
+from core.es_index import compact_closed_indices, setup_indices
+from core.mysql import (
+    backfill_rollups, close_mysql_pool, create_message_table, drop_message_partitions, ensure_message_partitions,
+    get_message_dates, list_message_chats, save_to_mysql,
+)
+from core.mysql_migrate import migrate, swap_tables
+from core.pipeline import IngestPipeline
+from core.schema import MessageRecord, is_stored_message
+from core.scrape import SPOOL_SINKS, scrape_chats, spool, spool_failed_batch
+from core.session_pool import SessionPool
 
 load_dotenv()  # 加载.env文件中的环境变量
 
-# 从环境变量获取配置
-API_ID = int(os.getenv('API_ID'))
-API_HASH = os.getenv('API_HASH')
-ES_HOST = os.getenv('ES_HOST')
-MYSQL_HOST = os.getenv('MYSQL_HOST')
-MYSQL_USER = os.getenv('MYSQL_USER')
-MYSQL_PASS = os.getenv('MYSQL_PASSWORD')
-MYSQL_DB = os.getenv('MYSQL_DATABASE')
-
-print(ES_HOST)
-
-# 初始化Elasticsearch和MySQL连接
-es = Elasticsearch(ES_HOST, timeout=120)
-mysql_conn = pymysql.connect(
-    host=MYSQL_HOST,
-    user=MYSQL_USER,
-    password=MYSQL_PASS,
-    database=MYSQL_DB,
-    charset='utf8mb4',
-    connect_timeout=12000,
-    read_timeout=12000,
-    write_timeout=12000,
-)
+logger = logging.getLogger(__name__)
 
 # 全局变量用于优雅退出
 running = True
@@ -50,419 +41,184 @@ def signal_handler(signum, frame):
 signal.signal(signal.SIGINT, signal_handler)
 signal.signal(signal.SIGTERM, signal_handler)
 
-# MySQL连接管理
-def ensure_mysql_connection():
-    """确保MySQL连接有效，如果断开则重新连接"""
-    global mysql_conn
+# 订阅新消息的处理函数
+async def handle_new_message(event, chat, pipeline):
+    """处理新消息事件：转换后放入实时写入缓冲即返回，由流水线攒批写入"""
+    if not running:
+        return
+
     try:
-        mysql_conn.ping(reconnect=True)
-    except Exception as e:
-        print(f"MySQL连接断开，正在重新连接: {e}")
-        mysql_conn = pymysql.connect(
-            host=MYSQL_HOST,
-            user=MYSQL_USER,
-            password=MYSQL_PASS,
-            database=MYSQL_DB,
-            charset='utf8mb4',
-            connect_timeout=12000,
-            read_timeout=12000,
-            write_timeout=12000,
-        )
-
-# 消息处理函数
-def process_message(msg: Message, chat_id: str):
-    """处理单条消息，提取关键信息"""
-    # 提取媒体类型
-    media_type = None
-    if msg.media:
-        media_type = str(msg.media).split('.')[-1].split("'")[0].lower()
-
-    # 构建消息文档
-    doc = {
-        "message_id": msg.id,
-        "chat_id": chat_id,
-        "message": msg.message or "",
-        "date": msg.date,
-        "sender_id": msg.sender_id if hasattr(msg, 'sender_id') else None,
-        "views": msg.views if hasattr(msg, 'views') else 0,
-        "forwards": msg.forwards if hasattr(msg, 'forwards') else 0,
-        "media_type": media_type,
-        "message_link": f"https://t.me/{chat_id[1:]}/{msg.id}" if chat_id.startswith('@') else f"https://t.me/c/{chat_id}/{msg.id}"
-    }
+        message = event.message
+        if not is_stored_message(message):
+            logger.debug("跳过非消息事件: %s", type(event.message))
+            return
 
-    # 处理HTML特殊字符
-    if doc['message']:
-        doc['message'] = re.sub(r'<[^>]+>', '', doc['message'])
+        doc = MessageRecord.from_message(message, chat.chat_id, chat.username)
+        await pipeline.put(doc)
 
-    return doc
+        # 逐条打印消息详情开销不小，只在 DEBUG 级别输出
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "收到新消息 频道/群组: %s 消息ID: %s 发送时间: %s 发送者ID: %s 媒体类型: %s "
+                "查看次数: %s 转发次数: %s 消息链接: %s\n消息内容: %s",
+                chat.name, doc.message_id, doc.date, doc.sender_id, doc.media_type or '无',
+                doc.views, doc.forwards, doc.message_link, doc.message or '[无文本内容]',
+            )
+    except Exception:
+        logger.exception("处理新消息时出错")
 
-# 存储到Elasticsearch
-def save_to_es(docs):
-    actions = [
-        {
-            "_index": "telegram_messages",
-            "_id": f"{doc['chat_id']}_{doc['message_id']}",
-            "_source": doc
-        }
-        for doc in docs
-    ]
-    bulk(es, actions)
+# 消息编辑事件：只放入会变化的字段，写入端据此做局部更新
+async def handle_edited_message(event, chat, pipeline):
+    """处理消息编辑事件"""
+    if not running:
+        return
 
-# 订阅新消息的处理函数
-async def handle_new_message(event, chat_name):
-    """处理新消息事件"""
-    global running
+    try:
+        doc = MessageRecord.from_message(event.message, chat.chat_id, chat.username)
+        await pipeline.put({
+            "_op": "update",
+            "message_id": doc.message_id,
+            "chat_id": chat.chat_id,
+            "date": doc.date,
+            "message": doc.message,
+            "media_type": doc.media_type,
+            "edited_at": doc.edited_at,
+        })
+        logger.debug("消息已编辑 频道/群组: %s 消息ID: %s", chat.name, doc.message_id)
+    except Exception:
+        logger.exception("处理编辑消息时出错")
+
+# 消息删除事件
+async def handle_deleted_messages(event, chat, pipeline):
+    """
+    处理消息删除事件，每条被删除的消息对应一个删除操作。
+    删除事件不带发送时间，先从 MySQL 查出来，ES 据此在对应周期的索引中按顺序删除
+    """
     if not running:
         return
-        
+
     try:
-        message = event.message
-        if not isinstance(message, Message):
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 跳过非消息事件: {type(event.message)}")
-            return
-        
-        # 打印收到消息的详细信息
-        print(f"\n{'='*60}")
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 收到新消息")
-        print(f"频道/群组: {chat_name}")
-        print(f"消息ID: {message.id}")
-        print(f"发送时间: {message.date}")
-        print(f"发送者ID: {message.sender_id if hasattr(message, 'sender_id') else '未知'}")
-        
-        # 打印消息内容
-        if message.message:
-            print(f"消息内容: {message.message}")
-        else:
-            print("消息内容: [无文本内容]")
-        
-        # 打印媒体信息
-        if message.media:
-            media_type = str(message.media).split('.')[-1].split("'")[0].lower()
-            print(f"媒体类型: {media_type}")
-        else:
-            print("媒体类型: 无")
-        
-        # 打印统计信息
-        if hasattr(message, 'views') and message.views:
-            print(f"查看次数: {message.views}")
-        if hasattr(message, 'forwards') and message.forwards:
-            print(f"转发次数: {message.forwards}")
-            
-        # 处理消息
-        doc = process_message(message, chat_name)
-        
-        # 保存到数据库和ES
-        try:
-            save_to_es([doc])
-            print("✓ 已保存到 Elasticsearch")
-        except Exception as e:
-            print(f"✗ 保存到 Elasticsearch 失败: {e}")
-            
-        try:
-            save_to_mysql([doc])
-            print("✓ 已保存到 MySQL")
-        except Exception as e:
-            print(f"✗ 保存到 MySQL 失败: {e}")
-        
-        print(f"消息链接: {doc['message_link']}")
-        print(f"{'='*60}\n")
-            
+        dates = await get_message_dates(chat.chat_id, event.deleted_ids)
     except Exception as e:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 处理新消息时出错: {e}")
-        import traceback
-        traceback.print_exc()
+        # 查不到时间的删除由 save_to_es 通过读别名删除
+        logger.warning("查询被删除消息的发送时间失败: %s", e)
+        dates = {}
+    for message_id in event.deleted_ids:
+        await pipeline.put({
+            "_op": "delete", "chat_id": chat.chat_id, "message_id": message_id, "date": dates.get(message_id),
+        })
+    logger.debug("消息已删除 频道/群组: %s 消息ID: %s", chat.name, event.deleted_ids)
 
-# 订阅频道/群组新消息的主函数
-async def subscribe_messages(client, chat_names):
-    """订阅指定频道/群组的新消息"""
-    print(f"开始订阅以下频道/群组的新消息: {', '.join(chat_names)}")
-    
-    # 验证频道/群组是否存在并获取实体
-    entities = {}
+# 实时订阅的写入缓冲：按条数或截止时间攒批写入 ES 和 MySQL
+def create_live_pipeline():
+    async def on_written(sink, docs):
+        logger.info("✓ 已写入 %s: %d 条", sink, len(docs))
+
+    # 每个写入端只用一个消费者，保证同一条消息的新增、编辑、删除按到达顺序写入；
+    # 缓冲中还有未回放的批次时新批次排在它们后面，同样经由缓冲写入
+    sinks = {
+        "es": (spool.guard("es", save_to_es), 1),
+        "mysql": (spool.guard("mysql", save_to_mysql), 1),
+    }
+    pipeline = IngestPipeline(
+        sinks,
+        batch_options={"max_docs": config.LIVE_BATCH_SIZE, "max_latency": config.LIVE_FLUSH_INTERVAL},
+        on_written=on_written,
+        on_error=spool_failed_batch,
+    )
+    pipeline.start()
+    return pipeline
+
+# 解析要订阅的频道/群组，建立 peer id -> 聊天 的分发表
+async def resolve_subscriptions(client, chat_names, skip_invalid=False):
+    """解析所有聊天；skip_invalid 为 False 时遇到无效聊天返回 None"""
+    chat_names = [chat_name.strip() for chat_name in chat_names]
+
+    # 先批量预热实体缓存，下面的逐个解析大多直接命中缓存
+    await client.warm_entities(chat_names)
+
+    dispatcher = ChatDispatcher()
     for chat_name in chat_names:
         try:
             entity = await client.get_entity(chat_name)
-            entities[chat_name] = entity
+            dispatcher.add(chat_name, entity)
             print(f"✓ 成功连接到: {entity.title} ({chat_name})")
         except Exception as e:
-            print(f"✗ 无法连接到 {chat_name}: {e}")
-            return
-    
-    # 为每个频道/群组注册新消息事件处理器
-    for chat_name, entity in entities.items():
-        @client.on(events.NewMessage(chats=entity))
-        async def new_message_handler(event):
-            await handle_new_message(event, chat_name)
-    
-    print("订阅设置完成，开始监听新消息...")
-    print("按 Ctrl+C 停止监听")
-    
-    # 保持运行状态
+            if not skip_invalid:
+                print(f"✗ 无法连接到 {chat_name}: {e}")
+                return None
+            print(f"✗ 跳过无效的频道/群组 {chat_name}: {e}")
+    return dispatcher
+
+# 在分发表上注册新消息、编辑、删除事件处理器
+def register_handlers(client, dispatcher, pipeline):
+    async def on_new_message(event, chat):
+        await handle_new_message(event, chat, pipeline)
+
+    async def on_message_edited(event, chat):
+        await handle_edited_message(event, chat, pipeline)
+
+    # 普通群组和私聊的删除事件不带 chat_id，无法判断属于哪个聊天，分发表会忽略它们
+    async def on_message_deleted(event, chat):
+        await handle_deleted_messages(event, chat, pipeline)
+
+    dispatcher.register(client, events.NewMessage(), on_new_message)
+    dispatcher.register(client, events.MessageEdited(), on_message_edited)
+    dispatcher.register(client, events.MessageDeleted(), on_message_deleted)
+
+# 保持运行直到收到退出信号，退出前写完缓冲中的消息
+async def wait_until_stopped(label, pipeline):
     try:
         while running:
             await asyncio.sleep(1)
     except KeyboardInterrupt:
         print("\n收到中断信号，正在停止...")
     finally:
-        print("订阅已停止")
+        written = await pipeline.close()
+        print(f"{label}已停止，共写入 ES {written['es']} 条、MySQL {written['mysql']} 条")
+
+# 订阅频道/群组新消息的主函数
+async def subscribe_messages(client, chat_names):
+    """订阅指定频道/群组的新消息"""
+    print(f"开始订阅以下频道/群组的新消息: {', '.join(chat_names)}")
+
+    # 验证频道/群组是否存在并获取实体
+    dispatcher = await resolve_subscriptions(client, chat_names)
+    if dispatcher is None:
+        return
+
+    pipeline = create_live_pipeline()
+    register_handlers(client, dispatcher, pipeline)
+
+    print("订阅设置完成，开始监听新消息...")
+    print("按 Ctrl+C 停止监听")
+
+    await wait_until_stopped("订阅", pipeline)
 
 # 批量订阅功能
 async def subscribe_batch_messages(client, chat_names):
     """批量订阅多个频道/群组的新消息"""
     print(f"开始批量订阅 {len(chat_names)} 个频道/群组的新消息")
-    
-    # 验证所有频道/群组
-    valid_entities = {}
-    for chat_name in chat_names:
-        try:
-            entity = await client.get_entity(chat_name.strip())
-            valid_entities[chat_name.strip()] = entity
-            print(f"✓ {entity.title} ({chat_name.strip()})")
-        except Exception as e:
-            print(f"✗ 跳过无效的频道/群组 {chat_name}: {e}")
-    
-    if not valid_entities:
+
+    # 验证所有频道/群组，跳过无效的
+    dispatcher = await resolve_subscriptions(client, chat_names, skip_invalid=True)
+    if not dispatcher:
         print("没有有效的频道/群组可以订阅")
         return
-    
-    # 注册事件处理器
-    @client.on(events.NewMessage(chats=list(valid_entities.values())))
-    async def batch_message_handler(event):
-        # 找到对应的chat_name
-        chat_id = event.chat_id
-        chat_name = None
-        for name, entity in valid_entities.items():
-            if entity.id == chat_id:
-                chat_name = name
-                break
-        
-        if chat_name:
-            await handle_new_message(event, chat_name)
-    
-    print(f"成功订阅 {len(valid_entities)} 个频道/群组")
+
+    pipeline = create_live_pipeline()
+    register_handlers(client, dispatcher, pipeline)
+
+    print(f"成功订阅 {len(dispatcher)} 个频道/群组")
     print("开始监听新消息... 按 Ctrl+C 停止")
-    
-    # 保持运行
-    try:
-        while running:
-            await asyncio.sleep(1)
-    except KeyboardInterrupt:
-        print("\n收到中断信号，正在停止...")
-    finally:
-        print("批量订阅已停止")
-
-# 修改存储到MySQL的函数
-def save_to_mysql(docs):
-    ensure_mysql_connection()  # 确保连接有效
-    with mysql_conn.cursor() as cursor:
-        sql = """
-              INSERT INTO telegram_message (message_id, chat_id, message, date, sender_id, views, forwards, media_type, message_link) \
-              VALUES (%(message_id)s, %(chat_id)s, %(message)s, %(date)s, \
-                      %(sender_id)s, %(views)s, %(forwards)s, %(media_type)s, %(message_link)s) ON DUPLICATE KEY \
-              UPDATE \
-                  message = \
-              VALUES (message), views = \
-              VALUES (views), forwards = \
-              VALUES (forwards), media_type = \
-              VALUES (media_type) \
-              """
-        cursor.executemany(sql, docs)
-    mysql_conn.commit()
-
-# 创建Elasticsearch索引（带中文分词）
-def create_es_index():
-    index_name = "telegram_messages"
-    if not es.indices.exists(index=index_name):
-        es.indices.create(
-            index=index_name,
-            # body={
-            #     "settings": {
-            #         "analysis": {
-            #             "analyzer": {
-            #                 "ik_pinyin_analyzer": {
-            #                     "type": "custom",
-            #                     "tokenizer": "ik_max_word",
-            #                     "filter": ["pinyin_filter"]
-            #                 }
-            #             },
-            #             "filter": {
-            #                 "pinyin_filter": {
-            #                     "type": "pinyin",
-            #                     "keep_original": True,
-            #                     "keep_first_letter": True,
-            #                     "keep_separate_first_letter": True
-            #                 }
-            #             }
-            #         }
-            #     },
-            #     "mappings": {
-            #         "properties": {
-            #             "id": {"type": "long"},
-            #             "chat_id": {"type": "keyword"},
-            #             "message": {
-            #                 "type": "text",
-            #                 "analyzer": "ik_pinyin_analyzer",
-            #                 "fields": {
-            #                     "keyword": {"type": "keyword"}
-            #                 }
-            #             },
-            #             "date": {"type": "date"},
-            #             "sender_id": {"type": "long"},
-            #             "views": {"type": "integer"},
-            #             "forwards": {"type": "integer"},
-            #             "media_type": {"type": "keyword"},
-            #             "message_link": {"type": "keyword"},
-            #         }
-            #     }
-            # }
-            body= {
-              "settings": {
-                "analysis": {
-                  "analyzer": {
-                    "my_analyzer": {
-                      "tokenizer": "ik_max_word",
-                      "filter": "py"
-                    }
-                  },
-                  "filter": {
-                    "py": {
-                      "type": "pinyin",
-                      "keep_full_pinyin": False,
-                      "keep_joined_full_pinyin": True,
-                      "keep_original": True,
-                      "limit_first_letter_length": 16,
-                      "remove_duplicated_term": True,
-                      "none_chinese_pinyin_tokenize": False
-                    }
-                  }
-                }
-              },
-              "mappings": {
-                "properties": {
-                  "id": {
-                    "type": "long"
-                  },
-                  "chat_id": {
-                    "type": "keyword"
-                  },
-
-                  "message": {
-                    "type": "text",
-                    "analyzer": "my_analyzer",
-                    "search_analyzer": "ik_max_word",
-                    "copy_to": ["all", "suggest"]
-                  },
-                  "date": {"type": "date"},
-                  "sender_id": {"type": "long"},
-                  "views": {"type": "integer"},
-                  "forwards": {"type": "integer"},
-                  "media_type": {"type": "keyword"},
-                  "message_link": {"type": "keyword"},
-                  "all": {
-                    "type": "text",
-                    "search_analyzer": "ik_max_word",
-                    "analyzer": "my_analyzer"
-                  },
-                  "suggest": {
-                    "type": "completion",
-                    "analyzer": "my_analyzer",
-                    "search_analyzer": "ik_max_word"
-                  }
-                }
-              }
-            }
-        )
-        print(f"Created Elasticsearch index: {index_name}")
-
-
-# 创建MySQL表
-def create_mysql_table():
-    with mysql_conn.cursor() as cursor:
-        cursor.execute("""
-                       CREATE TABLE IF NOT EXISTS telegram_message
-                       (
-                           id
-                           BIGINT
-                           UNSIGNED
-                           NOT
-                           NULL
-                           AUTO_INCREMENT
-                           COMMENT
-                           '自增主键',
-                           message_id
-                           BIGINT
-                           NOT
-                           NULL
-                           COMMENT
-                           'Telegram消息ID',
-                           chat_id
-                           VARCHAR(300)
-                           NOT
-                           NULL
-                           COMMENT
-                           '群组/频道ID',
-                           message
-                           TEXT
-                           CHARACTER
-                           SET
-                           utf8mb4
-                           COLLATE
-                           utf8mb4_unicode_ci
-                           COMMENT
-                           '消息内容',
-                           date
-                           DATETIME
-                           NOT
-                           NULL
-                           COMMENT
-                           '消息发送时间',
-                           sender_id
-                           BIGINT
-                           COMMENT
-                           '发送者ID',
-                           views
-                           INT
-                           COMMENT
-                           '查看次数',
-                           forwards
-                           INT
-                           COMMENT
-                           '转发次数',
-                           media_type
-                           VARCHAR
-                       (
-                           800
-                       ) COMMENT '媒体类型(photo/video/document等)',
-                           message_link VARCHAR(800) COMMENT '消息链接',
-                           PRIMARY KEY
-                       (
-                           id
-                       ),
-                           UNIQUE KEY uniq_msg
-                       (
-                           chat_id,
-                           message_id
-                       ),
-                           KEY idx_chat
-                       (
-                           chat_id
-                       ),
-                           KEY idx_date
-                       (
-                           date
-                       ),
-                           KEY idx_sender
-                       (
-                           sender_id
-                       )
-                           ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='存储Telegram消息'
-                       """)
-    mysql_conn.commit()
-    print("Created MySQL table")
+
+    await wait_until_stopped("批量订阅", pipeline)
 
 # 修改主函数以支持新的订阅功能
 async def main():
     parser = argparse.ArgumentParser(description='Telegram消息爬取和订阅工具')
+    parser.add_argument('--log-level', default=config.LOG_LEVEL,
+                        help='日志级别，DEBUG 时逐条打印收到的消息')
     subparsers = parser.add_subparsers(dest='command', help='可用命令')
     
     # 原有的爬取命令
@@ -470,6 +226,14 @@ async def main():
     scrape_parser.add_argument('--chats', required=True, help='逗号分隔的频道/群组ID')
     scrape_parser.add_argument('--start', type=int, required=True, help='起始消息ID')
     scrape_parser.add_argument('--end', type=int, required=True, help='结束消息ID')
+    scrape_parser.add_argument('--resume', action='store_true', help='从上次的断点继续爬取')
+    scrape_parser.add_argument('--concurrency', type=int, help='同时爬取的聊天数上限')
+    scrape_parser.add_argument('--bulk-load', action='store_true', help='回填期间把 ES 索引切换到批量导入模式')
+
+    # 增量同步命令：只拉取断点之后的新消息
+    sync_parser = subparsers.add_parser('sync', help='同步断点之后的新消息')
+    sync_parser.add_argument('--chats', required=True, help='逗号分隔的频道/群组ID')
+    sync_parser.add_argument('--concurrency', type=int, help='同时同步的聊天数上限')
     
     # 新增的订阅命令
     subscribe_parser = subparsers.add_parser('subscribe', help='订阅新消息')
@@ -479,31 +243,141 @@ async def main():
     batch_subscribe_parser = subparsers.add_parser('batch-subscribe', help='批量订阅多个频道/群组的新消息')
     batch_subscribe_parser.add_argument('--chats', required=True, help='逗号分隔的频道/群组名称或ID列表')
     
+    # 本地缓冲状态与手动回放
+    spool_parser = subparsers.add_parser('spool', help='查看本地写入缓冲的积压情况')
+    spool_parser.add_argument('--replay', action='store_true', help='立即把缓冲回放到 ES 和 MySQL')
+
+    # 整理已结束周期的 ES 索引
+    compact_parser = subparsers.add_parser('es-compact', help='收缩并 force merge 已结束周期的 ES 索引')
+    compact_parser.add_argument('--shrink', type=int, help='收缩到的主分片数，默认 ES_SHRINK_SHARDS')
+    compact_parser.add_argument('--segments', type=int, default=1, help='force merge 的目标段数')
+
+    # 从已有消息重建按天汇总的统计表
+    rollup_parser = subparsers.add_parser('rollup-backfill', help='从已有消息重建按天汇总的统计表')
+    rollup_parser.add_argument('--chats', help='逗号分隔的 chat_id（实体的 peer id，如 -100 开头的频道 ID），默认所有聊天')
+
+    # MySQL 消息表迁移为按月分区的布局
+    migrate_parser = subparsers.add_parser('mysql-migrate', help='在线把 telegram_message 迁移为按月分区的布局')
+    migrate_parser.add_argument('--chunk-size', type=int, help='每次复制的 id 区间大小，默认 MYSQL_MIGRATE_CHUNK_SIZE')
+    migrate_parser.add_argument('--pause', type=float, default=0.0, help='每块之间暂停的秒数')
+    migrate_parser.add_argument('--start-id', type=int, help='从该 id 继续复制（中断后续传）')
+    migrate_parser.add_argument('--swap', action='store_true', help='复制完成并停止写入端后，交换新旧表')
+
+    # 维护按月分区
+    partitions_parser = subparsers.add_parser('mysql-partitions', help='补齐未来月份的分区，删除过期分区')
+    partitions_parser.add_argument('--drop-before', help='删除该月（YYYY-MM）之前的分区')
+
     args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format='[%(asctime)s] %(levelname)s %(message)s')
     
     if not args.command:
         parser.print_help()
         return
     
     # 创建数据库结构
-    create_es_index()
-    create_mysql_table()
     
-    async with TelegramClient('session_name', API_ID, API_HASH) as client:
-        if args.command == 'scrape':
-            # 原有的爬取功能
-            chat_ids = [args.chats]
-            for chat_id in chat_ids:
-                await scrape_messages(client, chat_id, args.start, args.end)
+    if args.command == 'spool':
+        # 只涉及 ES 和 MySQL，不需要租用 Telegram 会话
+        try:
+            if args.replay:
+                for sink, write in SPOOL_SINKS.items():
+                    print(f"已回放 {sink}: {await spool.replay(sink, write)} 条")
+            for sink, stats in spool.metrics().items():
+                print(f"{sink}: {stats['segments']} 个段, {stats['bytes']} 字节, "
+                      f"最早积压 {stats['oldest_age']} 秒, 回放速度 {stats['replay_rate']} 条/秒")
+        finally:
+            await close_es_client()
+            await close_mysql_pool()
+        return
+
+    if args.command == 'es-compact':
+        try:
+            compacted = await compact_closed_indices(shrink_shards=args.shrink, max_num_segments=args.segments)
+            print(f"已整理 {len(compacted)} 个索引")
+        finally:
+            await close_es_client()
+        return
+
+    if args.command == 'rollup-backfill':
+        try:
+            await create_message_table()
+            if args.chats:
+                chat_ids = [name.strip() for name in args.chats.split(',') if name.strip()]
+            else:
+                chat_ids = await list_message_chats()
+            # 逐个聊天重建，每个聊天一个事务，锁定范围和时间都较小
+            for i, chat_id in enumerate(chat_ids, 1):
+                started = time.monotonic()
+                await backfill_rollups(chat_id)
+                print(f"[{i}/{len(chat_ids)}] 已重建 {chat_id} 的汇总，耗时 {time.monotonic() - started:.1f}s")
+        finally:
+            await close_mysql_pool()
+        return
+
+    if args.command == 'mysql-migrate':
+        try:
+            if args.swap:
+                await swap_tables()
+                print("已交换新旧表，旧表保留为 telegram_message_old；开启 MYSQL_PARTITIONED 后再启动写入端")
+            else:
+                started = time.monotonic()
+                copied = await migrate(args.chunk_size, args.pause, args.start_id)
+                print(f"已复制 {copied} 行，耗时 {time.monotonic() - started:.1f}s；"
+                      f"新写入由触发器同步，停止写入端后运行 mysql-migrate --swap")
+        finally:
+            await close_mysql_pool()
+        return
+
+    if args.command == 'mysql-partitions':
+        try:
+            added = await ensure_message_partitions()
+            print(f"新增分区: {', '.join(added) or '无'}")
+            if args.drop_before:
+                dropped = await drop_message_partitions(datetime.strptime(args.drop_before, '%Y-%m').date())
+                print(f"已删除分区: {', '.join(dropped) or '无'}")
+        finally:
+            await close_mysql_pool()
+        return
+
+    session_pool = SessionPool()
+    bulk_mode = BulkLoadMode()
+    spool.start_replayer(SPOOL_SINKS)
+    try:
+        await create_checkpoint_table()
+        await setup_indices()
+        await create_message_table()
+        # 上一次批量导入的任务如果崩溃，先恢复索引设置
+        await bulk_mode.recover()
+        # 从会话池租用一个账号，请求经由调度器发出，统一处理 FloodWait 和限速
+        async with session_pool.lease() as client:
+            print(f"Using Telegram session: {client.session_name}")
+            if args.command == 'scrape':
+                # 原有的爬取功能，多个聊天并发爬取
+                chat_ids = [name.strip() for name in args.chats.split(',') if name.strip()]
+                async with bulk_mode.hold() if args.bulk_load else nullcontext():
+                    await scrape_chats(client, chat_ids, args.start, args.end,
+                                       resume=args.resume, concurrency=args.concurrency)
+
+            elif args.command == 'sync':
+                # 增量同步：从断点拉取到最新消息
+                chat_ids = [name.strip() for name in args.chats.split(',') if name.strip()]
+                await scrape_chats(client, chat_ids, -1, -1, resume=True, concurrency=args.concurrency)
                 
-        elif args.command == 'subscribe':
-            # 新的订阅功能
-            await subscribe_messages(client, [args.chat])
+            elif args.command == 'subscribe':
+                # 新的订阅功能
+                await subscribe_messages(client, [args.chat])
             
-        elif args.command == 'batch-subscribe':
-            # 批量订阅功能
-            chat_names = [name.strip() for name in args.chats.split(',')]
-            await subscribe_batch_messages(client, chat_names)
+            elif args.command == 'batch-subscribe':
+                # 批量订阅功能
+                chat_names = [name.strip() for name in args.chats.split(',')]
+                await subscribe_batch_messages(client, chat_names)
+    finally:
+        # 异步写入端绑定在当前事件循环上，退出前关闭
+        await spool.close()
+        await bulk_mode.close()
+        await close_es_client()
+        await close_mysql_pool()
+        await session_pool.close()
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
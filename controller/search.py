@@ -0,0 +1,187 @@
+# search.py
+from datetime import datetime
+from typing import List, Optional
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from core.config import config
+from core.es import search_messages
+from core.es_cursor import decode_cursor, encode_cursor, iter_search, search_page
+from core.search_cache import SearchCache
+
+router = APIRouter()
+
+search_cache = SearchCache()
+
+
+def search_filters(
+        chat_id: Optional[List[str]] = Query(None, description="限定的频道/群组，可重复"),
+        sender_id: Optional[List[int]] = Query(None, description="限定的发送者ID，可重复"),
+        media_type: Optional[List[str]] = Query(None, description="限定的媒体类型，如 photo、document"),
+        date_from: Optional[datetime] = Query(None, description="发送时间下限"),
+        date_to: Optional[datetime] = Query(None, description="发送时间上限"),
+):
+    """规范化过滤条件：去重排序，写法不同但等价的查询得到相同的结果，也命中同一条缓存"""
+    return {
+        "chat_ids": sorted(set(chat_id or [])),
+        "sender_ids": sorted(set(sender_id or [])),
+        "media_types": sorted({value.lower() for value in media_type or []}),
+        "date_from": date_from.isoformat() if date_from else None,
+        "date_to": date_to.isoformat() if date_to else None,
+    }
+
+
+def normalize_query(q):
+    """合并空白并转小写"""
+    return " ".join(q.split()).lower()
+
+
+def build_query(q, filters):
+    """message / all 字段（IK + 拼音分词）上的全文检索，加上发送者、媒体类型和时间过滤"""
+    clauses = []
+    if filters["sender_ids"]:
+        clauses.append({"terms": {"sender_id": filters["sender_ids"]}})
+    if filters["media_types"]:
+        clauses.append({"terms": {"media_type": filters["media_types"]}})
+    if filters["date_from"] or filters["date_to"]:
+        date_range = {}
+        if filters["date_from"]:
+            date_range["gte"] = filters["date_from"]
+        if filters["date_to"]:
+            date_range["lte"] = filters["date_to"]
+        clauses.append({"range": {"date": date_range}})
+    return {
+        "bool": {
+            "must": [{"multi_match": {"query": q, "fields": ["message^2", "all"]}}],
+            "filter": clauses,
+        }
+    }
+
+
+# 游标中过滤条件的列表字段及元素类型
+_CURSOR_LISTS = {"chat_ids": str, "sender_ids": int, "media_types": str}
+
+
+def cursor_state(token):
+    """
+    解析客户端传回的游标。游标内容不可信：逐项校验查询条件，size 限制在 SEARCH_MAX_SIZE 以内，
+    格式不对时抛出 ValueError
+    """
+    state = decode_cursor(token)
+    params = state.get("params")
+    if not isinstance(state.get("pit"), str) or not isinstance(state.get("after"), list) \
+            or not isinstance(params, dict):
+        raise ValueError("invalid cursor")
+    q = params.get("q")
+    size = params.get("size")
+    if not isinstance(q, str) or not q.strip() or type(size) is not int or size < 1:
+        raise ValueError("invalid cursor")
+    clean = {"q": normalize_query(q)}
+    for key, item_type in _CURSOR_LISTS.items():
+        values = params.get(key)
+        if not isinstance(values, list) or any(type(value) is not item_type for value in values):
+            raise ValueError("invalid cursor")
+        clean[key] = values
+    for key in ("date_from", "date_to"):
+        value = params.get(key)
+        if value is not None:
+            # fromisoformat 对非字符串抛出 TypeError
+            try:
+                value = datetime.fromisoformat(value).isoformat()
+            except TypeError:
+                raise ValueError("invalid cursor")
+        clean[key] = value
+    clean["size"] = min(size, config.SEARCH_MAX_SIZE)
+    return {"pit": state["pit"], "after": state["after"], "params": clean}
+
+
+def format_hit(hit):
+    return {
+        "id": hit["_id"],
+        "score": hit["_score"],
+        **hit["_source"],
+        "highlight": hit.get("highlight", {}).get("message", []),
+    }
+
+
+def format_hits(response):
+    return {
+        "total": response["hits"]["total"]["value"],
+        "took": response["took"],
+        "hits": [format_hit(hit) for hit in response["hits"]["hits"]],
+    }
+
+
+@router.get("/search")
+async def search(
+        q: str = Query(..., min_length=1, description="搜索关键词，支持中文和拼音"),
+        filters: dict = Depends(search_filters),
+        size: int = Query(20, ge=1, le=config.SEARCH_MAX_SIZE),
+        offset: int = Query(0, alias="from", ge=0),
+):
+    """搜索消息；结果按查询缓存，被查询的聊天有新写入时自动失效"""
+    params = {"q": normalize_query(q), **filters, "size": size, "from": offset}
+
+    async def run():
+        response = await search_messages(
+            chat_ids=filters["chat_ids"] or None,
+            query=build_query(params["q"], filters),
+            from_=offset,
+            size=size,
+            highlight={"fields": {"message": {}}},
+        )
+        return format_hits(response)
+
+    result, cached = await search_cache.get_or_search(params, filters["chat_ids"], run)
+    return {**result, "cached": cached}
+
+
+@router.get("/search/cursor")
+async def search_cursor(
+        q: Optional[str] = Query(None, min_length=1, description="搜索关键词；传 cursor 时忽略"),
+        filters: dict = Depends(search_filters),
+        size: int = Query(20, ge=1, le=config.SEARCH_MAX_SIZE),
+        cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+):
+    """
+    游标分页（PIT + search_after），按发送时间倒序，没有 from/size 的深度限制。
+    首页传查询条件，之后只传上一页的 next_cursor，next_cursor 为 null 表示已到最后一页。
+    """
+    if cursor:
+        try:
+            state = cursor_state(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="invalid cursor")
+        params = state["params"]
+    elif q:
+        state = None
+        params = {"q": normalize_query(q), **filters, "size": size}
+    else:
+        raise HTTPException(status_code=400, detail="q or cursor is required")
+
+    hits, next_state = await search_page(
+        query=build_query(params["q"], params),
+        chat_ids=params["chat_ids"] or None,
+        size=params["size"],
+        cursor=state,
+        highlight={"fields": {"message": {}}},
+    )
+    return {
+        "hits": [format_hit(hit) for hit in hits],
+        "next_cursor": encode_cursor({**next_state, "params": params}) if next_state else None,
+    }
+
+
+@router.get("/search/export")
+async def search_export(
+        q: str = Query(..., min_length=1, description="搜索关键词，支持中文和拼音"),
+        filters: dict = Depends(search_filters),
+):
+    """以 NDJSON 流式导出全部命中的消息，服务端每次只取一页，内存占用与结果总数无关"""
+    async def lines():
+        async for hit in iter_search(build_query(normalize_query(q), filters), filters["chat_ids"] or None):
+            yield orjson.dumps(hit["_source"]) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -0,0 +1,30 @@
+# stats.py
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, Query
+
+from core.mysql import get_daily_stats, get_top_senders
+
+router = APIRouter()
+
+
+@router.get("/stats/daily")
+async def daily_stats(
+        chat_id: str = Query(..., description="频道/群组ID"),
+        date_from: Optional[date] = Query(None, description="起始日期"),
+        date_to: Optional[date] = Query(None, description="结束日期"),
+):
+    """聊天每天的消息数、媒体消息数、查看和转发次数，读取预先汇总的 chat_daily_stats"""
+    return {"chat_id": chat_id, "days": await get_daily_stats(chat_id, date_from, date_to)}
+
+
+@router.get("/stats/top-senders")
+async def top_senders(
+        chat_id: str = Query(..., description="频道/群组ID"),
+        date_from: Optional[date] = Query(None, description="起始日期"),
+        date_to: Optional[date] = Query(None, description="结束日期"),
+        limit: int = Query(10, ge=1, le=100),
+):
+    """时间范围内发言最多的发送者，读取预先汇总的 chat_sender_daily_stats"""
+    return {"chat_id": chat_id, "senders": await get_top_senders(chat_id, date_from, date_to, limit)}
@@ -0,0 +1,22 @@
+# suggest.py
+from typing import List, Optional
+
+from fastapi import APIRouter, Query
+
+from core.config import config
+from core.suggest import Suggester
+
+router = APIRouter()
+
+suggester = Suggester()
+
+
+@router.get("/suggest")
+async def suggest(
+        q: str = Query(..., min_length=1, description="已输入的前缀，支持汉字和拼音"),
+        chat_id: Optional[List[str]] = Query(None, description="只联想这些频道/群组中的消息，可重复"),
+        size: int = Query(config.SUGGEST_MAX_SIZE, ge=1, le=config.SUGGEST_MAX_SIZE),
+):
+    """输入联想：返回以 q 开头的消息，热门前缀直接从缓存返回"""
+    suggestions, cached = await suggester.suggest(q, chat_id, size)
+    return {"suggestions": suggestions, "cached": cached}
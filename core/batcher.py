@@ -0,0 +1,128 @@
+# batcher.py
+import asyncio
+import time
+
+import orjson
+
+from core.config import config
+
+
+def json_size(doc):
+    """估算一条文档序列化后的字节数"""
+    return len(orjson.dumps(doc, default=str))
+
+
+def is_rejection(exc):
+    """
+    判断写入异常是否属于"写入端过载"类的拒绝，这类错误应当缩小批量后重试，
+    而不是直接让任务失败：
+    - Elasticsearch 返回 429（线程池队列满 / 熔断）
+    - MySQL 锁等待超时（1205）或死锁（1213）
+    """
+    status = getattr(exc, 'status_code', None) or getattr(getattr(exc, 'meta', None), 'status', None)
+    if status == 429:
+        return True
+    # helpers.bulk 抛出的 BulkIndexError，所有失败条目都是 429 时视为拒绝
+    errors = getattr(exc, 'errors', None)
+    if errors and isinstance(errors, list):
+        statuses = [next(iter(item.values()), {}).get('status') for item in errors if isinstance(item, dict)]
+        if statuses and all(s == 429 for s in statuses):
+            return True
+    args = getattr(exc, 'args', ())
+    return bool(args) and args[0] in (1205, 1213)
+
+
+class AdaptiveBatcher:
+    """
+    按 文档数 / 字节数 / 最大等待时间 三者中先达到者触发刷新的批量缓冲。
+
+    目标批量大小根据每次写入的耗时和拒绝情况自动调整（AIMD）：
+    满批写入明显快于目标耗时则放大，慢于目标耗时则缩小，被拒绝则减半。
+    这样回填时能逐步放大到高效的大批量，实时订阅也能在 max_latency 内落库。
+    """
+
+    def __init__(self, max_docs=None, max_bytes=None, max_latency=None,
+                 min_docs=None, target_latency=None, sizeof=json_size):
+        self.max_docs = max_docs or config.BATCH_SIZE
+        self.max_bytes = max_bytes or config.BATCH_MAX_BYTES
+        self.max_latency = max_latency if max_latency is not None else config.BATCH_MAX_LATENCY
+        self.min_docs = min(min_docs or config.BATCH_MIN_SIZE, self.max_docs)
+        self.target_latency = target_latency or config.BATCH_TARGET_LATENCY
+        self.sizeof = sizeof
+
+        self.target_size = max(self.min_docs, self.max_docs // 10)
+        self.items = []
+        self.bytes = 0
+        self.first_added_at = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item):
+        """加入一条文档，返回是否应当立即刷新"""
+        if not self.items:
+            self.first_added_at = time.monotonic()
+        self.items.append(item)
+        self.bytes += self.sizeof(item)
+        return self.should_flush()
+
+    def should_flush(self):
+        if not self.items:
+            return False
+        return (len(self.items) >= self.target_size
+                or self.bytes >= self.max_bytes
+                or self.time_left() <= 0)
+
+    def time_left(self):
+        """距离最大等待时间还剩多少秒；缓冲为空时返回 None"""
+        if not self.items:
+            return None
+        return max(0.0, self.first_added_at + self.max_latency - time.monotonic())
+
+    def drain(self):
+        """取出当前缓冲中的全部文档"""
+        items = self.items
+        self.items = []
+        self.bytes = 0
+        self.first_added_at = None
+        return items
+
+    def record(self, docs, elapsed, rejected=False):
+        """根据一次写入的结果调整目标批量大小"""
+        if rejected:
+            self.target_size = max(self.min_docs, self.target_size // 2)
+        elif elapsed > self.target_latency:
+            self.target_size = max(self.min_docs, int(self.target_size * 0.75))
+        elif docs >= self.target_size and elapsed < self.target_latency / 2:
+            # 只有满批时的耗时才能说明写入端还有余量
+            self.target_size = min(self.max_docs, int(self.target_size * 1.5) + 1)
+
+    async def flush(self, write, retries=5):
+        """
+        取出缓冲并调用 write 写入（write 为协程函数），被写入端拒绝时
+        按缩小后的目标批量拆分被拒绝的批次，退避后逐个重试，返回写入的文档数。
+        retries 为连续被拒绝的最大重试次数。
+        """
+        pending = [self.drain()]
+        written = 0
+        delay = 0.5
+        attempt = 0
+        while pending:
+            batch = pending.pop(0)
+            started = time.monotonic()
+            try:
+                await write(batch)
+            except Exception as e:
+                if attempt == retries or not is_rejection(e):
+                    raise
+                attempt += 1
+                self.record(len(batch), time.monotonic() - started, rejected=True)
+                pending[:0] = [batch[i:i + self.target_size] for i in range(0, len(batch), self.target_size)]
+                await asyncio.sleep(delay)
+                delay *= 2
+                continue
+            self.record(len(batch), time.monotonic() - started)
+            written += len(batch)
+            attempt = 0
+            delay = 0.5
+        return written
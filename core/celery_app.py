@@ -13,7 +13,7 @@ celery_app = Celery(
     "telegram_scraper",
     broker=REDIS_URL,
     backend=REDIS_URL,
-    include=["app.tasks.telegram_scraper"]  # 自动发现任务的模块列表
+    include=["tasks.telegram_scraper"]  # 自动发现任务的模块列表
 )
 
 # 可选的 Celery 配置
@@ -0,0 +1,82 @@
+# checkpoint.py
+from collections import deque
+
+from core.mysql import get_mysql_pool
+
+CREATE_CHECKPOINT_TABLE_SQL = """
+                              CREATE TABLE IF NOT EXISTS scrape_checkpoint
+                              (
+                                  chat_id         VARCHAR(300) NOT NULL COMMENT '群组/频道ID',
+                                  last_message_id BIGINT       NOT NULL COMMENT '已同时写入 ES 和 MySQL 的最大消息ID',
+                                  updated_at      TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '最后更新时间',
+                                  PRIMARY KEY (chat_id)
+                              ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='抓取断点'
+                              """
+
+
+async def create_checkpoint_table():
+    """创建 scrape_checkpoint 表（如果不存在）"""
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(CREATE_CHECKPOINT_TABLE_SQL)
+        await conn.commit()
+
+
+async def get_checkpoint(chat_id):
+    """读取聊天的断点，没有记录时返回 None"""
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                "SELECT last_message_id FROM scrape_checkpoint WHERE chat_id = %s", (chat_id,)
+            )
+            row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+async def save_checkpoint(chat_id, message_id):
+    """推进聊天的断点，只会变大不会回退"""
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                """
+                INSERT INTO scrape_checkpoint (chat_id, last_message_id)
+                VALUES (%s, %s) ON DUPLICATE KEY
+                UPDATE last_message_id = GREATEST(last_message_id, VALUES (last_message_id))
+                """,
+                (chat_id, message_id),
+            )
+        await conn.commit()
+
+
+class CheckpointTracker:
+    """
+    跟踪流水线中各写入端的完成情况，计算可以安全记录的断点。
+
+    文档按消息ID递增的顺序产生，但不同写入端、不同消费者的批次会乱序完成。
+    只有当某条消息及其之前的所有消息都已被每个写入端写入时，断点才推进到该消息。
+    写入失败、已 fsync 到本地缓冲的批次也要通过 written 报告，否则断点停在这一批之前，
+    之后所有消息都会留在 inflight 和 done 中。
+    """
+
+    def __init__(self, chat_id, sinks):
+        self.chat_id = chat_id
+        self.inflight = deque()
+        self.done = {name: set() for name in sinks}
+        self.last_message_id = None
+
+    def add(self, message_id):
+        """记录一条已放入流水线的消息"""
+        self.inflight.append(message_id)
+
+    async def written(self, sink, docs):
+        """记录写入（或已落盘到本地缓冲）的批次，断点推进时持久化"""
+        self.done[sink].update(doc.message_id for doc in docs)
+        advanced = False
+        while self.inflight and all(self.inflight[0] in done for done in self.done.values()):
+            message_id = self.inflight.popleft()
+            for done in self.done.values():
+                done.discard(message_id)
+            self.last_message_id = message_id
+            advanced = True
+        if advanced:
+            await save_checkpoint(self.chat_id, self.last_message_id)
@@ -14,23 +14,98 @@ class Config:
     API_ID = os.getenv('API_ID')
     API_HASH = os.getenv('API_HASH')
     SESSION_NAME = os.getenv('SESSION_NAME', 'telegram_scraper')
+    # 会话池：逗号分隔的会话文件名（不含 .session），未配置时只使用 SESSION_NAME
+    SESSION_POOL = [name.strip() for name in os.getenv('SESSION_POOL', SESSION_NAME).split(',') if name.strip()]
+    SESSION_LOCK_TTL = int(os.getenv('SESSION_LOCK_TTL', 60))  # 会话锁过期秒数，持有期间后台续期
+    SESSION_LEASE_TIMEOUT = float(os.getenv('SESSION_LEASE_TIMEOUT', 300))  # 等待空闲会话的最长秒数
+    SESSION_COOLDOWN_THRESHOLD = int(os.getenv('SESSION_COOLDOWN_THRESHOLD', 60))  # FloodWait 超过该秒数时会话进入冷却
+    SESSION_HEALTH_TTL = int(os.getenv('SESSION_HEALTH_TTL', 3600))  # FloodWait 计数的保留时间
+    SESSION_DISABLE_TTL = int(os.getenv('SESSION_DISABLE_TTL', 86400))  # 账号失效时的停用时间
+    ENTITY_CACHE_TTL = int(os.getenv('ENTITY_CACHE_TTL', 86400))  # 实体缓存刷新间隔（秒）
+    ENTITY_CACHE_SIZE = int(os.getenv('ENTITY_CACHE_SIZE', 10000))  # 进程内实体缓存最多条目数
+    CHANNEL_CACHE_TTL = int(os.getenv('CHANNEL_CACHE_TTL', 3600))  # 频道元数据重新写入 MySQL 的间隔（秒）
+
+    # Redis 配置（Celery、进度、会话锁共用）
+    REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 
     # MySQL 数据库连接配置
     MYSQL_HOST = os.getenv('MYSQL_HOST', 'localhost')
     MYSQL_PORT = int(os.getenv('MYSQL_PORT', 3306))
     MYSQL_USER = os.getenv('MYSQL_USER')
     MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD')
-    MYSQL_DB = os.getenv('MYSQL_DB')
+    MYSQL_DB = os.getenv('MYSQL_DB', os.getenv('MYSQL_DATABASE'))
+    MYSQL_POOL_SIZE = int(os.getenv('MYSQL_POOL_SIZE', 8))  # 异步连接池最大连接数
+    MYSQL_IDLE_PING = float(os.getenv('MYSQL_IDLE_PING', 30))  # 连接空闲超过该秒数后，取出时先 ping
+    # 大批量写入时用 LOAD DATA LOCAL INFILE 导入临时表再合并，需要服务端开启 local_infile
+    MYSQL_BULK_LOAD = os.getenv('MYSQL_BULK_LOAD', 'false').lower() == 'true'
+    MYSQL_BULK_THRESHOLD = int(os.getenv('MYSQL_BULK_THRESHOLD', 1000))  # 单批 upsert 达到该条数时走 LOAD DATA
+    MYSQL_BULK_TMPDIR = os.getenv('MYSQL_BULK_TMPDIR')  # LOAD DATA 临时文件目录，默认系统临时目录
+    ROLLUPS_ENABLED = os.getenv('ROLLUPS_ENABLED', 'true').lower() == 'true'  # 写入消息时同时维护按天汇总的统计表
+    # telegram_message 使用按月分区、chat_id 为数字键的布局；已有的表需先用 cli.py mysql-migrate 迁移
+    MYSQL_PARTITIONED = os.getenv('MYSQL_PARTITIONED', 'false').lower() == 'true'
+    MYSQL_PARTITION_START = os.getenv('MYSQL_PARTITION_START')  # 新建分区表的第一个月份分区，如 2020-01，默认当前月
+    MYSQL_PARTITION_MONTHS_AHEAD = int(os.getenv('MYSQL_PARTITION_MONTHS_AHEAD', 3))  # 提前创建的未来月份分区数
+    MYSQL_MIGRATE_CHUNK_SIZE = int(os.getenv('MYSQL_MIGRATE_CHUNK_SIZE', 5000))  # 迁移时每次复制的 id 区间大小
 
     # Elasticsearch 连接配置
-    ES_HOSTS = os.getenv('ES_HOSTS', 'http://localhost:9200').split(',')
-    ES_INDEX_NAME = os.getenv('ES_INDEX_NAME', 'telegram_messages')
+    ES_HOSTS = os.getenv('ES_HOSTS', os.getenv('ES_HOST', 'http://localhost:9200')).split(',')
+    ES_CONNECTIONS = int(os.getenv('ES_CONNECTIONS', 10))  # 每个节点的 HTTP 连接数
+    ES_INDEX_NAME = os.getenv('ES_INDEX_NAME', 'telegram_messages')  # 周期索引名前缀，如 telegram_messages-2024.05
+    ES_INDEX_PERIOD = os.getenv('ES_INDEX_PERIOD', 'month')  # 索引分区周期：day / month / year
+    ES_INDEX_SHARDS = int(os.getenv('ES_INDEX_SHARDS', 1))  # 每个周期索引的主分片数
+    # 按 chat_id 路由时，一个聊天的文档分散到的分片数；大于 1 时必须小于 ES_INDEX_SHARDS
+    ES_ROUTING_PARTITION_SIZE = int(os.getenv('ES_ROUTING_PARTITION_SIZE', 1))
+    ES_WRITE_ALIAS = os.getenv('ES_WRITE_ALIAS', 'telegram_messages_write')  # 指向当前周期索引的写别名
+    ES_READ_ALIAS = os.getenv('ES_READ_ALIAS', 'telegram_messages_read')  # 覆盖所有周期索引的读别名
+    ES_SHRINK_SHARDS = int(os.getenv('ES_SHRINK_SHARDS', 0))  # 整理已结束周期时收缩到的主分片数，0 为不收缩
+    # 批量导入模式：回填期间关闭刷新和副本，结束后恢复
+    ES_BULK_MODE_TTL = int(os.getenv('ES_BULK_MODE_TTL', 1800))  # 使用者未续期多少秒后视为已崩溃
+    ES_BULK_TRANSLOG_ASYNC = os.getenv('ES_BULK_TRANSLOG_ASYNC', 'false').lower() == 'true'  # 是否同时把 translog 改为 async
+    ES_FORCE_MERGE_SEGMENTS = int(os.getenv('ES_FORCE_MERGE_SEGMENTS', 5))  # 恢复后 force merge 的目标段数，0 为不合并
 
     # 性能调优参数
-    BATCH_SIZE = int(os.getenv('BATCH_SIZE', 1000))
+    BATCH_SIZE = int(os.getenv('BATCH_SIZE', 1000))  # 单批最大文档数
+    BATCH_MIN_SIZE = int(os.getenv('BATCH_MIN_SIZE', 10))  # 自适应调整的下限
+    BATCH_MAX_BYTES = int(os.getenv('BATCH_MAX_BYTES', 5 * 1024 * 1024))  # 单批最大字节数
+    BATCH_MAX_LATENCY = float(os.getenv('BATCH_MAX_LATENCY', 1.0))  # 文档在缓冲中的最长等待秒数
+    BATCH_TARGET_LATENCY = float(os.getenv('BATCH_TARGET_LATENCY', 1.0))  # 单次批量写入的目标耗时（秒）
+    LIVE_BATCH_SIZE = int(os.getenv('LIVE_BATCH_SIZE', 500))  # 实时订阅单批最大文档数
+    LIVE_FLUSH_INTERVAL = float(os.getenv('LIVE_FLUSH_INTERVAL', 0.2))  # 实时订阅消息在缓冲中的最长等待秒数
     QUEUE_MAX_SIZE = int(os.getenv('QUEUE_MAX_SIZE', 10000))
     MYSQL_CONSUMERS = int(os.getenv('MYSQL_CONSUMERS', 2))
     ES_CONSUMERS = int(os.getenv('ES_CONSUMERS', 2))
+    FLOOD_MAX_RETRIES = int(os.getenv('FLOOD_MAX_RETRIES', 5))  # 同一请求因 FloodWait 重试的最大次数
+    FLOOD_MIN_PAGE_DELAY = float(os.getenv('FLOOD_MIN_PAGE_DELAY', 0.25))  # 翻页间隔的调整步长（秒）
+    FLOOD_MAX_PAGE_DELAY = float(os.getenv('FLOOD_MAX_PAGE_DELAY', 10))  # 翻页间隔上限（秒）
+    FLOOD_RELAX_PAGES = int(os.getenv('FLOOD_RELAX_PAGES', 50))  # 连续多少页未被限流后缩短翻页间隔
+    SCRAPE_CONCURRENCY = int(os.getenv('SCRAPE_CONCURRENCY', 4))  # scrape 命令同时爬取的聊天数
+    SCRAPE_SHARDS = int(os.getenv('SCRAPE_SHARDS', 8))  # 大范围回填默认切分的分片数
+    SCRAPE_PROBES_PER_SHARD = int(os.getenv('SCRAPE_PROBES_PER_SHARD', 4))  # 每个分片对应的密度采样次数
+    SCRAPE_PROGRESS_EVERY = int(os.getenv('SCRAPE_PROGRESS_EVERY', 1000))  # 每个聊天每抓取多少条消息输出一次进度
+
+    # 本地预写缓冲：写入端不可用时暂存失败的批次，恢复后回放
+    SPOOL_DIR = os.getenv('SPOOL_DIR', 'spool')
+    SPOOL_SEGMENT_BYTES = int(os.getenv('SPOOL_SEGMENT_BYTES', 64 * 1024 * 1024))  # 单个段文件的最大字节数
+    SPOOL_FSYNC = os.getenv('SPOOL_FSYNC', 'interval')  # always / interval / never
+    SPOOL_FSYNC_INTERVAL = float(os.getenv('SPOOL_FSYNC_INTERVAL', 1.0))  # interval 策略下两次 fsync 的最短间隔（秒）
+    SPOOL_REPLAY_INTERVAL = float(os.getenv('SPOOL_REPLAY_INTERVAL', 10))  # 后台检查并回放缓冲的间隔（秒）
+
+    # 搜索 API
+    HOST = os.getenv('HOST', '0.0.0.0')
+    PORT = int(os.getenv('PORT', 8000))
+    SEARCH_MAX_SIZE = int(os.getenv('SEARCH_MAX_SIZE', 100))  # 单次搜索最多返回的条数
+    SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 1000))  # 搜索结果缓存的最多条目数
+    SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', 60))  # 搜索结果缓存秒数，0 为不缓存
+    SEARCH_CACHE_REFRESH_WINDOW = float(os.getenv('SEARCH_CACHE_REFRESH_WINDOW', 1.0))  # 聊天写入后多少秒内的搜索结果不缓存，不应小于索引的 refresh_interval
+    SEARCH_PIT_KEEP_ALIVE = os.getenv('SEARCH_PIT_KEEP_ALIVE', '2m')  # 游标分页的 PIT 在两次翻页之间的保留时间
+    SEARCH_EXPORT_PAGE_SIZE = int(os.getenv('SEARCH_EXPORT_PAGE_SIZE', 1000))  # 流式导出每次向 ES 取的条数
+    SUGGEST_MAX_SIZE = int(os.getenv('SUGGEST_MAX_SIZE', 10))  # 单次联想最多返回的条数
+    SUGGEST_CACHE_SIZE = int(os.getenv('SUGGEST_CACHE_SIZE', 10000))  # 联想前缀缓存的最多条目数
+    SUGGEST_CACHE_TTL = float(os.getenv('SUGGEST_CACHE_TTL', 300))  # 联想前缀缓存秒数
+    SUGGEST_BUDGET_MS = float(os.getenv('SUGGEST_BUDGET_MS', 8))  # 联想请求等待 ES 的最长毫秒数，超时先返回空结果
+
+    # 日志配置
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 
 # 创建一个全局可用的配置实例
 config = Config()
\ No newline at end of file
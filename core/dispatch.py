@@ -0,0 +1,61 @@
+# dispatch.py
+from telethon import utils
+
+from core.schema import chat_id_of
+
+
+class ChatDescriptor:
+    """
+    一个已订阅聊天的描述：命令行里写的名字、解析出的实体、事件中使用的 peer id，
+    以及写入时使用的规范 chat_id（见 core.schema.chat_id_of）和用户名
+    """
+
+    __slots__ = ('name', 'entity', 'peer_id', 'chat_id', 'username')
+
+    def __init__(self, name, entity, peer_id):
+        self.name = name
+        self.entity = entity
+        self.peer_id = peer_id
+        self.chat_id = chat_id_of(entity)
+        self.username = getattr(entity, 'username', None)
+
+
+class ChatDispatcher:
+    """
+    peer id -> ChatDescriptor 的分发表。
+
+    事件中的 event.chat_id 是带标记的 peer id（频道为 -100 开头），与 entity.id 不同，
+    这里统一用 utils.get_peer_id 建索引，收到消息时一次字典查找即可找到对应的聊天，
+    耗时与订阅的聊天数量无关。
+    """
+
+    def __init__(self):
+        self.chats = {}
+
+    def add(self, name, entity):
+        peer_id = utils.get_peer_id(entity)
+        descriptor = ChatDescriptor(name, entity, peer_id)
+        self.chats[peer_id] = descriptor
+        return descriptor
+
+    def get(self, peer_id):
+        return self.chats.get(peer_id)
+
+    def entities(self):
+        return [descriptor.entity for descriptor in self.chats.values()]
+
+    def __len__(self):
+        return len(self.chats)
+
+    def register(self, client, builder, handler):
+        """
+        在 client 上注册一个事件处理器，把属于已订阅聊天的事件交给 handler(event, descriptor)。
+        不把聊天列表交给 Telethon 过滤，所有过滤都在这里的一次字典查找中完成。
+        """
+        async def dispatch(event):
+            descriptor = self.chats.get(event.chat_id)
+            if descriptor is not None:
+                await handler(event, descriptor)
+
+        client.add_event_handler(dispatch, builder)
+        return dispatch
@@ -0,0 +1,129 @@
+# entity_cache.py
+import base64
+import time
+from collections import OrderedDict
+
+from telethon.extensions import BinaryReader
+
+from core.config import config
+
+
+def _normalize(chat):
+    """同一个聊天的不同写法（@Name / name / 数字ID）映射到同一个缓存键"""
+    if isinstance(chat, int):
+        return str(chat)
+    chat = str(chat).strip()
+    for prefix in ('https://t.me/', 'http://t.me/', 't.me/', '@'):
+        if chat.lower().startswith(prefix):
+            chat = chat[len(prefix):]
+    return chat.lower()
+
+
+def dumps_entity(entity):
+    """把 Telethon 实体序列化为 TL 二进制并 base64 编码，反序列化后与原对象完全一致"""
+    return base64.b64encode(entity._bytes()).decode('ascii')
+
+
+def loads_entity(data):
+    return BinaryReader(base64.b64decode(data)).tgread_object()
+
+
+class EntityCache:
+    """
+    两级实体缓存：进程内 LRU + Redis 共享存储。
+
+    Redis 中的键为 entity_cache:{session}:{chat}，值为 "获取时间戳:序列化实体"。
+    access_hash 与账号绑定，所以缓存按会话隔离。超过 ttl 的条目在下次读取时
+    重新向 Telegram 解析；解析失败时退回使用旧值，避免因为一次 FloodWait 让启动失败。
+    """
+
+    def __init__(self, fetch, redis_client, session, ttl=None, maxsize=None):
+        """
+        :param fetch: 协程函数 fetch(chat 或 chat 列表)，真正向 Telegram 解析实体
+        :param redis_client: redis.asyncio 客户端（decode_responses=True）
+        :param session: 会话名，用于隔离不同账号的缓存
+        """
+        self.fetch = fetch
+        self.redis = redis_client
+        self.session = session
+        self.ttl = ttl or config.ENTITY_CACHE_TTL
+        self.maxsize = maxsize or config.ENTITY_CACHE_SIZE
+        self.local = OrderedDict()
+
+    def _key(self, name):
+        return f"entity_cache:{self.session}:{name}"
+
+    def _remember(self, name, entity, fetched_at):
+        self.local[name] = (fetched_at, entity)
+        self.local.move_to_end(name)
+        while len(self.local) > self.maxsize:
+            self.local.popitem(last=False)
+
+    async def _store(self, name, entity):
+        now = time.time()
+        self._remember(name, entity, now)
+        # Redis 中保留更久，过期但仍可作为解析失败时的后备
+        await self.redis.set(self._key(name), f"{int(now)}:{dumps_entity(entity)}", ex=self.ttl * 7)
+
+    async def get(self, chat):
+        name = _normalize(chat)
+        now = time.time()
+
+        hit = self.local.get(name)
+        if hit and now - hit[0] < self.ttl:
+            self.local.move_to_end(name)
+            return hit[1]
+
+        stale = hit[1] if hit else None
+        raw = await self.redis.get(self._key(name))
+        if raw:
+            fetched_at, data = raw.split(':', 1)
+            entity = loads_entity(data)
+            if now - int(fetched_at) < self.ttl:
+                self._remember(name, entity, int(fetched_at))
+                return entity
+            stale = entity
+
+        try:
+            entity = await self.fetch(chat)
+        except Exception:
+            if stale is None:
+                raise
+            return stale
+        await self._store(name, entity)
+        return entity
+
+    async def warm(self, chats):
+        """
+        启动时批量预热：一次 MGET 读出 Redis 中的所有条目，
+        缺失或过期的再一次性交给 Telethon 批量解析。
+        """
+        names = [_normalize(chat) for chat in chats]
+        if not names:
+            return
+        now = time.time()
+        missing = []
+        for chat, name, raw in zip(chats, names, await self.redis.mget([self._key(n) for n in names])):
+            if raw:
+                fetched_at, data = raw.split(':', 1)
+                if now - int(fetched_at) < self.ttl:
+                    self._remember(name, loads_entity(data), int(fetched_at))
+                    continue
+            missing.append((chat, name))
+        if not missing:
+            return
+
+        try:
+            entities = await self.fetch([chat for chat, _ in missing])
+        except Exception:
+            # 批量解析中只要有一个无效就会整体失败，退回逐个解析并跳过无效的
+            entities = []
+            for chat, _ in missing:
+                try:
+                    entities.append(await self.fetch(chat))
+                except Exception as e:
+                    print(f"✗ 无法解析 {chat}: {e}")
+                    entities.append(None)
+        for (chat, name), entity in zip(missing, entities):
+            if entity is not None:
+                await self._store(name, entity)
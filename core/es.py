@@ -0,0 +1,199 @@
+# es.py
+from datetime import datetime, timezone
+
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import BulkIndexError, async_streaming_bulk
+
+from core.config import config
+from core.schema import MessageRecord, document_id
+from core.search_cache import bump_generations, close_generations_client
+
+# 进程内共享的异步客户端，底层是带连接池的 aiohttp 会话，多个协程可以并发发送 bulk 请求
+_es_client = None
+
+
+def get_es_client():
+    """获取（必要时创建）共享的 AsyncElasticsearch 客户端"""
+    global _es_client
+    if _es_client is None:
+        _es_client = AsyncElasticsearch(
+            hosts=config.ES_HOSTS,
+            request_timeout=120,
+            connections_per_node=config.ES_CONNECTIONS,
+        )
+    return _es_client
+
+
+async def close_es_client():
+    """关闭共享客户端（及搜索缓存失效用的 Redis 客户端）；每个事件循环结束前都应调用（如 Celery 任务中的 asyncio.run）"""
+    global _es_client
+    if _es_client is not None:
+        await _es_client.close()
+        _es_client = None
+    await close_generations_client()
+
+
+# 分区周期 -> 索引名中的日期格式
+_PERIOD_FORMATS = {
+    "day": "%Y.%m.%d",
+    "month": "%Y.%m",
+    "year": "%Y",
+}
+
+
+def index_pattern():
+    """所有周期索引的通配名"""
+    return f"{config.ES_INDEX_NAME}-*"
+
+
+def index_for(date=None):
+    """消息发送时间所在周期的索引名，如 telegram_messages-2024.05；不传时为当前周期"""
+    if date is None:
+        date = datetime.now(timezone.utc)
+    elif isinstance(date, str):
+        date = datetime.fromisoformat(date)
+    return f"{config.ES_INDEX_NAME}-{date.strftime(_PERIOD_FORMATS[config.ES_INDEX_PERIOD])}"
+
+
+def chat_routing(chat_ids):
+    """
+    文档按 chat_id 路由，同一聊天的消息落在同一个（或 routing_partition_size 个）分片上，
+    限定聊天的查询只需访问这些分片。接受单个 chat_id 或多个 chat_id。
+    """
+    if isinstance(chat_ids, (str, int)):
+        return str(chat_ids)
+    return ",".join(sorted(str(chat_id) for chat_id in chat_ids))
+
+
+def chat_query(chat_ids, query=None):
+    """给查询加上 chat_id 过滤；chat_ids 为 None 时原样返回"""
+    if chat_ids is None:
+        return query
+    if isinstance(chat_ids, (str, int)):
+        chat_ids = [chat_ids]
+    chat_filter = {"terms": {"chat_id": [str(chat_id) for chat_id in chat_ids]}}
+    return {"bool": {"must": [query] if query else [], "filter": [chat_filter]}}
+
+
+async def search_messages(chat_ids=None, query=None, index=None, **kwargs):
+    """
+    在读别名上搜索消息。指定 chat_ids 时自动加上 chat_id 过滤和对应的 routing，
+    请求只会发往这些聊天所在的分片。其余参数原样传给 AsyncElasticsearch.search。
+    """
+    if chat_ids is not None:
+        kwargs["routing"] = chat_routing(chat_ids)
+    return await get_es_client().search(index=index or config.ES_READ_ALIAS, query=chat_query(chat_ids, query), **kwargs)
+
+
+def _actions(docs, index):
+    """
+    MessageRecord 整条写入，正文是预先编码好的 JSON 字节；带 _op 的字典是编辑/删除事件：
+    _op 为 update 时只局部更新其余字段，为 delete 时删除对应文档。
+    未指定 index 时按消息的发送时间写入对应周期的索引，没有时间的写入写别名。
+    """
+    for doc in docs:
+        if isinstance(doc, MessageRecord):
+            yield {
+                "_index": index or index_for(doc.date),
+                "_id": doc.doc_id,
+                "routing": chat_routing(doc.chat_id),
+                "_source": doc.es_source(),
+            }
+            continue
+        action = {
+            "_index": index or (index_for(doc['date']) if doc.get('date') else config.ES_WRITE_ALIAS),
+            "_id": document_id(doc['chat_id'], doc['message_id']),
+            "routing": chat_routing(doc['chat_id']),
+        }
+        if doc['_op'] == 'update':
+            action["_op_type"] = "update"
+            action["doc"] = {k: v for k, v in doc.items() if k != '_op'}
+        else:
+            action["_op_type"] = "delete"
+        yield action
+
+
+def _missing(item):
+    """编辑或删除的消息在索引中不存在（从未抓取过），不算失败"""
+    op_type, result = next(iter(item.items()))
+    return op_type in ('update', 'delete') and result.get('status') == 404
+
+
+def _runs(docs, index):
+    """
+    按原顺序把批次切分为 (是否按查询删除, 文档列表) 的连续片段。
+
+    删除事件通常带有从 MySQL 查到的发送时间，没有时取同一批次中前面写入的同一条消息的时间，
+    这些删除和其余操作一起作为 bulk delete 按顺序执行。仍然不知道所在周期索引的删除
+    （如消息还没写入 MySQL）单独成段，通过读别名按 _id 删除。
+    """
+    dates = {}
+    runs = []
+    for doc in docs:
+        by_query = False
+        if isinstance(doc, MessageRecord):
+            dates[(doc.chat_id, doc.message_id)] = doc.date
+        elif doc['_op'] == 'delete' and index is None and not doc.get('date'):
+            date = dates.get((doc['chat_id'], doc['message_id']))
+            if date is not None:
+                doc = {**doc, 'date': date}
+            else:
+                by_query = True
+        if runs and runs[-1][0] == by_query:
+            runs[-1][1].append(doc)
+        else:
+            runs.append((by_query, [doc]))
+    return runs
+
+
+async def _bulk(docs, index, errors):
+    success = 0
+    async for ok, item in async_streaming_bulk(
+            get_es_client(),
+            _actions(docs, index),
+            chunk_size=max(len(docs), 1),
+            max_chunk_bytes=config.BATCH_MAX_BYTES * 2,
+            raise_on_error=False,
+    ):
+        if ok or _missing(item):
+            success += 1
+        else:
+            errors.append(item)
+    return success
+
+
+async def _delete_by_query(deletes):
+    es = get_es_client()
+    # delete_by_query 只能看到已刷新的文档：先刷新，之前的片段和刚写入的批次才会被删除；
+    # 批量导入模式下 refresh_interval 为 -1，同样需要显式刷新
+    await es.indices.refresh(index=config.ES_READ_ALIAS)
+    await es.delete_by_query(
+        index=config.ES_READ_ALIAS,
+        query={"ids": {"values": [document_id(doc['chat_id'], doc['message_id']) for doc in deletes]}},
+        routing=chat_routing({doc['chat_id'] for doc in deletes}),
+        conflicts="proceed",
+    )
+    return len(deletes)
+
+
+async def save_to_es(docs, index=None):
+    """
+    批量写入 Elasticsearch，出错时与 helpers.bulk 一样抛出 BulkIndexError。
+    批次中的新增、编辑、删除按原顺序执行。返回成功写入的文档数。写入后使涉及的聊天的搜索缓存失效。
+    """
+    errors = []
+    success = 0
+    chat_ids = {doc.chat_id if isinstance(doc, MessageRecord) else doc['chat_id'] for doc in docs}
+    try:
+        for by_query, run in _runs(docs, index):
+            if by_query:
+                success += await _delete_by_query(run)
+            else:
+                success += await _bulk(run, index, errors)
+    finally:
+        # 部分失败时成功写入的文档同样需要失效；这些文档下一次 refresh 后才能被搜到，
+        # 在那之前算出的结果不会被缓存（见 SearchCache）
+        await bump_generations(chat_ids)
+    if errors:
+        raise BulkIndexError(f"{len(errors)} document(s) failed to index.", errors)
+    return success
@@ -0,0 +1,204 @@
+# es_bulk.py
+import asyncio
+import json
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+import redis.asyncio as aioredis
+from elasticsearch import NotFoundError
+
+from core.config import config
+from core.es import get_es_client, index_for, index_pattern
+from core.es_index import index_template
+from core.search_cache import bump_epoch
+
+# 批量导入期间临时修改的索引设置
+_BULK_SETTINGS = ("index.refresh_interval", "index.number_of_replicas", "index.translog.durability")
+
+
+def _next_period(date):
+    """date 所在周期的下一个周期中的某个时间"""
+    if config.ES_INDEX_PERIOD == "day":
+        return date + timedelta(days=1)
+    if config.ES_INDEX_PERIOD == "month":
+        return date.replace(day=1) + timedelta(days=32)
+    return date.replace(year=date.year + 1, month=1, day=1)
+
+
+class BulkLoadMode:
+    """
+    大规模回填期间的 Elasticsearch 批量导入模式。
+
+    默认作用于所有历史周期索引。进入时把索引的 refresh_interval 设为 -1、副本数设为 0
+   （可选把 translog 改为 async），最后一个使用者退出时恢复原设置、refresh 并发起 force merge。
+    回填的旧周期索引大多在进入之后才由模板自动创建，所以同时安装一个优先级更高、
+    带批量导入设置的索引模板，退出时删除它，并把期间新建的索引恢复为默认设置。
+
+    实时订阅写入的索引（写别名指向的索引、当前和下一个周期的索引）不进入批量导入模式：
+    修改设置、refresh 和 force merge 都排除它们，另有一个优先级更高的模板让它们按正常设置创建。
+
+    原设置保存在 Redis 的 es_bulk_mode:{index} 中，正在回填的任务记录在
+    es_bulk_mode:{index}:holders 有序集合里（分数为过期时间），由后台任务续期。
+    进程崩溃后它的记录会过期，下一次 enter 或 recover 发现没有存活的使用者时就恢复原设置，
+    索引不会一直停留在不刷新、无副本的状态。
+    """
+
+    def __init__(self, index=None, redis_client=None, ttl=None):
+        self.index = index or index_pattern()
+        self.redis = redis_client or aioredis.from_url(config.REDIS_URL, decode_responses=True)
+        self.ttl = ttl or config.ES_BULK_MODE_TTL
+        self.state_key = f"es_bulk_mode:{self.index}"
+        self.holders_key = f"es_bulk_mode:{self.index}:holders"
+        self.template = f"{config.ES_INDEX_NAME}_bulk_mode"
+        self.live_template = f"{config.ES_INDEX_NAME}_bulk_mode_live"
+
+    def _lock(self):
+        return self.redis.lock(f"es_bulk_mode:{self.index}:lock", timeout=60, blocking_timeout=60)
+
+    async def _live_holders(self):
+        await self.redis.zremrangebyscore(self.holders_key, "-inf", time.time())
+        return await self.redis.zcard(self.holders_key)
+
+    async def _live_indices(self):
+        """实时写入的索引：写别名指向的索引，以及当前和下一个周期的索引"""
+        now = datetime.now(timezone.utc)
+        live = {index_for(now), index_for(_next_period(now))}
+        try:
+            response = await get_es_client().indices.get_alias(name=config.ES_WRITE_ALIAS)
+            live.update(response.body)
+        except NotFoundError:
+            pass
+        return sorted(live)
+
+    def _target(self, live):
+        """排除实时写入索引后的索引表达式"""
+        return ",".join([self.index] + [f"-{index}" for index in live])
+
+    async def _install_template(self, bulk, live):
+        """
+        安装带批量导入设置的覆盖模板。可组合模板只应用匹配的优先级最高的一个，
+        所以覆盖模板包含正常模板的全部内容；实时写入的索引由优先级更高的正常模板覆盖回来
+        """
+        es = get_es_client()
+        await es.indices.put_index_template(
+            name=self.live_template,
+            index_patterns=live,
+            priority=200,
+            template=index_template(),
+        )
+        await es.indices.put_index_template(
+            name=self.template,
+            index_patterns=[self.index],
+            priority=100,
+            template=index_template(bulk),
+        )
+
+    async def _restore(self):
+        """恢复原设置并发起 force merge，调用方需持有锁"""
+        state = await self.redis.get(self.state_key)
+        if state is None:
+            return False
+        state = json.loads(state)
+        original, target = state["original"], self._target(state["live"])
+        es = get_es_client()
+        # 先删除覆盖模板，之后新建的索引不再使用批量导入设置
+        for template in (self.template, self.live_template):
+            try:
+                await es.indices.delete_index_template(name=template)
+            except NotFoundError:
+                pass
+        # 原来没有显式设置的项保存为 None，恢复时即重置为默认值
+        for index, settings in original.items():
+            await es.indices.put_settings(index=index, settings=settings)
+        # 批量导入期间按覆盖模板新建的索引，重置为默认设置
+        response = await es.indices.get_settings(index=target, name="index.refresh_interval")
+        created = sorted(set(response.body) - set(original))
+        if created:
+            await es.indices.put_settings(index=",".join(created), settings={name: None for name in _BULK_SETTINGS})
+        await es.indices.refresh(index=target)
+        # 批量导入期间没有 refresh，期间缓存的搜索结果都可能缺少回填的文档
+        await bump_epoch()
+        if config.ES_FORCE_MERGE_SEGMENTS:
+            # force merge 可能持续很久，不等待完成；正在写入的索引不做 force merge
+            await es.indices.forcemerge(
+                index=target, max_num_segments=config.ES_FORCE_MERGE_SEGMENTS, wait_for_completion=False
+            )
+        await self.redis.delete(self.state_key)
+        print(f"Restored settings of Elasticsearch index {self.index} after bulk load")
+        return True
+
+    async def recover(self):
+        """没有存活的使用者却仍处于批量导入模式（任务崩溃）时恢复原设置"""
+        async with self._lock():
+            if await self._live_holders() == 0:
+                return await self._restore()
+        return False
+
+    async def enter(self, token):
+        """以 token 的名义进入批量导入模式，原设置只在第一个使用者进入时保存"""
+        async with self._lock():
+            if await self._live_holders() == 0:
+                await self._restore()
+            if not await self.redis.exists(self.state_key):
+                es = get_es_client()
+                # 进入时确定排除哪些实时写入的索引，退出时按同一份名单恢复，期间跨周期也不会错乱
+                live = await self._live_indices()
+                target = self._target(live)
+                response = await es.indices.get_settings(index=target, name=list(_BULK_SETTINGS), flat_settings=True)
+                # 各周期索引的设置可能不同，逐个保存；回填期间新建的索引由覆盖模板设置
+                original = {
+                    index: {name: data.get("settings", {}).get(name) for name in _BULK_SETTINGS}
+                    for index, data in response.body.items()
+                }
+                bulk = {"index.refresh_interval": "-1", "index.number_of_replicas": 0}
+                if config.ES_BULK_TRANSLOG_ASYNC:
+                    bulk["index.translog.durability"] = "async"
+                # 先保存原设置再修改，修改到一半崩溃也能恢复
+                await self.redis.set(self.state_key, json.dumps({"original": original, "live": live}))
+                await self._install_template(bulk, live)
+                if original:
+                    await es.indices.put_settings(index=target, settings=bulk)
+                print(f"Elasticsearch index {self.index} switched to bulk load mode")
+            await self.redis.zadd(self.holders_key, {token: time.time() + self.ttl})
+
+    async def renew(self, token):
+        """延长 token 的有效期；token 已退出时不会重新加入"""
+        await self.redis.zadd(self.holders_key, {token: time.time() + self.ttl}, xx=True)
+
+    async def exit(self, token):
+        """token 退出批量导入模式，最后一个使用者退出时恢复原设置"""
+        async with self._lock():
+            await self.redis.zrem(self.holders_key, token)
+            if await self._live_holders() == 0:
+                await self._restore()
+
+    @asynccontextmanager
+    async def renewing(self, token):
+        """在 with 块执行期间定期为 token 续期（token 由其他进程 enter / exit）"""
+        async def renew():
+            while True:
+                await self.renew(token)
+                await asyncio.sleep(self.ttl / 3)
+
+        renewer = asyncio.create_task(renew())
+        try:
+            yield
+        finally:
+            renewer.cancel()
+            await asyncio.gather(renewer, return_exceptions=True)
+
+    @asynccontextmanager
+    async def hold(self, token=None):
+        """with 块执行期间处于批量导入模式"""
+        token = token or uuid.uuid4().hex
+        await self.enter(token)
+        try:
+            async with self.renewing(token):
+                yield
+        finally:
+            await self.exit(token)
+
+    async def close(self):
+        await self.redis.aclose()
@@ -0,0 +1,97 @@
+# es_cursor.py
+import base64
+
+import orjson
+from elasticsearch import NotFoundError
+
+from core.config import config
+from core.es import chat_query, chat_routing, get_es_client
+
+# 游标分页的排序：(date, chat_id, message_id) 与文档 _id 一一对应，是全序，
+# 不依赖 _id 的 fielddata，PIT 过期后重新打开也能从同一位置继续
+CURSOR_SORT = [{"date": "desc"}, {"chat_id": "asc"}, {"message_id": "desc"}]
+
+
+def encode_cursor(state):
+    """把游标状态编码为不透明的 URL 安全字符串，服务端不保存任何游标"""
+    return base64.urlsafe_b64encode(orjson.dumps(state)).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(token):
+    """解析 encode_cursor 生成的字符串，格式错误时抛出 ValueError"""
+    try:
+        state = orjson.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, orjson.JSONDecodeError) as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(state, dict):
+        raise ValueError("invalid cursor")
+    return state
+
+
+async def open_pit(chat_ids=None, keep_alive=None):
+    """在读别名上打开 point-in-time；限定聊天时 PIT 只覆盖这些聊天所在的分片"""
+    response = await get_es_client().open_point_in_time(
+        index=config.ES_READ_ALIAS,
+        keep_alive=keep_alive or config.SEARCH_PIT_KEEP_ALIVE,
+        routing=chat_routing(chat_ids) if chat_ids else None,
+    )
+    return response["id"]
+
+
+async def close_pit(pit_id):
+    """提前释放 PIT；已经过期的忽略"""
+    try:
+        await get_es_client().close_point_in_time(id=pit_id)
+    except NotFoundError:
+        pass
+
+
+async def search_page(query=None, chat_ids=None, size=20, cursor=None, **kwargs):
+    """
+    PIT + search_after 分页的一页结果。
+
+    cursor 为上一页返回的状态 {"pit": PIT ID, "after": 最后一条的排序值}，首页传 None。
+    每次翻页都会续期 PIT；PIT 已过期时重新打开并从 after 处继续（此后看到的是新的快照）。
+    返回 (命中列表, 下一页状态)，取到最后一页时 PIT 被关闭，下一页状态为 None。
+    其余参数原样传给 AsyncElasticsearch.search。
+    """
+    es = get_es_client()
+    pit_id = cursor["pit"] if cursor else await open_pit(chat_ids)
+    after = cursor.get("after") if cursor else None
+    keep_alive = config.SEARCH_PIT_KEEP_ALIVE
+    body = dict(query=chat_query(chat_ids, query), size=size, sort=CURSOR_SORT, **kwargs)
+    if after:
+        body["search_after"] = after
+
+    try:
+        response = await es.search(pit={"id": pit_id, "keep_alive": keep_alive}, **body)
+    except NotFoundError:
+        pit_id = await open_pit(chat_ids)
+        response = await es.search(pit={"id": pit_id, "keep_alive": keep_alive}, **body)
+
+    # 每次响应都可能返回新的 PIT ID，后续请求必须使用最新的
+    pit_id = response.get("pit_id", pit_id)
+    hits = response["hits"]["hits"]
+    if len(hits) < size:
+        await close_pit(pit_id)
+        return hits, None
+    return hits, {"pit": pit_id, "after": hits[-1]["sort"]}
+
+
+async def iter_search(query=None, chat_ids=None, page_size=None, **kwargs):
+    """
+    按游标顺序逐条产出全部命中，任意时刻只在内存中保留一页，供导出等下游任务使用。
+    提前结束迭代时也会关闭 PIT。
+    """
+    page_size = page_size or config.SEARCH_EXPORT_PAGE_SIZE
+    cursor = None
+    try:
+        while True:
+            hits, cursor = await search_page(query, chat_ids, page_size, cursor, **kwargs)
+            for hit in hits:
+                yield hit
+            if cursor is None:
+                return
+    finally:
+        if cursor is not None:
+            await close_pit(cursor["pit"])
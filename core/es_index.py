@@ -0,0 +1,179 @@
+# es_index.py
+from elasticsearch import NotFoundError
+
+from core.config import config
+from core.es import get_es_client, index_for, index_pattern
+
+INDEX_SETTINGS = {
+    "number_of_shards": config.ES_INDEX_SHARDS,
+    "analysis": {
+        "analyzer": {
+            "my_analyzer": {
+                "tokenizer": "ik_max_word",
+                "filter": "py"
+            }
+        },
+        "filter": {
+            "py": {
+                "type": "pinyin",
+                "keep_full_pinyin": False,
+                "keep_joined_full_pinyin": True,
+                "keep_original": True,
+                "limit_first_letter_length": 16,
+                "remove_duplicated_term": True,
+                "none_chinese_pinyin_tokenize": False
+            }
+        }
+    }
+}
+
+if config.ES_ROUTING_PARTITION_SIZE > 1:
+    # 超大频道的文档分散到多个分片，避免单个分片过热
+    INDEX_SETTINGS["routing_partition_size"] = config.ES_ROUTING_PARTITION_SIZE
+
+INDEX_MAPPINGS = {
+    # 文档按 chat_id 路由，要求写入时必须带 routing，避免同一 _id 落到不同分片
+    "_routing": {"required": True},
+    "properties": {
+        "id": {"type": "long"},
+        "message_id": {"type": "long"},
+        "chat_id": {"type": "keyword"},
+        "message": {
+            "type": "text",
+            "analyzer": "my_analyzer",
+            "search_analyzer": "ik_max_word",
+            "copy_to": ["all", "suggest"]
+        },
+        "date": {"type": "date"},
+        "sender_id": {"type": "long"},
+        "views": {"type": "integer"},
+        "forwards": {"type": "integer"},
+        "media_type": {"type": "keyword"},
+        "message_link": {"type": "keyword"},
+        "edited_at": {"type": "date"},
+        "all": {
+            "type": "text",
+            "search_analyzer": "ik_max_word",
+            "analyzer": "my_analyzer"
+        },
+        "suggest": {
+            "type": "completion",
+            "analyzer": "my_analyzer",
+            "search_analyzer": "ik_max_word",
+            # 按聊天过滤联想结果，上下文取自文档的 chat_id
+            "contexts": [{"name": "chat_id", "type": "category", "path": "chat_id"}]
+        }
+    }
+}
+
+
+def index_template(settings=None):
+    """周期索引模板的内容，settings 为在 INDEX_SETTINGS 之上追加的设置"""
+    return {
+        "settings": {**INDEX_SETTINGS, **(settings or {})},
+        "mappings": INDEX_MAPPINGS,
+        "aliases": {config.ES_READ_ALIAS: {}},
+    }
+
+
+async def ensure_index_template():
+    """
+    创建（或更新）索引模板：所有 {ES_INDEX_NAME}-* 索引使用相同的分词设置和映射，
+    并自动加入读别名。周期索引在第一条文档写入时由 ES 按模板自动创建。
+    """
+    es = get_es_client()
+    await es.indices.put_index_template(
+        name=f"{config.ES_INDEX_NAME}_template",
+        index_patterns=[index_pattern()],
+        template=index_template(),
+    )
+
+
+async def ensure_write_alias():
+    """
+    把写别名指向当前周期的索引（不存在时先创建），周期切换后调用即完成滚动。
+    实时写入的消息都落在当前周期，回填的旧消息则直接写入各自周期的索引。
+    """
+    es = get_es_client()
+    current = index_for()
+    if not await es.indices.exists(index=current):
+        await es.indices.create(index=current)
+    try:
+        aliased = list((await es.indices.get_alias(name=config.ES_WRITE_ALIAS)).body)
+    except NotFoundError:
+        aliased = []
+    if aliased == [current]:
+        return current
+    actions = [{"remove": {"index": index, "alias": config.ES_WRITE_ALIAS}} for index in aliased]
+    actions.append({"add": {"index": current, "alias": config.ES_WRITE_ALIAS, "is_write_index": True}})
+    await es.indices.update_aliases(actions=actions)
+    return current
+
+
+async def setup_indices():
+    """启动时准备模板、写别名；旧版本的单一索引加入读别名，历史数据仍可被搜索"""
+    es = get_es_client()
+    await ensure_index_template()
+    await ensure_write_alias()
+    legacy = config.ES_INDEX_NAME
+    if await es.indices.exists(index=legacy) and not await es.indices.exists_alias(name=legacy):
+        await es.indices.put_alias(index=legacy, name=config.ES_READ_ALIAS)
+    print(f"Elasticsearch indices ready: {index_pattern()} (write: {config.ES_WRITE_ALIAS}, read: {config.ES_READ_ALIAS})")
+
+
+async def _shrink(index, shards):
+    """
+    把已结束周期的索引收缩到 shards 个主分片：
+    先禁止写入并把所有分片集中到一个节点，收缩为 {index}-shrunk，
+    再删除原索引并以原索引名作为新索引的别名，按日期路由的写入仍然有效。
+    """
+    es = get_es_client()
+    target = f"{index}-shrunk"
+    # 分片只能分配到数据节点（角色含 d，或 s/h/w/c 等数据层角色）
+    nodes = await es.cat.nodes(format="json", h="name,node.role")
+    data_nodes = [node["name"] for node in nodes.body if set(node["node.role"]) & set("dshwc")]
+    if not data_nodes:
+        raise RuntimeError("No Elasticsearch data node to shrink the index on")
+    await es.indices.put_settings(index=index, settings={
+        "index.blocks.write": True,
+        "index.routing.allocation.require._name": data_nodes[0],
+    })
+    await es.cluster.health(index=index, wait_for_no_relocating_shards=True, timeout="30m")
+    await es.indices.shrink(index=index, target=target, settings={
+        "index.number_of_shards": shards,
+        "index.blocks.write": None,
+        "index.routing.allocation.require._name": None,
+    })
+    await es.cluster.health(index=target, wait_for_status="yellow", timeout="30m")
+    await es.indices.update_aliases(actions=[
+        {"remove_index": {"index": index}},
+        {"add": {"index": target, "alias": index}},
+        {"add": {"index": target, "alias": config.ES_READ_ALIAS}},
+    ])
+    return target
+
+
+async def compact_closed_indices(shrink_shards=None, max_num_segments=1):
+    """
+    整理已结束周期的索引：可选收缩主分片数，然后 force merge 到 max_num_segments 个段，
+    减少段数量和堆内存占用。当前周期的索引不处理。返回处理过的索引名。
+    """
+    es = get_es_client()
+    shrink_shards = shrink_shards if shrink_shards is not None else config.ES_SHRINK_SHARDS
+    current = index_for()
+    settings = (await es.indices.get_settings(
+        index=index_pattern(), name="index.number_of_shards", flat_settings=True)).body
+    compacted = []
+    for index in sorted(settings):
+        if index == current or index.endswith("-shrunk"):
+            continue
+        shards = int(settings[index]["settings"]["index.number_of_shards"])
+        # routing_partition_size 必须小于分片数，收缩后不能违反
+        if (shrink_shards and shards > shrink_shards and shards % shrink_shards == 0
+                and shrink_shards > config.ES_ROUTING_PARTITION_SIZE):
+            print(f"Shrinking {index} from {shards} to {shrink_shards} shards")
+            index = await _shrink(index, shrink_shards)
+        print(f"Force merging {index} to {max_num_segments} segment(s)")
+        await es.indices.forcemerge(index=index, max_num_segments=max_num_segments, wait_for_completion=False)
+        compacted.append(index)
+    return compacted
@@ -0,0 +1,563 @@
+# mysql.py
+import asyncio
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+
+import aiomysql
+
+from core.config import config
+from core.rollup import (
+    APPLY_DAILY_SQL, APPLY_SENDER_SQL, BACKFILL_DAILY_SQL, BACKFILL_SENDER_SQL, CREATE_CHAT_DAILY_STATS_SQL,
+    CREATE_CHAT_SENDER_DAILY_STATS_SQL, EXISTING_COLUMNS, rollup_deltas,
+)
+from core.schema import (
+    CREATE_CHAT_KEY_TABLE_SQL, CREATE_MESSAGE_TABLE_SQL, CREATE_PARTITIONED_MESSAGE_TABLE_SQL, MESSAGE_COLUMNS,
+    MessageRecord, chat_key, month_partitions,
+)
+
+# 参数为 MessageRecord.mysql_row() 的元组，列顺序见 MESSAGE_COLUMNS
+UPSERT_MESSAGE_SQL = f"""
+                     INSERT INTO telegram_message ({', '.join(MESSAGE_COLUMNS)}) \
+                     VALUES ({', '.join(['%s'] * len(MESSAGE_COLUMNS))}) ON DUPLICATE KEY \
+                     UPDATE \
+                         message = \
+                     VALUES (message), views = \
+                     VALUES (views), forwards = \
+                     VALUES (forwards), media_type = \
+                     VALUES (media_type), edited_at = \
+                     VALUES (edited_at) \
+                     """
+
+# LOAD DATA 的临时表：每个连接一张，只有列没有索引，导入后一次性合并到 telegram_message
+CREATE_STAGING_TABLE_SQL = f"""
+                           CREATE TEMPORARY TABLE IF NOT EXISTS telegram_message_staging AS
+                           SELECT {', '.join(MESSAGE_COLUMNS)} FROM telegram_message LIMIT 0
+                           """
+
+MERGE_STAGING_SQL = f"""
+                    INSERT INTO telegram_message ({', '.join(MESSAGE_COLUMNS)})
+                    SELECT {', '.join(MESSAGE_COLUMNS)} FROM telegram_message_staging ON DUPLICATE KEY
+                    UPDATE message = VALUES (message), views = VALUES (views), forwards = VALUES (forwards),
+                        media_type = VALUES (media_type), edited_at = VALUES (edited_at)
+                    """
+
+# 编辑事件只更新会变化的字段，按 uniq_msg 的 (chat_id, message_id) 前缀定位
+UPDATE_MESSAGE_SQL = """
+                     UPDATE telegram_message
+                     SET message    = %(message)s,
+                         media_type = %(media_type)s,
+                         edited_at  = %(edited_at)s
+                     WHERE chat_id = %(chat_id)s
+                       AND message_id = %(message_id)s
+                     """
+
+
+class MySQLPool:
+    """
+    aiomysql 连接池的薄封装。
+
+    取出连接时只有在连接空闲超过 idle_ping 秒后才 ping，
+    避免像原来的 ensure_mysql_connection 那样每次写入前都多一次往返。
+    正常归还时回滚只读调用方留下的事务，连接放回池中复用而不是被关闭。
+    """
+
+    def __init__(self, minsize=1, maxsize=None, idle_ping=None):
+        self.minsize = minsize
+        self.maxsize = maxsize or config.MYSQL_POOL_SIZE
+        self.idle_ping = idle_ping if idle_ping is not None else config.MYSQL_IDLE_PING
+        self._pool = None
+
+    async def open(self):
+        if self._pool is None:
+            self._pool = await aiomysql.create_pool(
+                host=config.MYSQL_HOST,
+                port=config.MYSQL_PORT,
+                user=config.MYSQL_USER,
+                password=config.MYSQL_PASSWORD,
+                db=config.MYSQL_DB,
+                charset='utf8mb4',
+                local_infile=config.MYSQL_BULK_LOAD,
+                minsize=self.minsize,
+                maxsize=self.maxsize,
+                connect_timeout=60,
+            )
+        return self
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+    @asynccontextmanager
+    async def acquire(self):
+        await self.open()
+        conn = await self._pool.acquire()
+        try:
+            if asyncio.get_running_loop().time() - conn.last_usage > self.idle_ping:
+                await conn.ping(reconnect=True)
+            yield conn
+            # 连接池关闭了自动提交，只读的调用方不会提交，SELECT 开启的事务会一直留着；
+            # release 会关闭仍在事务中的连接，下次取出就得重新建立连接，所以先结束事务再归还
+            if conn.get_transaction_status():
+                await conn.rollback()
+        finally:
+            self._pool.release(conn)
+
+
+# 进程内共享的连接池
+_mysql_pool = None
+
+
+def get_mysql_pool():
+    """获取（必要时创建）共享的 MySQL 连接池，首次 acquire 时才真正建立连接"""
+    global _mysql_pool
+    if _mysql_pool is None:
+        _mysql_pool = MySQLPool()
+    return _mysql_pool
+
+
+async def close_mysql_pool():
+    """关闭共享连接池；每个事件循环结束前都应调用（如 Celery 任务中的 asyncio.run）"""
+    global _mysql_pool
+    if _mysql_pool is not None:
+        await _mysql_pool.close()
+        _mysql_pool = None
+
+
+def chat_column(chat_id):
+    """telegram_message.chat_id 列中保存的值：分区布局下是 chat_key() 数字键，否则是原字符串"""
+    return chat_key(chat_id) if config.MYSQL_PARTITIONED else chat_id
+
+
+def table_row(row):
+    """把 mysql_row() 元组中的 chat_id 换成 chat_column() 的值，用于写入 telegram_message"""
+    if not config.MYSQL_PARTITIONED:
+        return row
+    return (row[0], chat_key(row[1]), *row[2:])
+
+
+# 已写入 telegram_chat_key 的 chat_id
+_registered_chats = set()
+
+
+async def register_chats(cursor, chat_ids):
+    """
+    分区布局下把新出现的 chat_id 写入 telegram_chat_key，用于从数字键还原 chat_id。
+    返回本次写入的 chat_id，调用方提交事务后再加入 _registered_chats。
+    """
+    new = {chat_id for chat_id in chat_ids if chat_id not in _registered_chats}
+    if new:
+        await cursor.executemany(
+            "INSERT IGNORE INTO telegram_chat_key (chat_key, chat_id) VALUES (%s, %s)",
+            [(chat_key(chat_id), chat_id) for chat_id in new],
+        )
+    return new
+
+
+# LOAD DATA 默认格式（制表符分隔、反斜杠转义）中需要转义的字符
+_TSV_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+
+
+def _tsv_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, str):
+        return value.translate(_TSV_ESCAPES)
+    if isinstance(value, datetime):
+        # 与 pymysql 一致，直接取时间字面值，不做时区换算
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)
+
+
+def encode_tsv(rows):
+    """把 mysql_row() 元组编码为 LOAD DATA 默认格式的 TSV"""
+    return '\n'.join('\t'.join(map(_tsv_value, row)) for row in rows).encode('utf-8')
+
+
+def _write_tsv(rows):
+    with tempfile.NamedTemporaryFile('wb', suffix='.tsv', dir=config.MYSQL_BULK_TMPDIR, delete=False) as f:
+        f.write(encode_tsv(rows))
+    return f.name
+
+
+async def insert_rows(cursor, rows):
+    """
+    多行 INSERT ... ON DUPLICATE KEY UPDATE。aiomysql 的 executemany 会把整批参数
+    拼成一条（超过 max_stmt_length 时拆成几条）多行 INSERT，而不是逐行执行。
+    """
+    await cursor.executemany(UPSERT_MESSAGE_SQL, rows)
+
+
+async def load_rows(cursor, rows):
+    """
+    大批量写入：整批写入临时 TSV 文件，LOAD DATA LOCAL INFILE 导入本连接的临时表，
+    再用一条 INSERT ... SELECT ... ON DUPLICATE KEY UPDATE 合并。与调用方在同一个事务中。
+    """
+    path = await asyncio.to_thread(_write_tsv, rows)
+    try:
+        await cursor.execute(CREATE_STAGING_TABLE_SQL)
+        # 不能用 TRUNCATE：它是 DDL，即使作用于临时表也会隐式提交调用方的事务
+        await cursor.execute("DELETE FROM telegram_message_staging")
+        await cursor.execute(
+            f"LOAD DATA LOCAL INFILE {cursor.connection.escape(path)} INTO TABLE telegram_message_staging "
+            f"CHARACTER SET utf8mb4 ({', '.join(MESSAGE_COLUMNS)})"
+        )
+        await cursor.execute(MERGE_STAGING_SQL)
+    finally:
+        os.unlink(path)
+
+
+async def lock_existing(cursor, message_ids):
+    """
+    锁定并读取已存在的消息，message_ids 为 {chat_id: [message_id, ...]}。
+    返回 {(chat_id, message_id): EXISTING_COLUMNS 顺序的元组}；FOR UPDATE 保证并发写入同一条消息时
+    汇总增量按顺序计算。调用方的事务须为 READ COMMITTED：REPEATABLE READ 下不存在的消息会加间隙锁，
+    两个批次先后锁住同一段间隙再插入会互相等待而死锁。按 chat_id、message_id 排序加锁，避免交叉等待。
+    """
+    existing = {}
+    for chat_id in sorted(message_ids):
+        ids = sorted(message_ids[chat_id])
+        placeholders = ', '.join(['%s'] * len(ids))
+        await cursor.execute(
+            f"SELECT message_id, {', '.join(EXISTING_COLUMNS)} FROM telegram_message "
+            f"WHERE chat_id = %s AND message_id IN ({placeholders}) FOR UPDATE",
+            [chat_column(chat_id), *ids],
+        )
+        for message_id, *row in await cursor.fetchall():
+            existing[(chat_id, message_id)] = tuple(row)
+    return existing
+
+
+async def get_message_dates(chat_id, message_ids):
+    """按 uniq_msg 查询消息的发送时间，返回 {message_id: date}，不存在的消息不包含在内"""
+    if not message_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(message_ids))
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                f"SELECT message_id, date FROM telegram_message WHERE chat_id = %s AND message_id IN ({placeholders})",
+                [chat_column(chat_id), *message_ids],
+            )
+            return dict(await cursor.fetchall())
+
+
+async def save_to_mysql(docs):
+    """
+    批量写入 telegram_message 表，每个批次占用池中的一个连接、一个事务。
+    MessageRecord 按 uniq_msg upsert：开启 MYSQL_BULK_LOAD 且达到 MYSQL_BULK_THRESHOLD 条时走 LOAD DATA，
+    否则用多行 INSERT；_op 为 update / delete 的编辑、删除事件分别执行定点 UPDATE / DELETE。
+    开启 ROLLUPS_ENABLED 时在同一个事务中更新按天汇总的统计表。
+    事务使用 READ COMMITTED，只锁定已存在的行、不加间隙锁；upsert 按 uniq_msg 排序，并发批次以相同顺序加锁。
+    极少数情况下两个批次同时插入同一条新消息，两边都按新消息计入汇总，可用 rollup-backfill 重算纠正。
+    """
+    upserts = []
+    updates = []
+    deletes = {}
+    for doc in docs:
+        if isinstance(doc, MessageRecord):
+            upserts.append(doc.mysql_row())
+        elif doc['_op'] == 'update':
+            updates.append(doc)
+        elif doc['_op'] == 'delete':
+            deletes.setdefault(doc['chat_id'], []).append(doc['message_id'])
+
+    upserts.sort(key=lambda row: (row[1], row[0]))
+
+    registered = set()
+    async with get_mysql_pool().acquire() as conn:
+        try:
+            async with conn.cursor() as cursor:
+                # 只作用于连接上的下一个事务；取出的连接都不在事务中，这里总是新事务的开始。
+                # READ COMMITTED 要求 binlog_format 为 ROW 或 MIXED（MySQL 8 默认 ROW）
+                await cursor.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+                if config.MYSQL_PARTITIONED and upserts:
+                    registered = await register_chats(cursor, {row[1] for row in upserts})
+                rollups = config.ROLLUPS_ENABLED and (upserts or updates or deletes)
+                if rollups:
+                    message_ids = {}
+                    for row in upserts:
+                        message_ids.setdefault(row[1], set()).add(row[0])
+                    for doc in updates:
+                        message_ids.setdefault(doc['chat_id'], set()).add(doc['message_id'])
+                    for chat_id, ids in deletes.items():
+                        message_ids.setdefault(chat_id, set()).update(ids)
+                    existing = await lock_existing(cursor, message_ids)
+                if upserts:
+                    rows = [table_row(row) for row in upserts]
+                    if config.MYSQL_BULK_LOAD and len(rows) >= config.MYSQL_BULK_THRESHOLD:
+                        await load_rows(cursor, rows)
+                    else:
+                        await insert_rows(cursor, rows)
+                if updates:
+                    await cursor.executemany(
+                        UPDATE_MESSAGE_SQL, [{**doc, 'chat_id': chat_column(doc['chat_id'])} for doc in updates]
+                    )
+                # 同一聊天的删除合并为一条语句，走 uniq_msg 索引
+                for chat_id, message_ids in deletes.items():
+                    placeholders = ', '.join(['%s'] * len(message_ids))
+                    await cursor.execute(
+                        f"DELETE FROM telegram_message WHERE chat_id = %s AND message_id IN ({placeholders})",
+                        [chat_column(chat_id), *message_ids],
+                    )
+                if rollups:
+                    daily, senders = rollup_deltas(
+                        upserts, existing,
+                        [(chat_id, message_id) for chat_id, ids in deletes.items() for message_id in ids],
+                        [(doc['chat_id'], doc['message_id'], doc['media_type']) for doc in updates],
+                    )
+                    if daily:
+                        await cursor.executemany(APPLY_DAILY_SQL, daily)
+                    if senders:
+                        await cursor.executemany(APPLY_SENDER_SQL, senders)
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+    _registered_chats.update(registered)
+
+
+def _last_partition_month():
+    """需要提前建好的最后一个月份分区：当前月之后第 MYSQL_PARTITION_MONTHS_AHEAD 个月"""
+    today = date.today()
+    month = today.month - 1 + config.MYSQL_PARTITION_MONTHS_AHEAD
+    return date(today.year + month // 12, month % 12 + 1, 1)
+
+
+def partitioned_table_sql(table, start=None):
+    """
+    分区布局的建表语句，月份分区从 start 建到 _last_partition_month()。
+    start 默认取 MYSQL_PARTITION_START，都没有时为当前月；更早的消息都落在第一个分区。
+    """
+    if start is None:
+        start = (datetime.strptime(config.MYSQL_PARTITION_START, '%Y-%m').date()
+                 if config.MYSQL_PARTITION_START else date.today())
+    partitions = month_partitions(start, _last_partition_month())
+    return CREATE_PARTITIONED_MESSAGE_TABLE_SQL.format(table=table, partitions=', '.join(partitions))
+
+
+async def list_partitions(cursor, table='telegram_message'):
+    """表的分区名列表（按分区顺序），未分区的表返回空列表"""
+    await cursor.execute(
+        """
+        SELECT PARTITION_NAME
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE()
+          AND TABLE_NAME = %s
+          AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+        """,
+        (table,),
+    )
+    return [name for (name,) in await cursor.fetchall()]
+
+
+async def ensure_message_partitions(table='telegram_message'):
+    """
+    把 pmax 拆分出到当前月之后 MYSQL_PARTITION_MONTHS_AHEAD 个月为止的月份分区。
+    pmax 中还没有数据时拆分只修改元数据；启动时和 cli.py mysql-partitions 会调用。
+    """
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor() as cursor:
+            months = [name for name in await list_partitions(cursor, table) if name != 'pmax']
+            if not months:
+                raise RuntimeError(f"{table} 不是按月分区的表")
+            last = months[-1]
+            year, month = int(last[1:5]), int(last[5:7])
+            start = date(year + month // 12, month % 12 + 1, 1)
+            # 最后一项是新的 pmax，只有它时说明分区已经足够
+            partitions = month_partitions(start, _last_partition_month())
+            if len(partitions) > 1:
+                await cursor.execute(
+                    f"ALTER TABLE {table} REORGANIZE PARTITION pmax INTO ({', '.join(partitions)})"
+                )
+            return partitions[:-1]
+
+
+async def drop_message_partitions(before):
+    """
+    删除 before 所在月之前的月份分区，即保留期之外的消息。DROP PARTITION 直接丢弃整个分区，
+    不像 DELETE 那样逐行删除、产生大量 undo 和锁。汇总表中的统计不受影响。返回删除的分区名。
+    """
+    cutoff = f"p{before.year:04d}{before.month:02d}"
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor() as cursor:
+            names = [name for name in await list_partitions(cursor) if name != 'pmax' and name < cutoff]
+            if names:
+                await cursor.execute(f"ALTER TABLE telegram_message DROP PARTITION {', '.join(names)}")
+    return names
+
+
+async def create_message_table():
+    """
+    创建 telegram_message 表及由写入端维护的汇总表（如果不存在），并补上旧表缺少的列。
+    开启 MYSQL_PARTITIONED 时创建分区布局并补齐未来月份的分区；已有的表还没有迁移时报错，
+    避免把数字键写进 VARCHAR 的 chat_id 列。
+    """
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor() as cursor:
+            if config.MYSQL_PARTITIONED:
+                await cursor.execute(partitioned_table_sql('telegram_message'))
+                await cursor.execute(CREATE_CHAT_KEY_TABLE_SQL)
+                if not await list_partitions(cursor):
+                    raise RuntimeError("telegram_message 还是未分区的布局，请先运行 cli.py mysql-migrate")
+            else:
+                await cursor.execute(CREATE_MESSAGE_TABLE_SQL)
+            await cursor.execute(CREATE_CHAT_DAILY_STATS_SQL)
+            await cursor.execute(CREATE_CHAT_SENDER_DAILY_STATS_SQL)
+        await conn.commit()
+    if config.MYSQL_PARTITIONED:
+        await ensure_message_partitions()
+    else:
+        await ensure_message_columns()
+
+
+async def list_message_chats():
+    """telegram_message 中出现过的所有 chat_id（走 idx_chat 索引；分区布局下读 telegram_chat_key）"""
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor() as cursor:
+            if config.MYSQL_PARTITIONED:
+                await cursor.execute("SELECT chat_id FROM telegram_chat_key")
+            else:
+                await cursor.execute("SELECT DISTINCT chat_id FROM telegram_message")
+            return [chat_id for (chat_id,) in await cursor.fetchall()]
+
+
+async def backfill_rollups(chat_id):
+    """
+    从 telegram_message 重建一个聊天的汇总。INSERT ... SELECT 期间该聊天的消息被共享锁定，
+    同时进行的写入会等待重建完成，之后的增量在重建结果上继续累加。
+    """
+    async with get_mysql_pool().acquire() as conn:
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute("DELETE FROM chat_daily_stats WHERE chat_id = %s", (chat_id,))
+                await cursor.execute("DELETE FROM chat_sender_daily_stats WHERE chat_id = %s", (chat_id,))
+                await cursor.execute(BACKFILL_DAILY_SQL, (chat_id, chat_column(chat_id)))
+                await cursor.execute(BACKFILL_SENDER_SQL, (chat_id, chat_column(chat_id)))
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+
+
+async def get_daily_stats(chat_id, date_from=None, date_to=None):
+    """聊天每天的消息数、媒体消息数、查看和转发次数，按日期升序"""
+    sql = "SELECT day, messages, media_messages, views, forwards FROM chat_daily_stats WHERE chat_id = %s"
+    args = [chat_id]
+    if date_from:
+        sql += " AND day >= %s"
+        args.append(date_from)
+    if date_to:
+        sql += " AND day <= %s"
+        args.append(date_to)
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(sql + " ORDER BY day", args)
+            return await cursor.fetchall()
+
+
+async def get_top_senders(chat_id, date_from=None, date_to=None, limit=10):
+    """时间范围内发言最多的发送者"""
+    sql = ("SELECT sender_id, SUM(messages) AS messages, SUM(views) AS views "
+           "FROM chat_sender_daily_stats WHERE chat_id = %s")
+    args = [chat_id]
+    if date_from:
+        sql += " AND day >= %s"
+        args.append(date_from)
+    if date_to:
+        sql += " AND day <= %s"
+        args.append(date_to)
+    sql += " GROUP BY sender_id ORDER BY messages DESC LIMIT %s"
+    args.append(limit)
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(sql, args)
+            return await cursor.fetchall()
+
+
+CREATE_CHANNEL_TABLE_SQL = """
+                           CREATE TABLE IF NOT EXISTS telegram_channel
+                           (
+                               id                 BIGINT       NOT NULL COMMENT '频道/群组ID',
+                               title              VARCHAR(800) COMMENT '标题',
+                               username           VARCHAR(300) COMMENT '用户名',
+                               description        TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci COMMENT '简介',
+                               participants_count INT COMMENT '成员数',
+                               PRIMARY KEY (id)
+                           ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='Telegram频道/群组信息'
+                           """
+
+
+async def create_channel_table():
+    """创建 telegram_channel 表（如果不存在）"""
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(CREATE_CHANNEL_TABLE_SQL)
+        await conn.commit()
+
+
+async def get_channel(channel_id):
+    """读取频道信息，不存在时返回 None"""
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute("SELECT * FROM telegram_channel WHERE id = %s", (channel_id,))
+            return await cursor.fetchone()
+
+
+async def save_channel(entity):
+    """根据 Telethon 实体写入（或更新）频道信息"""
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                """
+                INSERT INTO telegram_channel (id, title, username, description, participants_count)
+                VALUES (%s, %s, %s, %s, %s) ON DUPLICATE KEY
+                UPDATE title = VALUES (title), username = VALUES (username),
+                    description = VALUES (description), participants_count = VALUES (participants_count)
+                """,
+                (entity.id, entity.title, getattr(entity, 'username', None),
+                 getattr(entity, 'about', None), getattr(entity, 'participants_count', None)),
+            )
+        await conn.commit()
+
+
+# 频道ID -> 最后一次写入 telegram_channel 的时间（loop.time()）
+_channel_saved_at = {}
+
+
+async def ensure_channel(entity):
+    """
+    确保频道信息已写入 MySQL。每个频道在 CHANNEL_CACHE_TTL 内只写一次，
+    避免每个批次都查询 telegram_channel；过期后重新 upsert 以刷新标题、人数等元数据。
+    """
+    now = asyncio.get_running_loop().time()
+    saved_at = _channel_saved_at.get(entity.id)
+    if saved_at is not None and now - saved_at < config.CHANNEL_CACHE_TTL:
+        return
+    await save_channel(entity)
+    _channel_saved_at[entity.id] = now
+
+
+async def ensure_message_columns():
+    """给旧版本创建的 telegram_message 表补上后来新增的列"""
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                """
+                SELECT COUNT(*)
+                FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE()
+                  AND TABLE_NAME = 'telegram_message'
+                  AND COLUMN_NAME = 'edited_at'
+                """
+            )
+            (exists,) = await cursor.fetchone()
+            if not exists:
+                await cursor.execute(
+                    "ALTER TABLE telegram_message ADD COLUMN edited_at DATETIME NULL COMMENT '消息最后编辑时间'"
+                )
+        await conn.commit()
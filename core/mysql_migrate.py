@@ -0,0 +1,166 @@
+# mysql_migrate.py
+# 把未分区的 telegram_message 在线迁移为分区布局（按月 RANGE 分区、chat_id 为数字键）。
+# 做法与 pt-online-schema-change 相同：
+#   1. 建好分区的新表 telegram_message_new，在旧表上建触发器，把之后的写入、更新、删除同步到新表；
+#   2. 按 id 区间分块 INSERT IGNORE ... SELECT 复制已有数据和 chat_id 对应关系，每块一个短事务，块之间可以暂停；
+#      触发器同步过来的行比复制的行新，INSERT IGNORE 不会覆盖它们；
+#   3. 停止写入端后 swap：RENAME TABLE 原子地交换新旧表并删除触发器，
+#      再开启 MYSQL_PARTITIONED 重启写入端。旧表保留为 telegram_message_old，确认无误后手动删除。
+# 复制可以中断后重新执行，已复制的行会被跳过；已存在的触发器不会被删除重建，
+# 否则删除和重建之间落到已复制行上的更新、删除不会同步到新表。
+import asyncio
+import logging
+
+from core.config import config
+from core.mysql import ensure_message_columns, get_mysql_pool, list_partitions, partitioned_table_sql
+from core.schema import CHAT_KEY_SQL, CREATE_CHAT_KEY_TABLE_SQL, MESSAGE_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+NEW_TABLE = 'telegram_message_new'
+OLD_TABLE = 'telegram_message_old'
+
+_COLUMNS = ', '.join(('id', *MESSAGE_COLUMNS))
+
+
+def _converted(prefix=''):
+    """旧表一行转成新表一行的列表达式，chat_id 换成数字键；prefix 为空或触发器中的 NEW."""
+    return ', '.join(
+        CHAT_KEY_SQL.format(f'{prefix}{column}') if column == 'chat_id' else f'{prefix}{column}'
+        for column in ('id', *MESSAGE_COLUMNS)
+    )
+
+
+COPY_CHUNK_SQL = f"""
+                 INSERT IGNORE INTO {NEW_TABLE} ({_COLUMNS})
+                 SELECT {_converted()} FROM telegram_message
+                 WHERE id BETWEEN %s AND %s
+                 """
+
+COPY_CHAT_KEYS_SQL = f"""
+                     INSERT IGNORE INTO telegram_chat_key (chat_key, chat_id)
+                     SELECT DISTINCT {CHAT_KEY_SQL.format('chat_id')}, chat_id FROM telegram_message
+                     WHERE id BETWEEN %s AND %s
+                     """
+
+# 插入和更新都整行 REPLACE 到新表；REPLACE 会先删掉主键或 uniq_msg 冲突的旧行
+_MIRROR_ROW = f"""
+    INSERT IGNORE INTO telegram_chat_key (chat_key, chat_id) VALUES ({CHAT_KEY_SQL.format('NEW.chat_id')}, NEW.chat_id);
+    REPLACE INTO {NEW_TABLE} ({_COLUMNS}) VALUES ({_converted('NEW.')});
+"""
+
+TRIGGERS = {
+    'telegram_message_mirror_ins': f"AFTER INSERT ON telegram_message FOR EACH ROW BEGIN {_MIRROR_ROW} END",
+    'telegram_message_mirror_upd': f"AFTER UPDATE ON telegram_message FOR EACH ROW BEGIN {_MIRROR_ROW} END",
+    'telegram_message_mirror_del': (
+        f"AFTER DELETE ON telegram_message FOR EACH ROW "
+        f"DELETE FROM {NEW_TABLE} WHERE id = OLD.id AND date = OLD.date"
+    ),
+}
+
+
+async def _missing_triggers(cursor):
+    """TRIGGERS 中还没有创建的触发器名"""
+    placeholders = ', '.join(['%s'] * len(TRIGGERS))
+    await cursor.execute(
+        f"SELECT TRIGGER_NAME FROM information_schema.TRIGGERS "
+        f"WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME IN ({placeholders})",
+        list(TRIGGERS),
+    )
+    existing = {name for (name,) in await cursor.fetchall()}
+    return [name for name in TRIGGERS if name not in existing]
+
+
+async def _copy_range(cursor):
+    """旧表的 (最小 id, 最大 id)"""
+    await cursor.execute("SELECT MIN(id), MAX(id) FROM telegram_message")
+    return await cursor.fetchone()
+
+
+async def prepare_migration():
+    """创建新表、chat_id 对应表和缺少的同步触发器，返回旧表的 (最小 id, 最大 id)"""
+    # 很早创建的旧表可能还没有 edited_at 列，复制的 SELECT 需要它
+    await ensure_message_columns()
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor() as cursor:
+            if await list_partitions(cursor):
+                raise RuntimeError("telegram_message 已经是分区布局")
+            # 走 idx_date 索引，只读一行
+            await cursor.execute("SELECT MIN(date) FROM telegram_message")
+            (min_date,) = await cursor.fetchone()
+            await cursor.execute(partitioned_table_sql(NEW_TABLE, min_date.date() if min_date else None))
+            await cursor.execute(CREATE_CHAT_KEY_TABLE_SQL)
+            # 触发器必须在取复制范围之前建好：之后插入的行由触发器同步，之前的行都在复制范围内。
+            # 重新执行时已有的触发器保持不动
+            for name in await _missing_triggers(cursor):
+                await cursor.execute(f"CREATE TRIGGER {name} {TRIGGERS[name]}")
+            min_id, max_id = await _copy_range(cursor)
+        await conn.commit()
+    return min_id, max_id
+
+
+async def resume_migration():
+    """续传时只检查新表和触发器仍在并重新读取复制范围，不做任何 DDL"""
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor() as cursor:
+            if not await list_partitions(cursor, NEW_TABLE):
+                raise RuntimeError(f"{NEW_TABLE} 不存在，请不带 --start-id 运行 cli.py mysql-migrate")
+            missing = await _missing_triggers(cursor)
+            if missing:
+                # 触发器缺失期间已复制行上的修改没有同步，续传补不回来
+                raise RuntimeError(
+                    f"同步触发器 {', '.join(missing)} 不存在，新表可能与旧表不一致，请删除 {NEW_TABLE} 后重新迁移"
+                )
+            min_id, max_id = await _copy_range(cursor)
+        await conn.commit()
+    return min_id, max_id
+
+
+async def copy_rows(min_id, max_id, chunk_size=None, pause=0.0, start_id=None):
+    """
+    按 id 区间分块复制旧表中的行及其 chat_id 对应关系。每块只锁定区间内的行一小段时间，写入端可以正常运行；
+    pause 为每块之间暂停的秒数，用来降低对线上的影响。返回复制的行数。
+    """
+    chunk_size = chunk_size or config.MYSQL_MIGRATE_CHUNK_SIZE
+    copied = 0
+    low = start_id if start_id is not None else min_id
+    while low <= max_id:
+        high = min(low + chunk_size - 1, max_id)
+        async with get_mysql_pool().acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(COPY_CHAT_KEYS_SQL, (low, high))
+                copied += await cursor.execute(COPY_CHUNK_SQL, (low, high))
+            await conn.commit()
+        logger.info("已复制 id %s - %s / %s，共 %s 行", low, high, max_id, copied)
+        low = high + 1
+        if pause:
+            await asyncio.sleep(pause)
+    return copied
+
+
+async def swap_tables():
+    """
+    原子地交换新旧表并删除同步触发器。调用前应停止所有写入端，交换后开启 MYSQL_PARTITIONED 再启动：
+    仍按旧布局写入的进程会把原字符串写进数字键的 chat_id 列。
+    """
+    async with get_mysql_pool().acquire() as conn:
+        async with conn.cursor() as cursor:
+            if not await list_partitions(cursor, NEW_TABLE):
+                raise RuntimeError(f"{NEW_TABLE} 不存在，请先运行 cli.py mysql-migrate")
+            await cursor.execute(
+                f"RENAME TABLE telegram_message TO {OLD_TABLE}, {NEW_TABLE} TO telegram_message"
+            )
+            for name in TRIGGERS:
+                await cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        await conn.commit()
+
+
+async def migrate(chunk_size=None, pause=0.0, start_id=None):
+    """
+    准备新表和触发器并复制全部已有数据；之后由触发器保持同步，直到 swap_tables。
+    指定 start_id 续传时跳过准备步骤，只重新读取复制范围。
+    """
+    min_id, max_id = await (prepare_migration() if start_id is None else resume_migration())
+    if min_id is None:
+        return 0
+    return await copy_rows(min_id, max_id, chunk_size, pause, start_id)
@@ -0,0 +1,142 @@
+# pipeline.py
+import asyncio
+import inspect
+
+from core.batcher import AdaptiveBatcher
+from core.config import config
+
+# 队列结束标记，每个消费者收到一个后退出
+_STOP = object()
+
+
+class IngestPipeline:
+    """
+    抓取 -> 写入 的生产者/消费者流水线。
+
+    生产者把文档放入每个写入端独立的有界队列，每个写入端由自己的一组消费者
+    通过 AdaptiveBatcher 攒批写入。队列写满时生产者的 put 会挂起，从而在写入端跟不上时
+    反压抓取端，而不是无限占用内存。
+
+    回填时用 run 消费一个异步迭代器；实时订阅时用 start / put / close，
+    事件处理器只需把文档放入队列即可返回。
+    """
+
+    def __init__(self, sinks, queue_size=None, batch_options=None, on_written=None, on_error=None):
+        """
+        :param sinks: {名称: (写入函数, 消费者数量)}，写入函数接收一个文档列表，
+                      可以是普通函数（放到线程中执行）或协程函数
+        :param queue_size: 每个写入端队列的最大长度，默认 Config.QUEUE_MAX_SIZE
+        :param batch_options: 传给每个消费者的 AdaptiveBatcher 的参数
+        :param on_written: 可选的协程回调 on_written(名称, 文档列表)，每批写入成功后调用
+        :param on_error: 可选的协程回调 on_error(名称, 文档列表, 异常)。设置后写入失败的批次
+                         交给它处理，消费者继续运行；未设置时异常会终止流水线
+        """
+        self.sinks = sinks
+        self.queue_size = queue_size or config.QUEUE_MAX_SIZE
+        self.batch_options = batch_options or {}
+        self.on_written = on_written
+        self.on_error = on_error
+        self.queues = {name: asyncio.Queue(maxsize=self.queue_size) for name in sinks}
+        self.written = {name: 0 for name in sinks}
+        self.produced = 0
+        self.tasks = []
+
+    async def _write(self, sink, batch):
+        if inspect.iscoroutinefunction(sink):
+            await sink(batch)
+        else:
+            # 同步写入放到线程池执行，避免阻塞 Telethon 的事件循环
+            await asyncio.to_thread(sink, batch)
+
+    async def _consume(self, name, queue, sink):
+        batcher = AdaptiveBatcher(**self.batch_options)
+
+        async def write(batch):
+            await self._write(sink, batch)
+            if self.on_written:
+                await self.on_written(name, batch)
+
+        async def flush():
+            if not self.on_error:
+                return await batcher.flush(write)
+            # flush 会先取出缓冲，出错时需要自己保留这一批交给 on_error
+            batch = batcher.items
+            try:
+                return await batcher.flush(write)
+            except Exception as e:
+                await self.on_error(name, batch, e)
+                return 0
+
+        stop = False
+        while not stop:
+            if queue.empty():
+                # 队列暂时为空时最多等到缓冲的截止时间，保证低流量下也能按时落库
+                try:
+                    item = await asyncio.wait_for(queue.get(), batcher.time_left())
+                except asyncio.TimeoutError:
+                    item = None
+            else:
+                item = queue.get_nowait()
+
+            if item is _STOP:
+                stop = True
+            elif item is not None:
+                batcher.add(item)
+
+            if batcher.should_flush() or (stop and len(batcher)):
+                self.written[name] += await flush()
+
+    def start(self):
+        """启动所有消费者，之后可以通过 put 逐条放入文档"""
+        self.tasks = [
+            asyncio.create_task(self._consume(name, self.queues[name], sink))
+            for name, (sink, consumers) in self.sinks.items()
+            for _ in range(consumers)
+        ]
+
+    async def put(self, doc):
+        """放入一条文档，队列满时等待（反压）；已有消费者出错时抛出该异常"""
+        for task in self.tasks:
+            if task.done() and not task.cancelled() and task.exception():
+                raise task.exception()
+        for queue in self.queues.values():
+            await queue.put(doc)
+        self.produced += 1
+
+    async def _stop_consumers(self):
+        for name, (_, consumers) in self.sinks.items():
+            for _ in range(consumers):
+                await self.queues[name].put(_STOP)
+
+    async def close(self):
+        """停止接收文档，等待缓冲中剩余的文档全部写入"""
+        await self._stop_consumers()
+        results = await asyncio.gather(*self.tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return self.written
+
+    async def _produce(self, docs):
+        async for doc in docs:
+            await self.put(doc)
+        await self._stop_consumers()
+
+    async def run(self, docs):
+        """
+        消费异步可迭代对象 docs 直到结束，并等待所有写入完成。
+        任一写入端出错时停止抓取并抛出该异常。
+        """
+        self.start()
+        tasks = self.tasks + [asyncio.create_task(self._produce(docs))]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception():
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return self.written
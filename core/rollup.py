@@ -0,0 +1,125 @@
+# rollup.py
+# 按聊天 × 天、聊天 × 发送者 × 天预先汇总的统计表。
+# 写入端在写入 telegram_message 的同一个事务中维护这两张表：先锁定并读取批次涉及的已有消息，
+# 再按写入前后的差值累加，重复抓取、断点重放、缓冲回放和查看数刷新都不会重复计数。
+# 这里只有表结构和增量计算，执行 SQL 的部分在 core/mysql.py。
+
+CREATE_CHAT_DAILY_STATS_SQL = """
+                              CREATE TABLE IF NOT EXISTS chat_daily_stats
+                              (
+                                  chat_id        VARCHAR(300) NOT NULL COMMENT '群组/频道ID',
+                                  day            DATE         NOT NULL COMMENT '日期（按消息发送时间）',
+                                  messages       INT          NOT NULL DEFAULT 0 COMMENT '消息数',
+                                  media_messages INT          NOT NULL DEFAULT 0 COMMENT '带媒体的消息数',
+                                  views          BIGINT       NOT NULL DEFAULT 0 COMMENT '查看次数合计',
+                                  forwards       BIGINT       NOT NULL DEFAULT 0 COMMENT '转发次数合计',
+                                  PRIMARY KEY (chat_id, day)
+                              ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='每个聊天每天的消息统计'
+                              """
+
+CREATE_CHAT_SENDER_DAILY_STATS_SQL = """
+                                     CREATE TABLE IF NOT EXISTS chat_sender_daily_stats
+                                     (
+                                         chat_id   VARCHAR(300) NOT NULL COMMENT '群组/频道ID',
+                                         day       DATE         NOT NULL COMMENT '日期（按消息发送时间）',
+                                         sender_id BIGINT       NOT NULL DEFAULT 0 COMMENT '发送者ID，没有发送者时为 0',
+                                         messages  INT          NOT NULL DEFAULT 0 COMMENT '消息数',
+                                         views     BIGINT       NOT NULL DEFAULT 0 COMMENT '查看次数合计',
+                                         PRIMARY KEY (chat_id, day, sender_id)
+                                     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='每个聊天每个发送者每天的消息统计'
+                                     """
+
+# 增量累加，参数为 rollup_deltas 返回的元组
+APPLY_DAILY_SQL = """
+                  INSERT INTO chat_daily_stats (chat_id, day, messages, media_messages, views, forwards)
+                  VALUES (%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY
+                  UPDATE messages = messages + VALUES (messages), media_messages = media_messages + VALUES (media_messages),
+                      views = views + VALUES (views), forwards = forwards + VALUES (forwards)
+                  """
+
+APPLY_SENDER_SQL = """
+                   INSERT INTO chat_sender_daily_stats (chat_id, day, sender_id, messages, views)
+                   VALUES (%s, %s, %s, %s, %s) ON DUPLICATE KEY
+                   UPDATE messages = messages + VALUES (messages), views = views + VALUES (views)
+                   """
+
+# 从 telegram_message 重建一个聊天的汇总（回填用），参数为 (chat_id, telegram_message.chat_id 列中的值)，
+# 两者在分区布局下不同（见 core.mysql.chat_column）
+BACKFILL_DAILY_SQL = """
+                     INSERT INTO chat_daily_stats (chat_id, day, messages, media_messages, views, forwards)
+                     SELECT %s, DATE(date), COUNT(*), COUNT(media_type), COALESCE(SUM(views), 0), COALESCE(SUM(forwards), 0)
+                     FROM telegram_message
+                     WHERE chat_id = %s
+                     GROUP BY DATE(date)
+                     """
+
+BACKFILL_SENDER_SQL = """
+                      INSERT INTO chat_sender_daily_stats (chat_id, day, sender_id, messages, views)
+                      SELECT %s, DATE(date), COALESCE(sender_id, 0), COUNT(*), COALESCE(SUM(views), 0)
+                      FROM telegram_message
+                      WHERE chat_id = %s
+                      GROUP BY DATE(date), COALESCE(sender_id, 0)
+                      """
+
+# 计算增量需要的已有消息字段，顺序与 rollup_deltas 中 existing 的值一致
+EXISTING_COLUMNS = ("date", "sender_id", "views", "forwards", "media_type")
+
+
+def _add(daily, senders, chat_id, row, sign):
+    date, sender_id, views, forwards, media_type = row
+    day = date.date()
+    views = views or 0
+    stats = daily.setdefault((chat_id, day), [0, 0, 0, 0])
+    stats[0] += sign
+    stats[1] += sign if media_type else 0
+    stats[2] += sign * views
+    stats[3] += sign * (forwards or 0)
+    stats = senders.setdefault((chat_id, day, sender_id or 0), [0, 0])
+    stats[0] += sign
+    stats[1] += sign * views
+
+
+def rollup_deltas(upserts, existing, deleted, edited=()):
+    """
+    计算一个批次对汇总表的增量，按写入顺序依次应用 upsert、编辑和删除。
+
+    :param upserts: mysql_row() 元组列表
+    :param existing: 批次写入前已存在的消息 {(chat_id, message_id): EXISTING_COLUMNS 顺序的元组}
+    :param deleted: 被删除的消息的 (chat_id, message_id) 列表
+    :param edited: 编辑事件的 (chat_id, message_id, media_type) 列表
+    :return: (APPLY_DAILY_SQL 的参数列表, APPLY_SENDER_SQL 的参数列表)，增量为 0 的行不包含在内
+    """
+    existing = dict(existing)
+    daily = {}
+    senders = {}
+    for message_id, chat_id, _, date, sender_id, views, forwards, media_type, _, _ in upserts:
+        key = (chat_id, message_id)
+        old = existing.get(key)
+        if old is None:
+            new = (date, sender_id, views, forwards, media_type)
+        else:
+            # upsert 不修改已有消息的发送时间和发送者，只更新查看、转发次数和媒体类型
+            _add(daily, senders, chat_id, old, -1)
+            new = (old[0], old[1], views, forwards, media_type)
+        _add(daily, senders, chat_id, new, 1)
+        # 同一批次中重复出现的消息，后一次在前一次的基础上计算
+        existing[key] = new
+    for chat_id, message_id, media_type in edited:
+        key = (chat_id, message_id)
+        old = existing.get(key)
+        # 编辑不存在的消息时 UPDATE 不影响任何行
+        if old is None:
+            continue
+        # 编辑会改写媒体类型，其余字段不变
+        new = (*old[:4], media_type)
+        _add(daily, senders, chat_id, old, -1)
+        _add(daily, senders, chat_id, new, 1)
+        existing[key] = new
+    for key in deleted:
+        old = existing.pop(key, None)
+        if old is not None:
+            _add(daily, senders, key[0], old, -1)
+    return (
+        [(*key, *stats) for key, stats in daily.items() if any(stats)],
+        [(*key, *stats) for key, stats in senders.items() if any(stats)],
+    )
@@ -0,0 +1,157 @@
+# scheduler.py
+import asyncio
+import inspect
+import time
+from collections import deque
+
+from telethon.errors import FloodPremiumWaitError, FloodWaitError
+
+from core.config import config
+
+# iter_messages 每次请求最多返回的消息数（Telegram API 上限，Telethon 内部固定使用）
+PAGE_SIZE = 100
+
+
+class RequestScheduler:
+    """
+    Telethon 请求调度器，包装 get_entity / get_messages / iter_messages。
+
+    - 统计每个方法最近一分钟的请求速率
+    - 遇到 FloodWait 时，该方法的所有调用都等待到解封时间后再重试，
+      iter_messages 从最后一条已返回的消息处续上，而不是整个任务失败
+    - 按 AIMD 调整 iter_messages 翻页之间的间隔：被限流就加倍，
+      连续一段时间没有被限流就逐步减小，使抓取速度贴近账号能承受的上限
+
+    其余属性和方法直接转发给被包装的 client，可以当作 client 使用。
+    """
+
+    def __init__(self, client, on_wait=None, max_retries=None):
+        """
+        :param client: TelegramClient
+        :param on_wait: 可选回调 on_wait(方法名, 等待秒数)，进入 FloodWait 时调用，可以是协程函数
+        :param max_retries: 同一次调用最多因 FloodWait 重试的次数
+        """
+        self.client = client
+        # 让 Telethon 把所有 FloodWait 都抛出来，由调度器统一等待并记录
+        client.flood_sleep_threshold = 0
+        self.on_wait = on_wait
+        self.max_retries = max_retries if max_retries is not None else config.FLOOD_MAX_RETRIES
+        self.requests = {}
+        self.blocked_until = {}
+        self.page_delay = 0.0
+        self.pages_since_flood = 0
+        self.flood_waits = 0
+        # 由 SessionPool 在租用会话时挂上 EntityCache
+        self.entity_cache = None
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _record(self, method):
+        now = time.monotonic()
+        window = self.requests.setdefault(method, deque())
+        window.append(now)
+        while window and window[0] < now - 60:
+            window.popleft()
+
+    async def _wait_turn(self, method):
+        delay = self.blocked_until.get(method, 0) - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _flood(self, method, seconds):
+        self.flood_waits += 1
+        self.blocked_until[method] = time.monotonic() + seconds
+        # 被限流说明当前节奏过快，翻页间隔加倍
+        self.page_delay = min(max(self.page_delay * 2, config.FLOOD_MIN_PAGE_DELAY), config.FLOOD_MAX_PAGE_DELAY)
+        self.pages_since_flood = 0
+        print(f"FloodWait on {method}: sleeping {seconds}s, page delay now {self.page_delay:.2f}s")
+        if self.on_wait:
+            result = self.on_wait(method, seconds)
+            if inspect.isawaitable(result):
+                await result
+        await self._wait_turn(method)
+
+    async def _call(self, method, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            await self._wait_turn(method)
+            self._record(method)
+            try:
+                return await getattr(self.client, method)(*args, **kwargs)
+            except (FloodWaitError, FloodPremiumWaitError) as e:
+                if attempt == self.max_retries:
+                    raise
+                await self._flood(method, e.seconds)
+
+    async def get_entity(self, entity, **kwargs):
+        # 单个用户名/ID 优先走实体缓存，其余（实体对象、列表）直接解析
+        if self.entity_cache and not kwargs and isinstance(entity, (str, int)):
+            return await self.entity_cache.get(entity)
+        return await self._call('get_entity', entity, **kwargs)
+
+    async def warm_entities(self, chats):
+        """批量预热实体缓存，没有缓存时什么也不做"""
+        if self.entity_cache:
+            await self.entity_cache.warm(chats)
+
+    async def get_messages(self, *args, **kwargs):
+        return await self._call('get_messages', *args, **kwargs)
+
+    async def iter_messages(self, entity, limit=None, min_id=0, max_id=0, reverse=False, **kwargs):
+        """
+        与 client.iter_messages 相同，但会在 FloodWait 后从断开处继续，
+        并在每页之间按当前的翻页间隔限速。
+        """
+        method = 'iter_messages'
+        yielded = 0
+        retries = 0
+        while True:
+            await self._wait_turn(method)
+            self._record(method)
+            try:
+                async for message in self.client.iter_messages(
+                        entity, limit=None if limit is None else limit - yielded,
+                        min_id=min_id, max_id=max_id, reverse=reverse, **kwargs):
+                    # 从断开处续上：正序时抬高下界，倒序时压低上界
+                    if reverse:
+                        min_id = message.id
+                    else:
+                        max_id = message.id
+                    yield message
+                    yielded += 1
+                    if yielded % PAGE_SIZE == 0:
+                        # Telethon 在当前页消费完之后才请求下一页，在此处等待即可控制翻页速度
+                        await self._page_done(method)
+                return
+            except (FloodWaitError, FloodPremiumWaitError) as e:
+                if retries == self.max_retries:
+                    raise
+                retries += 1
+                await self._flood(method, e.seconds)
+
+    async def _page_done(self, method):
+        self.pages_since_flood += 1
+        if self.pages_since_flood >= config.FLOOD_RELAX_PAGES and self.page_delay > 0:
+            # 一段时间没有被限流，逐步缩短翻页间隔
+            self.page_delay = max(0.0, self.page_delay - config.FLOOD_MIN_PAGE_DELAY)
+            self.pages_since_flood = 0
+        if self.page_delay:
+            await asyncio.sleep(self.page_delay)
+        self._record(method)
+
+    def state(self):
+        """当前调度状态，用于进度上报"""
+        now = time.monotonic()
+        waiting = {
+            method: round(until - now, 1)
+            for method, until in self.blocked_until.items()
+            if until > now
+        }
+        return {
+            "flood_wait": waiting,
+            "flood_waits": self.flood_waits,
+            "page_delay": round(self.page_delay, 2),
+            "requests_per_minute": {
+                method: sum(1 for t in window if t >= now - 60) for method, window in self.requests.items()
+            },
+        }
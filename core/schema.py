@@ -0,0 +1,228 @@
+# schema.py
+import hashlib
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import orjson
+from telethon import utils
+from telethon.tl.types import Message
+
+# telegram_message 表的列顺序，mysql_row() 与 UPSERT_MESSAGE_SQL 都按此顺序
+MESSAGE_COLUMNS = (
+    "message_id", "chat_id", "message", "date", "sender_id",
+    "views", "forwards", "media_type", "message_link", "edited_at",
+)
+
+CREATE_MESSAGE_TABLE_SQL = """
+                           CREATE TABLE IF NOT EXISTS telegram_message
+                           (
+                               id           BIGINT UNSIGNED NOT NULL AUTO_INCREMENT COMMENT '自增主键',
+                               message_id   BIGINT          NOT NULL COMMENT 'Telegram消息ID',
+                               chat_id      VARCHAR(300)    NOT NULL COMMENT '群组/频道ID',
+                               message      TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci COMMENT '消息内容',
+                               date         DATETIME        NOT NULL COMMENT '消息发送时间',
+                               sender_id    BIGINT COMMENT '发送者ID',
+                               views        INT COMMENT '查看次数',
+                               forwards     INT COMMENT '转发次数',
+                               media_type   VARCHAR(800) COMMENT '媒体类型(photo/video/document等)',
+                               message_link VARCHAR(800) COMMENT '消息链接',
+                               edited_at    DATETIME NULL COMMENT '消息最后编辑时间',
+                               PRIMARY KEY (id),
+                               UNIQUE KEY uniq_msg (chat_id, message_id),
+                               KEY idx_chat (chat_id),
+                               KEY idx_date (date),
+                               KEY idx_sender (sender_id)
+                           ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='存储Telegram消息'
+                           """
+
+
+# 分区布局（MYSQL_PARTITIONED）：按发送时间每月一个 RANGE 分区，chat_id 存为数字键。
+# MySQL 要求分区列出现在每个唯一键中，所以主键和 uniq_msg 都带上 date；
+# 同一条消息的发送时间不会变，uniq_msg 仍然能对重复写入去重。{partitions} 由 month_partitions 生成
+CREATE_PARTITIONED_MESSAGE_TABLE_SQL = """
+                                       CREATE TABLE IF NOT EXISTS {table}
+                                       (
+                                           id           BIGINT UNSIGNED NOT NULL AUTO_INCREMENT COMMENT '自增主键',
+                                           message_id   BIGINT          NOT NULL COMMENT 'Telegram消息ID',
+                                           chat_id      BIGINT          NOT NULL COMMENT '群组/频道ID的数字键，对应 telegram_chat_key',
+                                           message      TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci COMMENT '消息内容',
+                                           date         DATETIME        NOT NULL COMMENT '消息发送时间',
+                                           sender_id    BIGINT COMMENT '发送者ID',
+                                           views        INT COMMENT '查看次数',
+                                           forwards     INT COMMENT '转发次数',
+                                           media_type   VARCHAR(800) COMMENT '媒体类型(photo/video/document等)',
+                                           message_link VARCHAR(800) COMMENT '消息链接',
+                                           edited_at    DATETIME NULL COMMENT '消息最后编辑时间',
+                                           PRIMARY KEY (id, date),
+                                           UNIQUE KEY uniq_msg (chat_id, message_id, date),
+                                           KEY idx_chat_date (chat_id, date),
+                                           KEY idx_sender (sender_id)
+                                       ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='存储Telegram消息（按月分区）'
+                                       PARTITION BY RANGE COLUMNS(date) ({partitions})
+                                       """
+
+CREATE_CHAT_KEY_TABLE_SQL = """
+                            CREATE TABLE IF NOT EXISTS telegram_chat_key
+                            (
+                                chat_key BIGINT       NOT NULL COMMENT 'chat_id 的数字键',
+                                chat_id  VARCHAR(300) NOT NULL COMMENT '群组/频道ID',
+                                PRIMARY KEY (chat_key)
+                            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='分区布局下 chat_id 数字键与原值的对应关系'
+                            """
+
+# 与 chat_key() 相同的计算，供迁移的 SQL 和触发器使用，{} 为 chat_id 列或表达式
+CHAT_KEY_SQL = "CAST(CONV(LEFT(SHA1({}), 15), 16, 10) AS SIGNED)"
+
+
+def chat_key(chat_id):
+    """
+    chat_id 的 60 位数字键：SHA1 的前 15 个十六进制位。不需要查表就能在写入端和 SQL（CHAT_KEY_SQL）中
+    得到相同的值，索引比 VARCHAR(300) 紧凑得多。
+    """
+    return int(hashlib.sha1(str(chat_id).encode('utf-8')).hexdigest()[:15], 16)
+
+
+def month_partitions(start, end):
+    """
+    从 start 所在月到 end 所在月（含）的分区定义，分区名为 pYYYYMM，最后是兜底的 pmax。
+    """
+    year, month = start.year, start.month
+    partitions = []
+    while (year, month) <= (end.year, end.month):
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        partitions.append(
+            f"PARTITION p{year:04d}{month:02d} VALUES LESS THAN ('{next_year:04d}-{next_month:02d}-01')"
+        )
+        year, month = next_year, next_month
+    partitions.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+    return partitions
+
+
+def document_id(chat_id, message_id):
+    """ES 文档 _id，同一条消息在各写入路径中保持一致"""
+    return f"{chat_id}_{message_id}"
+
+
+def chat_id_of(entity):
+    """
+    聊天的规范 chat_id：解析出的实体的 peer id（频道为 -100 开头）转成字符串。
+    所有写入路径（命令行、Celery、实时订阅）都用它作为 ES _id、MySQL、断点和汇总中的 chat_id，
+    同一个聊天不论命令行里写的是 @name 还是数字 ID 都只有一份数据。
+    """
+    return str(utils.get_peer_id(entity))
+
+
+def is_stored_message(msg):
+    """所有写入路径共用的过滤：保存普通消息（包括只有媒体、没有文字的），跳过 MessageService 等"""
+    return isinstance(msg, Message)
+
+
+def link_prefix(chat_id, username=None):
+    """消息链接中消息 ID 之前的部分，同一聊天只需计算一次；公开聊天优先使用用户名"""
+    if username:
+        return f"https://t.me/{username}/"
+    if chat_id.startswith('@'):
+        return f"https://t.me/{chat_id[1:]}/"
+    # t.me/c/ 链接使用不带 -100 标记的频道 ID
+    return f"https://t.me/c/{utils.resolve_id(int(chat_id))[0]}/"
+
+
+def message_link(chat_id, message_id, username=None):
+    return f"{link_prefix(chat_id, username)}{message_id}"
+
+
+_TAG_RE = re.compile(r'<[^>]+>')
+
+
+def strip_tags(text):
+    """去掉 HTML 标签；绝大多数消息不含 '<'，直接返回原文，不进入正则"""
+    if '<' in text:
+        return _TAG_RE.sub('', text)
+    return text
+
+
+# 媒体类 -> media_type，如 MessageMediaPhoto -> photo；按类缓存，不再对媒体对象取字符串
+_MEDIA_TYPES = {}
+
+
+def media_type(media):
+    if media is None:
+        return None
+    cls = type(media)
+    name = _MEDIA_TYPES.get(cls)
+    if name is None:
+        name = _MEDIA_TYPES[cls] = cls.__name__.removeprefix("MessageMedia").lower()
+    return name
+
+
+@dataclass(slots=True)
+class MessageRecord:
+    """
+    一条消息在 MySQL 和 ES 中的统一结构，CLI 抓取、实时订阅和 Celery 任务都使用它。
+
+    使用 __slots__ 而不是 dict：内存更小，orjson 可以直接序列化，
+    写入 ES 时不需要再逐条构建字典。
+    """
+
+    message_id: int
+    chat_id: str
+    message: str
+    date: datetime
+    sender_id: Optional[int] = None
+    views: int = 0
+    forwards: int = 0
+    media_type: Optional[str] = None
+    message_link: Optional[str] = None
+    edited_at: Optional[datetime] = None
+
+    @classmethod
+    def from_message(cls, msg, chat_id, username=None):
+        """从 Telethon Message 转换"""
+        return cls.from_messages((msg,), chat_id, username)[0]
+
+    @classmethod
+    def from_messages(cls, msgs, chat_id, username=None):
+        """
+        批量转换同一聊天的消息：链接前缀只计算一次，
+        查找函数提前绑定到局部变量，省去逐条的全局查找。
+        chat_id 应为 chat_id_of(实体)，username 为实体的用户名（用于生成公开链接）。
+        """
+        prefix = link_prefix(chat_id, username)
+        strip = strip_tags
+        media_types = _MEDIA_TYPES
+        records = []
+        append = records.append
+        for msg in msgs:
+            text = msg.message
+            media = msg.media
+            message_id = msg.id
+            append(cls(
+                message_id,
+                chat_id,
+                strip(text) if text else "",
+                msg.date,
+                msg.sender_id,
+                msg.views or 0,
+                msg.forwards or 0,
+                (media_types.get(type(media)) or media_type(media)) if media is not None else None,
+                f"{prefix}{message_id}",
+                msg.edit_date,
+            ))
+        return records
+
+    @property
+    def doc_id(self):
+        return document_id(self.chat_id, self.message_id)
+
+    def mysql_row(self):
+        """按 MESSAGE_COLUMNS 顺序排列的元组"""
+        return (
+            self.message_id, self.chat_id, self.message, self.date, self.sender_id,
+            self.views, self.forwards, self.media_type, self.message_link, self.edited_at,
+        )
+
+    def es_source(self):
+        """ES 文档正文，已编码为 JSON 字节，bulk 时原样发送"""
+        return orjson.dumps(self)
@@ -0,0 +1,124 @@
+# scrape.py
+# cli.py 和 telegram_es_cli.py 共用的历史消息抓取流程
+import asyncio
+import logging
+import time
+
+from core.checkpoint import CheckpointTracker, get_checkpoint
+from core.config import config
+from core.es import save_to_es
+from core.mysql import save_to_mysql
+from core.pipeline import IngestPipeline
+from core.schema import MessageRecord, chat_id_of, is_stored_message
+from core.spool import Spool
+
+logger = logging.getLogger(__name__)
+
+# 写入端不可用时的本地缓冲，恢复后由后台任务回放
+spool = Spool()
+SPOOL_SINKS = {"es": save_to_es, "mysql": save_to_mysql}
+
+
+async def spool_failed_batch(sink, docs, error, sync=False):
+    """IngestPipeline 的 on_error 回调：把写入失败的批次存入本地缓冲"""
+    logger.error("✗ 写入 %s 失败，%d 条转入本地缓冲: %s", sink, len(docs), error)
+    await spool.append(sink, docs, sync=sync)
+
+
+# 主爬取函数
+async def scrape_messages(client, channel_name, min_id, max_id, resume=False):
+    print(f"Starting scrape for chat {channel_name}. Range: {min_id} to {max_id}")
+
+    # 获取最小/最大ID的实际值
+    real_min_id = 0 if min_id < 0 else min_id
+    real_max_id = None if max_id < 0 else max_id
+
+    # 不论命令行里写的是 @name 还是数字 ID，数据和断点都记在实体的 peer id 下
+    entity = await client.get_entity(channel_name)
+    chat_id = chat_id_of(entity)
+    username = getattr(entity, 'username', None)
+
+    # 从断点继续：跳过已经同时写入 ES 和 MySQL 的消息
+    if resume:
+        checkpoint = await get_checkpoint(chat_id)
+        if checkpoint is not None and checkpoint > real_min_id:
+            print(f"Resuming chat {channel_name} from checkpoint {checkpoint}")
+            real_min_id = checkpoint
+
+    started = time.monotonic()
+    total_message_count = 0
+    if real_max_id:
+        total_message_count = real_max_id - real_min_id + 1
+
+    # 多个聊天并发抓取，进度按聊天每 SCRAPE_PROGRESS_EVERY 条输出一行，而不是逐条输出
+    progress_every = max(config.SCRAPE_PROGRESS_EVERY, 1)
+
+    async def fetch_docs():
+        message_count = 0
+        async for message in client.iter_messages(
+                entity=entity,
+                min_id=real_min_id,
+                max_id=real_max_id,
+                reverse=True  # 从旧到新获取
+        ):
+            if not is_stored_message(message):
+                continue
+
+            doc = MessageRecord.from_message(message, chat_id, username)
+            tracker.add(doc.message_id)
+            message_count += 1
+            if message_count % progress_every == 0:
+                rate = message_count / max(time.monotonic() - started, 1e-9)
+                print(f"[{channel_name}] {message_count} / {total_message_count or '?'} messages pulled, "
+                      f"message_id: {doc.message_id}, {rate:.0f} msg/s")
+            yield doc
+
+    # 抓取与写入解耦：ES 和 MySQL 各自由一组消费者从有界队列中批量写入，
+    # 两端都写入成功的消息才会推进断点
+    sinks = {
+        "es": (spool.guard("es", save_to_es), config.ES_CONSUMERS),
+        "mysql": (spool.guard("mysql", save_to_mysql), config.MYSQL_CONSUMERS),
+    }
+    tracker = CheckpointTracker(chat_id, sinks)
+
+    # 写入端不可用时批次转入本地缓冲，由后台回放补写，抓取不中断；缓冲回放完之前新批次也写入缓冲。
+    # 缓冲就是预写日志：批次 fsync 落盘后视为已写入，断点可以越过它，
+    # 否则之后的消息都会卡在 tracker 中，内存随抓取量无限增长
+    async def on_error(sink, docs, error):
+        await spool_failed_batch(sink, docs, error, sync=True)
+        await tracker.written(sink, docs)
+
+    pipeline = IngestPipeline(sinks, on_written=tracker.written, on_error=on_error)
+    written = await pipeline.run(fetch_docs())
+
+    elapsed = time.monotonic() - started
+    print(f"Completed! Total {pipeline.produced} messages processed in chat {channel_name} "
+          f"(es: {written['es']}, mysql: {written['mysql']}) in {elapsed:.1f}s")
+    return pipeline.produced, elapsed
+
+
+# 并发爬取多个聊天
+async def scrape_chats(client, chat_ids, min_id, max_id, resume=False, concurrency=None):
+    """共用同一个 TelegramClient 并发爬取多个聊天，每个聊天有自己的流水线和断点"""
+    semaphore = asyncio.Semaphore(concurrency or config.SCRAPE_CONCURRENCY)
+
+    async def scrape_one(chat_id):
+        async with semaphore:
+            return await scrape_messages(client, chat_id, min_id, max_id, resume=resume)
+
+    await client.warm_entities(chat_ids)
+    started = time.monotonic()
+    results = await asyncio.gather(*(scrape_one(chat_id) for chat_id in chat_ids), return_exceptions=True)
+    elapsed = time.monotonic() - started
+
+    # 汇总每个聊天及总体的吞吐量
+    print(f"\n{'chat':<40}{'messages':>12}{'seconds':>10}{'msg/s':>10}")
+    total = 0
+    for chat_id, result in zip(chat_ids, results):
+        if isinstance(result, BaseException):
+            print(f"{chat_id:<40}  FAILED: {result}")
+            continue
+        count, chat_elapsed = result
+        total += count
+        print(f"{chat_id:<40}{count:>12}{chat_elapsed:>10.1f}{count / max(chat_elapsed, 1e-9):>10.1f}")
+    print(f"{'TOTAL':<40}{total:>12}{elapsed:>10.1f}{total / max(elapsed, 1e-9):>10.1f}")
@@ -0,0 +1,137 @@
+# search_cache.py
+import logging
+import time
+from collections import OrderedDict
+
+import orjson
+import redis.asyncio as aioredis
+
+from core.config import config
+
+logger = logging.getLogger(__name__)
+
+# 每个聊天的索引版本号（Redis 哈希 chat_id -> 版本），写入端每写入一批就递增
+GENERATIONS_KEY = "search_cache:generations"
+# 每个聊天最近一次写入的时间（Redis 哈希 chat_id -> Unix 时间戳）
+BUMPED_KEY = "search_cache:bumped"
+# 不限定聊天的查询依赖的全局版本号，任何聊天有写入都会递增
+ALL_CHATS = "*"
+# 所有查询都依赖的版本号，只在所有聊天的结果都可能变化时递增（如批量导入结束后刷新索引）
+EPOCH = "#"
+
+# 写入端递增版本号用的客户端
+_redis = None
+
+
+def _get_redis():
+    global _redis
+    if _redis is None:
+        _redis = aioredis.from_url(config.REDIS_URL, decode_responses=True)
+    return _redis
+
+
+async def close_generations_client():
+    """关闭写入端的 Redis 客户端；与 close_es_client 一样在事件循环结束前调用"""
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
+
+
+async def bump_generations(chat_ids):
+    """
+    文档写入 ES 后调用，递增这些聊天及全局的版本号，API 进程中涉及它们的缓存结果随之失效。
+    同时记录写入时间：文档要到下一次 refresh 才能被搜到，之后 SEARCH_CACHE_REFRESH_WINDOW 秒内的结果不缓存。
+    只影响缓存的新鲜度，Redis 不可用时记录日志而不让写入失败（缓存仍受 TTL 限制）。
+    """
+    await _bump({str(chat_id) for chat_id in chat_ids} | {ALL_CHATS})
+
+
+async def bump_epoch():
+    """使所有缓存结果失效，用于批量导入结束、索引刷新之后"""
+    await _bump({EPOCH})
+
+
+async def _bump(fields):
+    try:
+        now = time.time()
+        pipe = _get_redis().pipeline(transaction=False)
+        for name in fields:
+            pipe.hincrby(GENERATIONS_KEY, name, 1)
+        pipe.hset(BUMPED_KEY, mapping={name: now for name in fields})
+        await pipe.execute()
+    except Exception:
+        logger.exception("递增搜索缓存版本号失败")
+
+
+class SearchCache:
+    """
+    搜索结果缓存：进程内 LRU + TTL。
+
+    缓存键是规范化后的查询参数。每个条目同时记录查询时相关聊天的版本号，
+    读取时版本号与 Redis 中的不一致（这些聊天有新写入）就视为失效，
+    因此失效只影响被查询的聊天，不会因为别的聊天有写入而清空整个缓存。
+    相关聊天在 refresh_window 秒内有写入时，新文档可能还没有刷新、搜不到，这时的结果不缓存。
+    """
+
+    def __init__(self, maxsize=None, ttl=None, redis_client=None, refresh_window=None):
+        self.maxsize = maxsize or config.SEARCH_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else config.SEARCH_CACHE_TTL
+        self.refresh_window = refresh_window if refresh_window is not None else config.SEARCH_CACHE_REFRESH_WINDOW
+        self.redis = redis_client or aioredis.from_url(config.REDIS_URL, decode_responses=True)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(params):
+        return orjson.dumps(params, option=orjson.OPT_SORT_KEYS)
+
+    async def _generations(self, chat_ids):
+        """
+        读取查询相关的版本号和其中最近一次写入的时间；
+        Redis 不可用时返回 (None, None)，本次查询不使用缓存。
+        """
+        fields = [*(sorted(chat_ids) if chat_ids else [ALL_CHATS]), EPOCH]
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hmget(GENERATIONS_KEY, fields)
+            pipe.hmget(BUMPED_KEY, fields)
+            generations, bumped = await pipe.execute()
+        except Exception:
+            logger.exception("读取搜索缓存版本号失败")
+            return None, None
+        return tuple(generations), max((float(value) for value in bumped if value is not None), default=0.0)
+
+    async def get_or_search(self, params, chat_ids, search):
+        """
+        命中且未失效时返回缓存结果，否则执行协程函数 search() 并缓存其结果。
+        返回 (结果, 是否命中缓存)。
+        """
+        if not self.ttl:
+            return await search(), False
+        key = self.make_key(params)
+        generations, bumped = await self._generations(chat_ids)
+        entry = self.entries.get(key)
+        now = time.monotonic()
+        if generations is not None and entry is not None and entry[0] > now and entry[1] == generations:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2], True
+
+        self.misses += 1
+        # 版本号在查询前读取：查询期间有新写入时，下次读取会发现版本号已变化
+        searched_at = time.time()
+        result = await search()
+        if generations is not None and searched_at - bumped >= self.refresh_window:
+            self.entries[key] = (now + self.ttl, generations, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return result, False
+
+    def stats(self):
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+    async def close(self):
+        await self.redis.aclose()
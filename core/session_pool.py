@@ -0,0 +1,174 @@
+# session_pool.py
+import asyncio
+import inspect
+import logging
+import random
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+import redis.asyncio as aioredis
+from telethon import TelegramClient
+from telethon.errors import AuthKeyUnregisteredError, RPCError, SessionRevokedError, UserDeactivatedBanError
+
+from core.config import config
+from core.entity_cache import EntityCache
+from core.scheduler import RequestScheduler
+
+logger = logging.getLogger(__name__)
+
+# 只有持锁者才能释放 / 续期，避免锁过期后误删别人的锁
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# 这些错误说明账号本身已不可用，应长期停用而不是短暂冷却
+_FATAL_ERRORS = (AuthKeyUnregisteredError, SessionRevokedError, UserDeactivatedBanError)
+
+
+class SessionPool:
+    """
+    多账号 Telethon 会话池。
+
+    每次 lease 从 Config.SESSION_POOL 中挑一个空闲的会话文件，通过 Redis 锁
+    （session_lock:{name}，带过期时间并在后台续期）保证同一时间只被一个进程使用。
+    每个会话在 session_health:{name} 中记录 FloodWait、错误次数和最后使用时间，
+    遇到较长的 FloodWait 会写入 session_cooldown:{name} 冷却，冷却期内不再被租出。
+    续期失败（锁已过期被别人拿走，或 Redis 长时间不可用）时立即断开客户端并中止租用：
+    两个客户端同时使用同一个授权密钥会触发 AuthKeyDuplicatedError，会话随之作废。
+    """
+
+    def __init__(self, sessions=None, redis_client=None, lock_ttl=None):
+        self.sessions = sessions or config.SESSION_POOL
+        self.redis = redis_client or aioredis.from_url(config.REDIS_URL, decode_responses=True)
+        self.lock_ttl = lock_ttl or config.SESSION_LOCK_TTL
+
+    async def _candidates(self):
+        """未冷却的会话，按最近的 FloodWait 次数从少到多排序（相同时随机）"""
+        candidates = []
+        for name in self.sessions:
+            if await self.redis.exists(f"session_cooldown:{name}"):
+                continue
+            flood_waits = int(await self.redis.hget(f"session_health:{name}", "flood_waits") or 0)
+            candidates.append((flood_waits, random.random(), name))
+        return [name for _, _, name in sorted(candidates)]
+
+    async def _acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            for name in await self._candidates():
+                token = uuid.uuid4().hex
+                if await self.redis.set(f"session_lock:{name}", token, nx=True, ex=self.lock_ttl):
+                    return name, token
+            if time.monotonic() >= deadline:
+                raise RuntimeError(f"No free Telegram session among {len(self.sessions)} configured")
+            await asyncio.sleep(1)
+
+    async def _renew(self, name, token, on_lost):
+        """
+        每 lock_ttl / 3 秒续期一次。锁已不属于自己时调用 on_lost 并退出；
+        Redis 出错时每秒重试，距上次续期超过 2 / 3 个 lock_ttl 仍未成功时，锁随时可能过期，同样视为丢失。
+        """
+        interval = self.lock_ttl / 3
+        renewed = time.monotonic()
+        delay = interval
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                ok = await self.redis.eval(_RENEW_SCRIPT, 1, f"session_lock:{name}", token, self.lock_ttl)
+            except Exception as e:
+                if time.monotonic() - renewed + 1 < 2 * interval:
+                    logger.warning("续期会话 %s 的锁失败，稍后重试: %s", name, e)
+                    delay = min(1, interval)
+                    continue
+                await on_lost(f"Redis 不可用，无法续期: {e}")
+                return
+            if not ok:
+                await on_lost("锁已过期或被其他进程持有")
+                return
+            renewed = time.monotonic()
+            delay = interval
+
+    async def report_flood(self, name, seconds):
+        """记录一次 FloodWait；较长的等待会让会话进入冷却"""
+        await self.redis.hincrby(f"session_health:{name}", "flood_waits", 1)
+        # FloodWait 计数随时间淡化，冷却结束后的会话不会一直排在最后
+        await self.redis.expire(f"session_health:{name}", config.SESSION_HEALTH_TTL)
+        if seconds >= config.SESSION_COOLDOWN_THRESHOLD:
+            await self.redis.set(f"session_cooldown:{name}", int(seconds), ex=int(seconds))
+
+    async def report_error(self, name, error):
+        """记录一次 Telegram 错误；账号失效类错误会让会话长期停用"""
+        key = f"session_health:{name}"
+        await self.redis.hset(key, mapping={"last_error": repr(error)[:500], "last_error_at": int(time.time())})
+        await self.redis.hincrby(key, "errors", 1)
+        if isinstance(error, _FATAL_ERRORS):
+            await self.redis.set(f"session_cooldown:{name}", "disabled", ex=config.SESSION_DISABLE_TTL)
+
+    @asynccontextmanager
+    async def lease(self, on_wait=None, timeout=None):
+        """
+        租用一个会话，返回已启动的、经 RequestScheduler 包装的客户端。
+        on_wait 会在 FloodWait 时与会话池自身的记录一起被调用。
+        """
+        name, token = await self._acquire(timeout if timeout is not None else config.SESSION_LEASE_TIMEOUT)
+        holder = asyncio.current_task()
+        lost = None
+
+        async def handle_wait(method, seconds):
+            await self.report_flood(name, seconds)
+            if on_wait:
+                result = on_wait(method, seconds)
+                if inspect.isawaitable(result):
+                    await result
+
+        client = RequestScheduler(TelegramClient(name, int(config.API_ID), config.API_HASH), on_wait=handle_wait)
+        client.session_name = name
+        client.entity_cache = EntityCache(
+            lambda chat: client._call('get_entity', chat), self.redis, name)
+
+        async def on_lost(reason):
+            nonlocal lost
+            lost = reason
+            logger.error("会话 %s 的锁已丢失（%s），断开客户端并中止租用", name, reason)
+            # 先断开，别的进程可能已经租到同一个会话
+            try:
+                if client.is_connected():
+                    await client.disconnect()
+            finally:
+                holder.cancel()
+
+        renewer = asyncio.create_task(self._renew(name, token, on_lost))
+        try:
+            await client.start()
+            await self.redis.hset(f"session_health:{name}", "last_used", int(time.time()))
+            yield client
+        except RPCError as e:
+            await self.report_error(name, e)
+            raise
+        except asyncio.CancelledError:
+            if lost is None:
+                raise
+            # 取消来自 on_lost 而不是外部，转换为普通异常交给调用方
+            if hasattr(holder, "uncancel"):
+                holder.uncancel()
+            raise RuntimeError(f"Telegram session {name} lost its lock ({lost}), lease aborted") from None
+        finally:
+            renewer.cancel()
+            try:
+                if client.is_connected():
+                    await client.disconnect()
+            finally:
+                await self.redis.eval(_RELEASE_SCRIPT, 1, f"session_lock:{name}", token)
+
+    async def close(self):
+        await self.redis.aclose()
@@ -0,0 +1,152 @@
+# sharding.py
+import redis
+
+# 探测密度时每个采样区间最多拉取的消息数
+PROBE_LIMIT = 100
+
+
+async def probe_density(client, entity, lo, hi, buckets):
+    """
+    把 (lo, hi] 等分为 buckets 个采样区间，每个区间从起点拉取一页消息，
+    用 "返回条数 / 覆盖的ID跨度" 估算该区间的消息密度。
+    返回 [(区间起点, 区间终点, 密度), ...]
+    """
+    samples = []
+    width = (hi - lo) / buckets
+    for i in range(buckets):
+        a = lo + int(i * width)
+        b = lo + int((i + 1) * width)
+        if b <= a:
+            continue
+        messages = await client.get_messages(entity, limit=PROBE_LIMIT, min_id=a, max_id=b + 1, reverse=True)
+        if len(messages) >= PROBE_LIMIT:
+            covered = max(messages[-1].id - a, 1)
+        else:
+            covered = b - a
+        samples.append((a, b, len(messages) / covered))
+    return samples
+
+
+def split_by_density(lo, hi, samples, shards):
+    """
+    按估算的消息数而不是ID跨度，把 (lo, hi] 切分为最多 shards 个连续区间。
+    返回 [(区间起点, 区间终点), ...]，区间为左开右闭，相邻区间首尾相接。
+    """
+    # 空区间也给一个很小的权重，避免整段被删光的范围无法切分
+    weights = [(a, b, max(density, 1e-6) * (b - a)) for a, b, density in samples]
+    total = sum(w for _, _, w in weights)
+    if not weights or shards <= 1 or total <= 0:
+        return [(lo, hi)]
+
+    cuts = []
+    target = total / shards
+    acc = 0.0
+    for a, b, w in weights:
+        # 在当前采样区间内线性插值出所有落在其中的切分点
+        while len(cuts) < shards - 1 and acc + w >= target * (len(cuts) + 1):
+            need = target * (len(cuts) + 1) - acc
+            cut = a + int((b - a) * need / w)
+            if lo < cut < hi and (not cuts or cut > cuts[-1]):
+                cuts.append(cut)
+            else:
+                break
+        acc += w
+
+    bounds = [lo] + cuts + [hi]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class ShardRegistry:
+    """
+    记录一个分片抓取任务下所有分片的进度，供进度汇总和动态拆分使用。
+
+    每个分片是 Redis hash task_shard:{parent}:{shard_id}，字段：
+      lo / hi  分片范围 (lo, hi]，hi 可能被其他 worker 拆分时调小
+      pos      已写入的最大消息ID
+      count    已写入的消息数
+      done     是否完成
+    """
+
+    # 剩余跨度小于该值的分片不再拆分
+    MIN_SPLIT_SPAN = 2000
+
+    def __init__(self, redis_client, parent_id):
+        self.redis = redis_client
+        self.parent_id = parent_id
+        self.ids_key = f"task_shards:{parent_id}"
+        self.seq_key = f"task_shards:{parent_id}:seq"
+
+    def _key(self, shard_id):
+        return f"task_shard:{self.parent_id}:{shard_id}"
+
+    def add(self, lo, hi):
+        """登记一个新分片，返回分片ID"""
+        shard_id = self.redis.incr(self.seq_key)
+        self.redis.hset(self._key(shard_id), mapping={"lo": lo, "hi": hi, "pos": lo, "count": 0, "done": 0})
+        self.redis.sadd(self.ids_key, shard_id)
+        return shard_id
+
+    def get(self, shard_id):
+        data = self.redis.hgetall(self._key(shard_id))
+        return {k: int(v) for k, v in data.items()}
+
+    def all(self):
+        return {int(shard_id): self.get(shard_id) for shard_id in self.redis.smembers(self.ids_key)}
+
+    def advance(self, shard_id, pos, count):
+        """记录分片写入进度，返回分片当前的上界（可能已被拆分调小）"""
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key(shard_id), "pos", pos)
+        pipe.hincrby(self._key(shard_id), "count", count)
+        pipe.hget(self._key(shard_id), "hi")
+        return int(pipe.execute()[-1])
+
+    def finish(self, shard_id):
+        self.redis.hset(self._key(shard_id), "done", 1)
+
+    def steal(self):
+        """
+        从剩余跨度最大的未完成分片中拆走后一半，登记为新分片并返回其ID；
+        没有值得拆分的分片时返回 None。
+        使用 WATCH 保证拆分点不会落在对方已经写入的位置之前。
+        """
+        while True:
+            candidates = [
+                (shard["hi"] - shard["pos"], shard_id)
+                for shard_id, shard in self.all().items()
+                if not shard["done"] and shard["hi"] - shard["pos"] >= self.MIN_SPLIT_SPAN
+            ]
+            if not candidates:
+                return None
+            _, victim = max(candidates)
+            key = self._key(victim)
+            with self.redis.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    pos, hi, done = (int(v) for v in pipe.hmget(key, "pos", "hi", "done"))
+                    if done or hi - pos < self.MIN_SPLIT_SPAN:
+                        continue
+                    mid = pos + (hi - pos) // 2
+                    pipe.multi()
+                    pipe.hset(key, "hi", mid)
+                    pipe.execute()
+                except redis.WatchError:
+                    # 对方刚好更新了进度，重新挑选
+                    continue
+            return self.add(mid, hi)
+
+    def progress(self):
+        """汇总所有分片的进度"""
+        shards = self.all()
+        return {
+            "current": sum(shard["count"] for shard in shards.values()),
+            "shards": len(shards),
+            "shards_done": sum(shard["done"] for shard in shards.values()),
+        }
+
+    def clear(self, ex=3600):
+        """任务结束后让分片记录在 ex 秒后过期"""
+        for shard_id in self.redis.smembers(self.ids_key):
+            self.redis.expire(self._key(shard_id), ex)
+        self.redis.expire(self.ids_key, ex)
+        self.redis.expire(self.seq_key, ex)
@@ -0,0 +1,260 @@
+# spool.py
+import asyncio
+import fcntl
+import inspect
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import orjson
+
+from core.config import config
+from core.schema import MessageRecord
+
+logger = logging.getLogger(__name__)
+
+# 写入时被 orjson 转成 ISO 字符串、回放前需要还原的字段
+_DATETIME_FIELDS = ('date', 'edited_at')
+
+
+def _restore(doc):
+    """还原时间字段；不带 _op 的是完整消息，还原为 MessageRecord"""
+    for field in _DATETIME_FIELDS:
+        value = doc.get(field)
+        if isinstance(value, str):
+            doc[field] = datetime.fromisoformat(value)
+    return doc if '_op' in doc else MessageRecord(**doc)
+
+
+class Spool:
+    """
+    写入端不可用时的本地预写缓冲（append-only）。
+
+    每个写入端一个目录 {SPOOL_DIR}/{sink}/，其中是按序号命名的 JSONL 段文件，
+    每行是一个写入失败的批次。当前段超过 SPOOL_SEGMENT_BYTES 后切换到新段；
+    回放整段成功写入后删除。ES 和 MySQL 的写入都是按主键 upsert，
+    段在回放中途失败时下次从头重放不会产生重复数据。
+
+    同一目录可能被多个进程共用（如长期运行的 subscribe 与 spool --replay、scrape）：
+    段文件名带上每个 Spool 实例自己的标识，不同进程不会打开同一个文件；
+    写入进程对当前段持有 flock，回放时对段加非阻塞的排他锁，拿不到锁的段（别的进程
+    正在写入或回放）和它之后的段都等下一轮再处理，保证批次按写入顺序回放。进程退出或崩溃时锁自动释放。
+
+    fsync 策略（SPOOL_FSYNC）：
+      always    每个批次写入后 fsync，进程或机器崩溃都不丢数据
+      interval  距上次 fsync 超过 SPOOL_FSYNC_INTERVAL 秒时 fsync
+      never     只交给操作系统刷盘
+    """
+
+    def __init__(self, directory=None, segment_bytes=None, fsync=None, fsync_interval=None):
+        self.directory = directory or config.SPOOL_DIR
+        self.segment_bytes = segment_bytes or config.SPOOL_SEGMENT_BYTES
+        self.fsync = fsync or config.SPOOL_FSYNC
+        self.fsync_interval = fsync_interval if fsync_interval is not None else config.SPOOL_FSYNC_INTERVAL
+        self.lock = threading.Lock()
+        # 写入端 -> (文件对象, 段路径)
+        self.active = {}
+        self.last_fsync = {}
+        self.replayed = {}
+        self.replay_seconds = {}
+        self.tasks = []
+        # 本实例的段文件标识
+        self.writer_id = f"{os.getpid()}.{uuid.uuid4().hex[:8]}"
+
+    def _dir(self, sink):
+        path = os.path.join(self.directory, sink)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _segments(self, sink):
+        path = self._dir(sink)
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.jsonl'))
+
+    def _open_segment(self, sink):
+        # 段文件名为 {序号}-{创建时间}-{写入者}.jsonl，创建时间用于计算积压时长
+        segments = self._segments(sink)
+        seq = int(os.path.basename(segments[-1]).split('-')[0]) + 1 if segments else 1
+        path = os.path.join(self._dir(sink), f"{seq:012d}-{int(time.time())}-{self.writer_id}.jsonl")
+        # 先以临时名创建并加锁，再改成 .jsonl：回放进程能看到的段一定已经被锁住
+        file = open(path + '.tmp', 'ab')
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        os.rename(path + '.tmp', path)
+        self.active[sink] = (file, path)
+        self.last_fsync[sink] = time.monotonic()
+        return self.active[sink]
+
+    def _close_segment(self, sink):
+        file, _ = self.active.pop(sink)
+        file.flush()
+        os.fsync(file.fileno())
+        # 关闭文件同时释放 flock，段可以被回放
+        file.close()
+
+    def _append(self, sink, docs, sync):
+        line = orjson.dumps(docs, default=str) + b'\n'
+        with self.lock:
+            file, _ = self.active.get(sink) or self._open_segment(sink)
+            file.write(line)
+            file.flush()
+            now = time.monotonic()
+            if sync or self.fsync == 'always' or (
+                    self.fsync == 'interval' and now - self.last_fsync[sink] >= self.fsync_interval):
+                os.fsync(file.fileno())
+                self.last_fsync[sink] = now
+            if file.tell() >= self.segment_bytes:
+                self._close_segment(sink)
+
+    async def append(self, sink, docs, sync=False):
+        """
+        把一个批次追加到写入端的当前段（文件 I/O 放到线程中执行）。
+        sync 为 True 时不论 SPOOL_FSYNC 策略都在返回前 fsync，调用方可以把这一批视为已落盘。
+        """
+        await asyncio.to_thread(self._append, sink, docs, sync)
+
+    def _rotate(self, sink):
+        """关闭本进程的当前段，返回目录中所有的段（其中可能有别的进程正在写入的段）"""
+        with self.lock:
+            if sink in self.active:
+                self._close_segment(sink)
+            return self._segments(sink)
+
+    @staticmethod
+    def _claim(path):
+        """对段加非阻塞排他锁；段正被别的进程写入或回放、或已被回放删除时返回 None"""
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return None
+        # 拿到锁之前别的回放进程可能已经回放完并删除了这一段
+        if os.fstat(file.fileno()).st_nlink == 0:
+            file.close()
+            return None
+        return file
+
+    def _read(self, file):
+        for line in file:
+            # 最后一行可能因崩溃只写了一半，跳过
+            if line.endswith(b'\n'):
+                yield [_restore(doc) for doc in orjson.loads(line)]
+
+    async def _write(self, write, docs):
+        if inspect.iscoroutinefunction(write):
+            await write(docs)
+        else:
+            await asyncio.to_thread(write, docs)
+
+    def guard(self, sink, write):
+        """
+        包装写入端的写入函数，供流水线使用：缓冲中还有该写入端的段（包括别的进程写入的）时，
+        新批次也追加到缓冲并 fsync，由回放按顺序写入。否则回放会把较早的新增、编辑
+        覆盖到之后直接写入的结果上：已删除的消息重新出现，编辑被还原成编辑前的内容。
+        回放本身使用原始的写入函数。
+        """
+        async def guarded(docs):
+            if await asyncio.to_thread(self.pending, sink):
+                await self.append(sink, docs, sync=True)
+            else:
+                await self._write(write, docs)
+        return guarded
+
+    async def replay(self, sink, write, batch_size=None):
+        """
+        按顺序把写入端的所有段回放到 write，合并为 batch_size 条一批全速写入。
+        遇到别的进程正在写入或回放的段时停止，之后的段不能越过它先写入。
+        返回回放的文档数；write 出错时停止并抛出异常，未完成的段保留到下次。
+        """
+        batch_size = batch_size or config.BATCH_SIZE
+        segments = await asyncio.to_thread(self._rotate, sink)
+        total = 0
+        for path in segments:
+            file = await asyncio.to_thread(self._claim, path)
+            if file is None:
+                break
+            started = time.monotonic()
+            pending = []
+            count = 0
+            try:
+                for docs in self._read(file):
+                    pending.extend(docs)
+                    if len(pending) >= batch_size:
+                        await self._write(write, pending)
+                        count += len(pending)
+                        pending = []
+                if pending:
+                    await self._write(write, pending)
+                    count += len(pending)
+                # 持有锁时删除，别的进程不会再回放这一段
+                os.remove(path)
+            finally:
+                file.close()
+            total += count
+            self.replayed[sink] = self.replayed.get(sink, 0) + count
+            self.replay_seconds[sink] = self.replay_seconds.get(sink, 0.0) + time.monotonic() - started
+        return total
+
+    async def _replay_loop(self, sink, write, interval):
+        while True:
+            await asyncio.sleep(interval)
+            if not self.pending(sink):
+                continue
+            try:
+                count = await self.replay(sink, write)
+            except Exception as e:
+                logger.warning("回放 %s 缓冲失败，稍后重试: %s", sink, e)
+                continue
+            logger.info("已回放 %s 缓冲 %d 条，%s", sink, count, self.metrics()[sink])
+
+    def start_replayer(self, sinks, interval=None):
+        """
+        为每个写入端启动后台回放任务。
+        :param sinks: {名称: 写入函数}
+        """
+        interval = interval or config.SPOOL_REPLAY_INTERVAL
+        self.tasks = [asyncio.create_task(self._replay_loop(sink, write, interval)) for sink, write in sinks.items()]
+
+    async def close(self):
+        """停止后台回放并关闭当前段，未回放的批次留在磁盘上，下次启动时继续"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        for sink in list(self.active):
+            self._rotate(sink)
+
+    def pending(self, sink):
+        return bool(self._segments(sink))
+
+    def sinks(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory)
+                      if os.path.isdir(os.path.join(self.directory, name)))
+
+    def metrics(self):
+        """
+        每个写入端的缓冲状况：
+        segments / bytes 段数和总字节数，oldest_age 最早一段距今秒数，
+        replayed / replay_rate 本进程已回放的文档数和回放速度（条/秒）
+        """
+        now = time.time()
+        result = {}
+        for sink in self.sinks():
+            segments = self._segments(sink)
+            created = [int(os.path.basename(path).split('-')[1].split('.')[0]) for path in segments]
+            seconds = self.replay_seconds.get(sink, 0.0)
+            result[sink] = {
+                "segments": len(segments),
+                "bytes": sum(os.path.getsize(path) for path in segments),
+                "oldest_age": round(now - min(created)) if created else 0,
+                "replayed": self.replayed.get(sink, 0),
+                "replay_rate": round(self.replayed.get(sink, 0) / seconds, 1) if seconds else 0,
+            }
+        return result
@@ -0,0 +1,101 @@
+# suggest.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from core.config import config
+from core.es import chat_routing, get_es_client
+
+logger = logging.getLogger(__name__)
+
+# 联想结果只需要这几个字段，其余响应内容由 filter_path 在 ES 端裁掉
+_FILTER_PATH = [
+    "suggest.messages.options.text",
+    "suggest.messages.options._source",
+]
+
+
+def normalize_prefix(prefix):
+    """合并空白并转小写，同一前缀的不同写法共用缓存"""
+    return " ".join(prefix.split()).lower()
+
+
+class Suggester:
+    """
+    基于 suggest 补全字段（IK + 拼音）的输入联想。
+
+    热门前缀保存在进程内 LRU + TTL 缓存中，命中时不访问 ES；相同前缀的并发请求共用一次查询。
+    未命中时最多等待 ES budget 毫秒，超时先返回空结果，查询在后台继续并写入缓存，
+    用户继续输入或重试时即可命中。
+    """
+
+    def __init__(self, maxsize=None, ttl=None, budget_ms=None):
+        self.maxsize = maxsize or config.SUGGEST_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else config.SUGGEST_CACHE_TTL
+        self.budget = (budget_ms if budget_ms is not None else config.SUGGEST_BUDGET_MS) / 1000
+        self.cache = OrderedDict()
+        self.inflight = {}
+
+    async def _fetch(self, prefix, chat_ids, size):
+        completion = {"field": "suggest", "size": size, "skip_duplicates": True}
+        if chat_ids:
+            completion["contexts"] = {"chat_id": list(chat_ids)}
+        response = await get_es_client().search(
+            index=config.ES_READ_ALIAS,
+            size=0,
+            suggest={"messages": {"prefix": prefix, "completion": completion}},
+            source=["chat_id", "message_id", "message_link"],
+            routing=chat_routing(chat_ids) if chat_ids else None,
+            filter_path=_FILTER_PATH,
+        )
+        suggestions = response.get("suggest", {}).get("messages", [{}])
+        return [
+            {"text": option["text"], **option.get("_source", {})}
+            for option in (suggestions[0].get("options", []) if suggestions else [])
+        ]
+
+    @staticmethod
+    def _done(task):
+        # 超时后没有人等待的后台查询，出错时在这里取出异常并记录
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("联想查询失败: %s", task.exception())
+
+    def _store(self, key, suggestions):
+        self.cache[key] = (time.monotonic() + self.ttl, suggestions)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+
+    async def _load(self, key, prefix, chat_ids, size):
+        try:
+            suggestions = await self._fetch(prefix, chat_ids, size)
+            self._store(key, suggestions)
+            return suggestions
+        finally:
+            self.inflight.pop(key, None)
+
+    async def suggest(self, prefix, chat_ids=None, size=None):
+        """返回 (联想结果, 是否命中缓存)；超出时间预算或 ES 出错时结果为空列表"""
+        prefix = normalize_prefix(prefix)
+        chat_ids = tuple(sorted(set(chat_ids or ())))
+        size = size or config.SUGGEST_MAX_SIZE
+        key = (prefix, chat_ids, size)
+
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.cache.move_to_end(key)
+            return entry[1], True
+
+        task = self.inflight.get(key)
+        if task is None:
+            task = self.inflight[key] = asyncio.create_task(self._load(key, prefix, chat_ids, size))
+            task.add_done_callback(self._done)
+        try:
+            # shield：超时只是不再等待，查询本身继续完成并写入缓存
+            return await asyncio.wait_for(asyncio.shield(task), self.budget), False
+        except asyncio.TimeoutError:
+            return [], False
+        except Exception:
+            # 联想只是辅助功能，ES 出错时返回空结果而不是让输入框报错
+            return [], False
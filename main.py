@@ -1,12 +1,31 @@
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
-from core.config import PORT, HOST
 
-app = FastAPI()
+from controller.search import router as search_router, search_cache
+from controller.stats import router as stats_router
+from controller.suggest import router as suggest_router
+from core.config import config
+from core.es import close_es_client
+from core.mysql import close_mysql_pool
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    # 共享的 ES 客户端、MySQL 连接池和缓存的 Redis 连接绑定在服务的事件循环上
+    await search_cache.close()
+    await close_es_client()
+    await close_mysql_pool()
+
 
+app = FastAPI(lifespan=lifespan)
+app.include_router(search_router)
+app.include_router(suggest_router)
+app.include_router(stats_router)
 
 
 if __name__ == "__main__":
- 
-    uvicorn.run("main:app", host=HOST, port=int(PORT), reload=True)
 
+    uvicorn.run("main:app", host=config.HOST, port=config.PORT, reload=True)
@@ -1,110 +1,123 @@
 import asyncio
-import os
 import json
+from contextlib import nullcontext
 from datetime import datetime
 
-from telethon import TelegramClient
-from telethon.tl.types import Message
+from celery import chord
 from celery.utils.log import get_task_logger
 import redis
 
+from core.batcher import AdaptiveBatcher
 from core.celery_app import celery_app
-from services.database import get_async_session, Channel, Message as MessageModel
-from services.elasticsearch import get_es_client, bulk_index_messages
-
-# 从环境变量加载配置
-SESSION_NAME = "telegram_scraper_session"
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+from core.checkpoint import create_checkpoint_table, get_checkpoint, save_checkpoint
+from core.config import config
+from core.es import close_es_client, save_to_es
+from core.es_bulk import BulkLoadMode
+from core.es_index import setup_indices
+from core.mysql import close_mysql_pool, create_channel_table, create_message_table, ensure_channel, save_to_mysql
+from core.schema import MessageRecord, chat_id_of, is_stored_message
+from core.session_pool import SessionPool
+from core.sharding import ShardRegistry, probe_density, split_by_density
 
 # 初始化 Redis 客户端用于进度更新
-redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+redis_client = redis.from_url(config.REDIS_URL, decode_responses=True)
 logger = get_task_logger(__name__)
 
-         # 定义 Celery 任务
-         @ celery_app.task(bind=True)
+
+def message_size(msg):
+    """估算一条 Telethon 消息写入后的字节数，避免为估算而序列化整条消息"""
+    return len((msg.text or '').encode('utf-8')) + 512
 
 
-def scrape_telegram_channel(self, channel_id: int, start_message_id: int, end_message_id: int):
+# 定义 Celery 任务
+@celery_app.task(bind=True)
+def scrape_telegram_channel(self, channel_id: int, start_message_id: int, end_message_id: int, resume: bool = False,
+                            bulk_load: bool = False):
     """
     Celery task to scrape messages from a Telegram channel.
+    With resume=True, messages up to the chat's stored checkpoint are skipped.
+    With bulk_load=True, the ES index is kept in bulk load mode while the task runs.
     """
     task_id = self.request.id
     progress_key = f"task_progress:{task_id}"
 
     async def main():
-        # 初始化 Telethon 客户端
-        client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
-        await client.start()
-        logger.info(f"Task {task_id}: Telethon client started.")
+        progress_data = {"status": "STARTING"}
 
-        try:
-            # 获取频道实体
-            entity = await client.get_entity(channel_id)
-            logger.info(f"Task {task_id}: Found entity '{entity.title}' for ID {channel_id}.")
-
-            # 处理特殊的 message_id
-            min_id = start_message_id if start_message_id > 0 else 0
-            # 如果 end_message_id < 0，则 max_id 应该为 0，iter_messages 会抓取到最新
-            max_id = end_message_id if end_message_id > 0 else 0
-
-            # 如果是抓取到最后，先获取第一条消息的 ID 作为总数参考
-            # 注意：这只是一个估算，因为消息可能被删除
-            total_messages_estimate = 0
-            if max_id == 0:
-                try:
-                    latest_msg = await client.get_messages(entity, limit=1)
-                    if latest_msg:
-                        total_messages_estimate = latest_msg.id - min_id
-                except Exception:
-                    pass  # 可能频道为空
-
-            # 初始化进度
-            progress_data = {
-                "status": "STARTING",
-                "current": 0,
-                "total": total_messages_estimate if total_messages_estimate > 0 else "Calculating...",
-                "channel_title": entity.title
-            }
+        def on_wait(method, seconds):
+            # FloodWait 期间把等待状态写入进度，便于观察任务为何停顿
+            progress_data.update({"status": "FLOOD_WAIT", "scheduler": client.state()})
             redis_client.set(progress_key, json.dumps(progress_data))
+            logger.warning(f"Task {task_id}: FloodWait on {method}, sleeping {seconds}s.")
 
-            message_batch =
-            count = 0
-            BATCH_SIZE = 100
+        # 从会话池租用一个账号，所有请求经由调度器发出
+        session_pool = SessionPool()
+        bulk_mode = BulkLoadMode()
+        try:
+            async with session_pool.lease(on_wait=on_wait) as client:
+                logger.info(f"Task {task_id}: Telethon session '{client.session_name}' started.")
 
-            # 使用 iter_messages 进行异步迭代
-            async for message in client.iter_messages(
-                    entity,
-                    limit=None,  # 不限制总数
-                    min_id=min_id,
-                    max_id=max_id,
-                    reverse=True  # 从旧到新遍历
-            ):
-                if not isinstance(message, Message) or not message.text:
-                    continue
+                # 获取频道实体
+                entity = await client.get_entity(channel_id)
+                # 与命令行相同，数据和断点都记在实体的 peer id 下
+                chat_id = chat_id_of(entity)
+                logger.info(f"Task {task_id}: Found entity '{entity.title}' ({chat_id}) for ID {channel_id}.")
+                await create_channel_table()
+                await create_checkpoint_table()
+                await create_message_table()
+                await setup_indices()
 
-                message_batch.append(message)
-                count += 1
+                # 处理特殊的 message_id
+                min_id = start_message_id if start_message_id > 0 else 0
+                # 如果 end_message_id < 0，则 max_id 应该为 0，iter_messages 会抓取到最新
+                max_id = end_message_id if end_message_id > 0 else 0
 
-                if len(message_batch) >= BATCH_SIZE:
-                    await process_batch(message_batch, entity)
-                    message_batch.clear()
+                # 从断点继续：跳过已经同时写入 ES 和 MySQL 的消息
+                if resume:
+                    checkpoint = await get_checkpoint(chat_id)
+                    if checkpoint is not None and checkpoint > min_id:
+                        logger.info(f"Task {task_id}: Resuming from checkpoint {checkpoint}.")
+                        min_id = checkpoint
 
+                # 如果是抓取到最后，先获取第一条消息的 ID 作为总数参考
+                # 注意：这只是一个估算，因为消息可能被删除
+                total_messages_estimate = 0
+                if max_id == 0:
+                    try:
+                        latest_msg = await client.get_messages(entity, limit=1)
+                        if latest_msg:
+                            total_messages_estimate = latest_msg.id - min_id
+                    except Exception:
+                        pass  # 可能频道为空
+
+                # 初始化进度
+                progress_data.update({
+                    "status": "STARTING",
+                    "current": 0,
+                    "total": total_messages_estimate if total_messages_estimate > 0 else "Calculating...",
+                    "channel_title": entity.title
+                })
+                redis_client.set(progress_key, json.dumps(progress_data))
+
+                def on_flush(batch_size, last_id):
                     # 更新进度
-                    progress_data.update({"status": "RUNNING", "current": count})
+                    progress_data.update({
+                        "status": "RUNNING",
+                        "current": progress_data["current"] + batch_size,
+                        "scheduler": client.state(),
+                    })
                     redis_client.set(progress_key, json.dumps(progress_data))
-                    logger.info(f"Task {task_id}: Processed batch of {BATCH_SIZE}. Total processed: {count}")
+                    logger.info(f"Task {task_id}: Processed batch of {batch_size}. Total processed: {progress_data['current']}")
 
-            # 处理最后一批不足 BATCH_SIZE 的消息
-            if message_batch:
-                await process_batch(message_batch, entity)
-                logger.info(f"Task {task_id}: Processed final batch of {len(message_batch)}. Total processed: {count}")
+                async with bulk_mode.hold(task_id) if bulk_load else nullcontext():
+                    count = await scrape_range(client, entity, chat_id, min_id, max_id, on_flush)
 
-            # 任务完成
-            final_status = f"SUCCESS: Scraped a total of {count} messages from '{entity.title}'."
-            progress_data.update({"status": "SUCCESS", "current": count, "total": count, "details": final_status})
-            redis_client.set(progress_key, json.dumps(progress_data), ex=3600)  # 缓存1小时
-            logger.info(f"Task {task_id}: {final_status}")
-            return final_status
+                # 任务完成
+                final_status = f"SUCCESS: Scraped a total of {count} messages from '{entity.title}'."
+                progress_data.update({"status": "SUCCESS", "current": count, "total": count, "details": final_status})
+                redis_client.set(progress_key, json.dumps(progress_data), ex=3600)  # 缓存1小时
+                logger.info(f"Task {task_id}: {final_status}")
+                return final_status
 
         except Exception as e:
             error_message = f"FAILURE: An error occurred: {str(e)}"
@@ -115,68 +128,232 @@ def scrape_telegram_channel(self, channel_id: int, start_message_id: int, end_me
             raise
 
         finally:
-            if client.is_connected():
-                await client.disconnect()
-            logger.info(f"Task {task_id}: Telethon client disconnected.")
+            logger.info(f"Task {task_id}: Telethon session released.")
+            # 写入端的连接池绑定在本次 asyncio.run 的事件循环上，必须随之关闭
+            await close_es_client()
+            await close_mysql_pool()
+            await session_pool.close()
+            await bulk_mode.close()
 
     # 在 Celery 任务中运行异步代码
     return asyncio.run(main())
 
 
-async def process_batch(batch: list, entity):
+@celery_app.task(bind=True)
+def scrape_telegram_channel_sharded(self, channel_id: int, start_message_id: int, end_message_id: int, shards: int = None,
+                                    bulk_load: bool = False):
+    """
+    Coordinator for large backfills: splits the range into sub-ranges of roughly equal
+    message count (measured by sampling density) and fans them out as a chord of
+    scrape_channel_shard tasks. Progress is aggregated under this task's task_progress: key.
+    With bulk_load=True the ES index enters bulk load mode under this task's id; the shards
+    keep that lease alive and the chord callback restores the index settings.
+    """
+    parent_id = self.request.id
+    progress_key = f"task_progress:{parent_id}"
+    shards = shards or config.SCRAPE_SHARDS
+
+    async def plan():
+        session_pool = SessionPool()
+        bulk_mode = BulkLoadMode()
+        try:
+            # 分片任务直接写入，表结构在分发前准备好
+            await create_channel_table()
+            await create_checkpoint_table()
+            await create_message_table()
+            await setup_indices()
+            async with session_pool.lease() as client:
+                entity = await client.get_entity(channel_id)
+                lo = start_message_id if start_message_id > 0 else 0
+                if end_message_id > 0:
+                    hi = end_message_id - 1
+                else:
+                    latest = await client.get_messages(entity, limit=1)
+                    hi = latest[0].id if latest else lo
+                samples = await probe_density(client, entity, lo, hi, shards * config.SCRAPE_PROBES_PER_SHARD)
+            if bulk_load:
+                await bulk_mode.enter(parent_id)
+            return entity.title, chat_id_of(entity), lo, hi, samples
+        finally:
+            await close_es_client()
+            await close_mysql_pool()
+            await session_pool.close()
+            await bulk_mode.close()
+
+    title, chat_id, lo, hi, samples = asyncio.run(plan())
+    ranges = split_by_density(lo, hi, samples, shards)
+    estimate = int(sum(density * (b - a) for a, b, density in samples))
+    logger.info(f"Task {parent_id}: Split ({lo}, {hi}] of '{title}' into {len(ranges)} shards, ~{estimate} messages.")
+
+    registry = ShardRegistry(redis_client, parent_id)
+    shard_ids = [registry.add(a, b) for a, b in ranges]
+    progress_data = {
+        "status": "STARTING",
+        "current": 0,
+        "total": estimate,
+        "channel_title": title,
+        "shards": len(shard_ids),
+        "shards_done": 0,
+    }
+    redis_client.set(progress_key, json.dumps(progress_data))
+
+    chord(
+        scrape_channel_shard.s(channel_id, parent_id, shard_id, bulk_load) for shard_id in shard_ids
+    )(finish_sharded_scrape.s(chat_id, parent_id, hi, bulk_load))
+    return {"shards": len(shard_ids), "range": [lo, hi], "estimate": estimate}
+
+
+@celery_app.task(bind=True)
+def scrape_channel_shard(self, channel_id: int, parent_id: str, shard_id: int, bulk_load: bool = False):
+    """
+    Scrape one shard registered by scrape_telegram_channel_sharded. When it is done,
+    the worker steals the second half of the slowest remaining shard and keeps going,
+    so stragglers are re-split dynamically. Returns the number of messages written.
+    """
+    registry = ShardRegistry(redis_client, parent_id)
+    progress_key = f"task_progress:{parent_id}"
+
+    async def main():
+        current = shard_id
+
+        def on_wait(method, seconds):
+            update_shard_progress(progress_key, registry, current, client.state(), status="FLOOD_WAIT")
+
+        session_pool = SessionPool()
+        bulk_mode = BulkLoadMode()
+        try:
+            async with session_pool.lease(on_wait=on_wait) as client, \
+                    bulk_mode.renewing(parent_id) if bulk_load else nullcontext():
+                entity = await client.get_entity(channel_id)
+                chat_id = chat_id_of(entity)
+                count = 0
+                while current is not None:
+                    shard = registry.get(current)
+
+                    def on_flush(batch_size, last_id, shard_id=current):
+                        hi = registry.advance(shard_id, last_id, batch_size)
+                        update_shard_progress(progress_key, registry, shard_id, client.state())
+                        return hi + 1
+
+                    count += await scrape_range(
+                        client, entity, chat_id, shard["lo"], shard["hi"] + 1, on_flush, checkpoint=False
+                    )
+                    registry.finish(current)
+                    update_shard_progress(progress_key, registry, current, client.state())
+                    logger.info(f"Task {parent_id}: Shard {current} ({shard['lo']}, {shard['hi']}] finished.")
+                    current = registry.steal()
+                return count
+        finally:
+            await close_es_client()
+            await close_mysql_pool()
+            await session_pool.close()
+            await bulk_mode.close()
+
+    return asyncio.run(main())
+
+
+@celery_app.task
+def finish_sharded_scrape(results, chat_id: str, parent_id: str, hi: int, bulk_load: bool = False):
+    """
+    Chord callback: all shards succeeded, so the whole range is committed to both sinks.
+    chat_id is the canonical chat_id_of(entity) resolved by the coordinator.
+    """
+    async def main():
+        bulk_mode = BulkLoadMode()
+        try:
+            await create_checkpoint_table()
+            await save_checkpoint(chat_id, hi)
+            if bulk_load:
+                await bulk_mode.exit(parent_id)
+        finally:
+            await close_es_client()
+            await close_mysql_pool()
+            await bulk_mode.close()
+
+    asyncio.run(main())
+    count = sum(results)
+    registry = ShardRegistry(redis_client, parent_id)
+    progress_key = f"task_progress:{parent_id}"
+    progress_data = json.loads(redis_client.get(progress_key) or "{}")
+    progress_data.update(registry.progress())
+    final_status = f"SUCCESS: Scraped a total of {count} messages in {progress_data['shards']} shards."
+    progress_data.update({"status": "SUCCESS", "current": count, "total": count, "details": final_status})
+    redis_client.set(progress_key, json.dumps(progress_data), ex=3600)
+    registry.clear()
+    logger.info(f"Task {parent_id}: {final_status}")
+    return final_status
+
+
+def update_shard_progress(progress_key: str, registry: ShardRegistry, shard_id: int,
+                          scheduler_state: dict, status: str = "RUNNING"):
+    """Merge the shards' aggregated progress and one shard's request scheduler state into the parent's payload."""
+    progress_data = json.loads(redis_client.get(progress_key) or "{}")
+    progress_data.update(registry.progress())
+    progress_data.setdefault("scheduler", {})[str(shard_id)] = scheduler_state
+    progress_data["status"] = status
+    redis_client.set(progress_key, json.dumps(progress_data))
+
+
+async def scrape_range(client, entity, chat_id: str, min_id: int, max_id: int, on_flush, checkpoint: bool = True):
+    """
+    Scrape messages with min_id < id < max_id (max_id=0 means up to the latest) in adaptive batches.
+    After each batch on_flush(batch_size, last_message_id) is called; if it returns a value,
+    that becomes the new exclusive upper bound, which lets a re-split shard stop early.
+    Returns the number of messages written.
+    """
+    # 按文档数 / 字节数 / 等待时间攒批，批量大小根据写入耗时自适应
+    batcher = AdaptiveBatcher(sizeof=message_size)
+    count = 0
+    limit_id = max_id
+
+    async def write(batch):
+        await process_batch(batch, entity, chat_id, checkpoint=checkpoint)
+
+    async def flush():
+        nonlocal count, limit_id
+        last_id = batcher.items[-1].id
+        batch_size = await batcher.flush(write)
+        count += batch_size
+        new_limit = on_flush(batch_size, last_id)
+        if new_limit:
+            limit_id = new_limit
+
+    # 使用 iter_messages 进行异步迭代
+    async for message in client.iter_messages(
+            entity,
+            limit=None,  # 不限制总数
+            min_id=min_id,
+            max_id=max_id,
+            reverse=True  # 从旧到新遍历
+    ):
+        if limit_id and message.id >= limit_id:
+            break
+        # 与命令行、实时订阅相同的过滤，只有媒体没有文字的消息同样保存
+        if not is_stored_message(message):
+            continue
+
+        if batcher.add(message):
+            await flush()
+
+    # 处理最后一批未触发刷新的消息
+    if len(batcher):
+        await flush()
+    return count
+
+
+async def process_batch(batch: list, entity, chat_id: str, checkpoint: bool = True):
     """
     Asynchronously process a batch of messages: save to MySQL and index in Elasticsearch.
     """
-    # 1. 准备数据
-    db_messages =
-    es_messages =
-
-    for msg in batch:
-        msg_data = {
-            "id": msg.id,
-            "channel_id": entity.id,
-            "message_text": msg.text,
-            "sender_id": msg.sender_id,
-            "reply_to_msg_id": msg.reply_to.reply_to_msg_id if msg.reply_to else None,
-            "date": msg.date,
-            "views": msg.views,
-            "raw_message_json": msg.to_json()
-        }
-        db_messages.append(msg_data)
-
-        es_doc = {
-            "message_id": msg.id,
-            "channel_id": entity.id,
-            "message_text": msg.text,
-            "sender_id": msg.sender_id,
-            "reply_to_msg_id": msg.reply_to.reply_to_msg_id if msg.reply_to else None,
-            "date": msg.date.isoformat(),
-            "views": msg.views
-        }
-        es_messages.append(es_doc)
-
-    # 2. 异步批量写入数据库和 ES
-    async with get_async_session() as db_session, get_es_client() as es_client:
-        # 写入 MySQL
-        async with db_session.begin():
-            # 先确保 channel 存在
-            channel_obj = await db_session.get(Channel, entity.id)
-            if not channel_obj:
-                channel_obj = Channel(
-                    id=entity.id,
-                    title=entity.title,
-                    username=getattr(entity, 'username', None),
-                    description=getattr(entity, 'about', None),
-                    participants_count=getattr(entity, 'participants_count', None)
-                )
-                db_session.add(channel_obj)
-
-            # 批量插入消息
-            await db_session.execute(
-                MessageModel.__table__.insert().prefix_with("IGNORE"),
-                db_messages
-            )
-            await db_session.commit()
-
-        # 索引到 Elasticsearch
-        await bulk_index_messages(es_client, "telegram_messages", es_messages)
\ No newline at end of file
+    # 1. 准备数据（与 CLI 相同的 MessageRecord 结构和 chat_id）
+    docs = MessageRecord.from_messages(batch, chat_id, getattr(entity, 'username', None))
+
+    # 2. 先确保 channel 存在
+    await ensure_channel(entity)
+
+    # 3. 并发写入 MySQL 和 Elasticsearch，两者使用各自的连接池
+    await asyncio.gather(save_to_mysql(docs), save_to_es(docs))
+
+    # 4. 两端都写入成功后才推进断点（分片抓取时由汇总任务统一推进）
+    if checkpoint:
+        await save_checkpoint(chat_id, batch[-1].id)